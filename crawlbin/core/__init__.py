@@ -0,0 +1,24 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+crawlbin's directive semantics, without Django.
+
+The URL parser, user agent classification and directive registry don't
+need Django, Keen or the network, so they live here, where crawler test
+suites can use them in-process to work out what crawlbin would send for
+any number of URLs:
+
+    >>> from crawlbin.core import evaluate
+    >>> evaluate('/[response_404]/', 'Googlebot/2.1').status_code
+    404
+
+Nothing in this package may import Django.
+
+"""
+
+from crawlbin.core.page import evaluate
+from crawlbin.core.page import evaluate_plan
+from crawlbin.core.page import split_path
@@ -0,0 +1,185 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Small in-process caches used on the request path.
+
+Everything crawlbin caches (compiled URL plans, user agent categories,
+rendered responses) is keyed on a handful of strings that a crawler
+fleet repeats over and over, so a bounded least-recently-used cache is
+all we need. Each can be backed by a cache shared between worker
+processes (see crawlbin.core.shared_cache), so that what one worker
+builds the others find.
+
+"""
+
+import logging
+import threading
+
+from collections import OrderedDict
+
+logger = logging.getLogger('crawlbin.core.cache')
+
+
+class LRUCache(object):
+    """A bounded, thread-safe least-recently-used cache.
+
+    max_size caps the number of entries. If max_bytes is given the total
+    sizeof() of the cached values is capped too, and values larger than
+    max_bytes on their own aren't cached at all.
+
+    Hits, misses and evictions are counted so they can be reported
+    alongside the other request stats.
+
+    shared, if set, is a cache with the same interface, such as a
+    SharedCache, that misses are looked up in and new entries written
+    to. Entries found there are kept in this cache too.
+
+    """
+
+    def __init__(self, max_size=1024, max_bytes=None, sizeof=len, shared=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.shared = shared
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """Return the cached value for key, marking it as most recently
+        used, or default if it isn't cached.
+
+        """
+
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                pass
+            else:
+                self._data[key] = value
+                self.hits += 1
+                return value
+
+        if self.shared is not None:
+            value = self.shared.get(key, _MISSING)
+            if value is not _MISSING:
+                self._store(key, value)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used
+        entries if the cache is full.
+
+        """
+
+        self._store(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def get_or_create(self, key, factory):
+        """Return the cached value for key, building it with
+        factory(key) and caching it on a miss.
+
+        Exceptions raised by factory are not cached.
+
+        """
+
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory(key)
+            self.set(key, value)
+        return value
+
+    def resize(self, max_size):
+        """Change the maximum number of entries, evicting if needed."""
+
+        with self._lock:
+            self.max_size = max_size
+            self._evict(max(max_size, 0))
+
+    def clear(self):
+        """Drop every entry and reset the counters. The shared cache
+        is left alone.
+
+        """
+
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """Return a dictionary of the cache counters."""
+
+        stats = {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+        if self.max_bytes is not None:
+            stats['bytes'] = self.bytes
+            stats['max_bytes'] = self.max_bytes
+
+        if self.shared is not None:
+            for key, value in self.shared.stats().items():
+                stats['shared_' + key] = value
+
+        return stats
+
+    def _store(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        size = 0
+        if self.max_bytes is not None:
+            size = self.sizeof(value)
+            if size > self.max_bytes:
+                return
+
+        with self._lock:
+            self._remove(key)
+            self._data[key] = value
+
+            if self.max_bytes is not None:
+                self._sizes[key] = size
+                self.bytes += size
+
+            self._evict(self.max_size)
+
+    def _remove(self, key):
+        if self._data.pop(key, _MISSING) is not _MISSING:
+            self.bytes -= self._sizes.pop(key, 0)
+
+    def _evict(self, max_size):
+        while len(self._data) > max_size or (
+                self.max_bytes is not None and self.bytes > self.max_bytes):
+            key, value = self._data.popitem(last=False)
+            self.bytes -= self._sizes.pop(key, 0)
+            self.evictions += 1
+
+
+_MISSING = object()
@@ -0,0 +1,133 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Content encodings.
+
+Pages are sent with the best encoding the client accepts out of brotli
+(if the brotli package is installed), gzip and deflate. The encoding
+directives can also force an encoding, claim one without applying it
+(lie) or apply it twice (double), to test how crawlers decode responses.
+
+"""
+
+import logging
+import zlib
+
+from collections import OrderedDict
+
+from crawlbin.core.cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger('crawlbin.core.compression')
+
+COMPRESSION_LEVEL = 6
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_stream(chunks, level=COMPRESSION_LEVEL):
+    """Gzip an iterable of byte strings, yielding the compressed data as
+    it is produced, so the whole of it is never held in memory.
+
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _deflate(data):
+    # HTTP's deflate is the zlib format, not a raw deflate stream.
+    return zlib.compress(data, COMPRESSION_LEVEL)
+
+
+# The supported encodings, most preferred first.
+ENCODERS = OrderedDict()
+if brotli is not None:
+    ENCODERS['br'] = brotli.compress
+ENCODERS['gzip'] = _gzip
+ENCODERS['deflate'] = _deflate
+
+_ALIASES = {'x-gzip': 'gzip'}
+
+# Accept-Encoding headers come from a handful of crawlers and browsers.
+negotiation_cache = LRUCache(max_size=1024)
+
+
+def _negotiate(accept_encoding):
+    qualities = {}
+
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        qualities[_ALIASES.get(coding, coding)] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODERS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+
+    return best
+
+
+def negotiate(accept_encoding):
+    """Return the best encoding for an Accept-Encoding header, or None
+    if the response should be sent as is.
+
+    """
+
+    if not accept_encoding:
+        return None
+
+    return negotiation_cache.get_or_create(accept_encoding, _negotiate)
+
+
+def encode(content, encoding, mode='normal'):
+    """Return content as it should be sent with a Content-Encoding of
+    encoding. mode is 'normal', 'lie' to send content as is anyway, or
+    'double' to encode it twice.
+
+    """
+
+    if mode == 'lie':
+        return content
+
+    body = ENCODERS[encoding](content)
+    if mode == 'double':
+        body = ENCODERS[encoding](body)
+    return body
+
+
+def encoded_etag(etag, encoding):
+    """Return the ETag for the encoding of the page with etag. Each
+    encoding is a different representation, so needs its own.
+
+    """
+
+    return '%s-%s"' % (etag[:-1], encoding)
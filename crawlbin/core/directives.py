@@ -0,0 +1,694 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Every directive crawlbin supports is registered here, along with the
+category it belongs to and a handler that applies it.
+
+evaluate_directives() looks each directive in a URL up in the registry
+and runs the handlers in a single pass, building one context and one
+set of headers. The cost therefore depends on the number of directives
+in the URL rather than the number crawlbin supports.
+
+Handlers run in registration order, which decides what wins when two
+directives disagree. For example response_404 is registered after
+response_301, so it is the 404 that gets sent for both.
+
+The older per-category helpers (h1_directive, handle_redirect, ...) are
+kept, and evaluate just their own category.
+
+"""
+
+import itertools
+import logging
+import random
+import re
+
+from collections import namedtuple
+
+from crawlbin.core.compression import ENCODERS
+from crawlbin.core.graph import DEFAULT_LINKS
+from crawlbin.core.graph import LINK_KINDS
+from crawlbin.core.graph import MAX_LINKS
+from crawlbin.core.graph import outlinks
+
+logger = logging.getLogger('crawlbin.core.directives')
+
+# Longest delay a delay_ms_<n> directive can ask for.
+MAX_DELAY_MS = 60000
+
+# Largest body a size_<n>kb or size_<n>mb directive can ask for.
+MAX_SIZE_BYTES = 1024 * 1024 * 1024
+
+
+class Directive(namedtuple('Directive', ['name', 'category', 'priority', 'handler',
+                                         'is_random'])):
+    """A registered directive. name is a regular expression for
+    directives registered with a pattern. is_random is set for
+    directives that make a response different every time.
+
+    """
+
+    __slots__ = ()
+
+
+class Category(object):
+    """A group of related directives.
+
+    defaults are the context variables every response gets, whether or
+    not any of the category's directives are used. finish, if given, is
+    called once after all the category's handlers have run.
+
+    """
+
+    def __init__(self, name, defaults=None, finish=None):
+        self.name = name
+        self.defaults = defaults or {}
+        self.finish = finish
+
+
+class Evaluation(object):
+    """The state built up while evaluating a request's directives.
+
+    base_url, current_url and next_block_url are the URLs the canonical
+    and redirect directives point at.
+
+    """
+
+    def __init__(self, base_url='', current_url='', next_block_url='', rng=random):
+        self.base_url = base_url
+        self.current_url = current_url
+        self.next_block_url = next_block_url
+        # What random directives make their choices with: the random
+        # module, or a seeded random.Random for seeded requests.
+        self.rng = rng
+
+        self.context = {}
+        self.headers = {}
+        self.status_code = 200
+        self.unknown = []
+        self.is_random = False
+
+        # Values collected by handlers for a category's finish() to
+        # combine, e.g. the individual Vary header values.
+        self.collected = {}
+
+    def collect(self, key, value):
+        values = self.collected.setdefault(key, [])
+        if value not in values:
+            values.append(value)
+
+
+CATEGORIES = {}
+DIRECTIVES = {}
+DIRECTIVE_PATTERNS = []
+
+_CONTEXT_DEFAULTS = {}
+
+_priorities = itertools.count()
+
+
+def register_category(name, defaults=None, finish=None):
+    CATEGORIES[name] = Category(name, defaults, finish)
+    _CONTEXT_DEFAULTS.update(CATEGORIES[name].defaults)
+
+
+def register(name, category, handler, pattern=False, is_random=False):
+    """Register handler for the directive name in category.
+
+    handler is called as handler(evaluation, match), where match is the
+    regular expression match for directives registered with pattern set
+    and None otherwise. Set is_random if the directive introduces
+    randomness, so that responses using it are never cached.
+
+    """
+
+    directive = Directive(name, category, next(_priorities), handler, is_random)
+
+    if pattern:
+        DIRECTIVE_PATTERNS.append((re.compile('^' + name + '$'), directive))
+    else:
+        DIRECTIVES[name] = directive
+
+
+def lookup_directive(name):
+    """Return the registered Directive and pattern match for name, or
+    (None, None) if crawlbin doesn't know it.
+
+    """
+
+    directive = DIRECTIVES.get(name)
+    if directive is not None:
+        return directive, None
+
+    for regex, directive in DIRECTIVE_PATTERNS:
+        match = regex.match(name)
+        if match:
+            return directive, match
+
+    return None, None
+
+
+def evaluate_directives(directives, base_url='', current_url='', next_block_url='',
+                        categories=None, rng=None):
+    """Apply every directive in the list directives and return the
+    Evaluation.
+
+    Directives crawlbin doesn't recognise are listed, in URL order, in
+    the evaluation's unknown attribute. If categories is given only
+    directives in those categories are applied and only those
+    categories' defaults are set. Random directives choose with rng,
+    if given, and with the random module otherwise.
+
+    """
+
+    evaluation = Evaluation(base_url, current_url, next_block_url, rng or random)
+
+    if categories is None:
+        evaluation.context.update(_CONTEXT_DEFAULTS)
+    else:
+        for category in categories:
+            evaluation.context.update(CATEGORIES[category].defaults)
+
+    resolved = []
+    for name in frozenset(directives):
+        directive, match = lookup_directive(name)
+
+        if directive is None:
+            if name:
+                evaluation.unknown.append(name)
+        elif categories is None or directive.category in categories:
+            resolved.append((directive.priority, directive, match))
+
+    resolved.sort(key=lambda entry: entry[0])
+
+    finished = []
+    for priority, directive, match in resolved:
+        directive.handler(evaluation, match)
+        evaluation.is_random = evaluation.is_random or directive.is_random
+
+        category = CATEGORIES[directive.category]
+        if category.finish is not None and category not in finished:
+            finished.append(category)
+
+    for category in finished:
+        category.finish(evaluation)
+
+    if evaluation.unknown:
+        evaluation.unknown.sort(key=list(directives).index)
+        logger.info('Unknown directives: %s', ', '.join(evaluation.unknown))
+
+    return evaluation
+
+
+def _evaluate_category(category, directives, *args, **kwargs):
+    return evaluate_directives(directives, *args, categories=(category,), **kwargs)
+
+
+# Responses
+
+def _status(status_code, location=False):
+    def handler(evaluation, match):
+        evaluation.status_code = status_code
+        if location:
+            evaluation.headers['Location'] = evaluation.next_block_url
+    return handler
+
+
+def _unauthorized(evaluation, match):
+    evaluation.status_code = 401
+    evaluation.headers['WWW-Authenticate'] = 'Basic realm="crawlbin:"'
+
+
+register_category('response')
+
+for status_code in (301, 302, 303, 307, 308):
+    register('response_%d' % status_code, 'response', _status(status_code, location=True))
+
+# The view sends a 304 without a body.
+register('response_304', 'response', _status(304))
+register('response_400', 'response', _status(400))
+register('response_401', 'response', _unauthorized)
+for status_code in (403, 404, 410, 418, 500, 503):
+    register('response_%d' % status_code, 'response', _status(status_code))
+
+
+# H1
+
+def _context(key, value):
+    def handler(evaluation, match):
+        evaluation.context[key] = value
+    return handler
+
+
+def _ignore(evaluation, match):
+    pass
+
+
+register_category('h1', defaults={'h1': ''})
+
+register('h1_on', 'h1', _ignore)
+register('h1_multiple', 'h1', _context('h1', 'multiple'))
+# Registered last so that it wins over h1_multiple.
+register('h1_off', 'h1', _context('h1', 'off'))
+
+
+# Title
+
+def _random_title(evaluation, match):
+    evaluation.context['title'] = evaluation.rng.choice(['Crawlbin', 'Crawlbin Alternative'])
+
+
+register_category('title', defaults={'title': 'Crawlbin'})
+
+register('random_title', 'title', _random_title, is_random=True)
+
+
+# Index / follow
+
+def _meta_robots(value):
+    def handler(evaluation, match):
+        evaluation.context['meta_' + value] = True
+        evaluation.collect('meta_robots', value)
+    return handler
+
+
+def _header_robots(value):
+    def handler(evaluation, match):
+        evaluation.collect('header_robots', value)
+    return handler
+
+
+def _finish_index_follow(evaluation):
+    meta_robots = evaluation.collected.get('meta_robots')
+    if meta_robots:
+        evaluation.context['meta_follow_index_string'] = ', '.join(meta_robots)
+
+    header_robots = evaluation.collected.get('header_robots')
+    if header_robots:
+        evaluation.headers['X-Robots-Tag'] = ','.join(header_robots)
+
+
+register_category('index_follow', defaults={
+    'meta_follow_index_string': '',
+    'meta_follow': False,
+    'meta_nofollow': False,
+    'meta_index': False,
+    'meta_noindex': False,
+}, finish=_finish_index_follow)
+
+for value in ('follow', 'nofollow', 'index', 'noindex'):
+    register('meta_' + value, 'index_follow', _meta_robots(value))
+
+for value in ('noindex', 'index', 'nofollow', 'follow'):
+    register('header_' + value, 'index_follow', _header_robots(value))
+
+
+# Canonicals
+
+def _canonical_url(evaluation, target):
+    if target == 'next_block':
+        return evaluation.next_block_url
+    if target == 'random':
+        return get_random_url(evaluation.base_url, evaluation.rng)
+    if target == 'self':
+        return evaluation.current_url
+    return evaluation.base_url
+
+
+def _canonical(target, html, header):
+    def handler(evaluation, match):
+        canonical_url = _canonical_url(evaluation, target)
+        if html:
+            evaluation.context['canonical_' + target] = canonical_url
+        if header:
+            evaluation.headers['Link'] = '<{url}>; rel="canonical"'.format(url=canonical_url)
+    return handler
+
+
+register_category('canonical')
+
+CANONICAL_TARGETS = ('next_block', 'random', 'self', 'home')
+
+for target in CANONICAL_TARGETS:
+    register('canonical_' + target, 'canonical', _canonical(target, html=True, header=True),
+             is_random=target == 'random')
+for target in CANONICAL_TARGETS:
+    register('header_canonical_' + target, 'canonical',
+             _canonical(target, html=False, header=True), is_random=target == 'random')
+for target in CANONICAL_TARGETS:
+    register('html_canonical_' + target, 'canonical',
+             _canonical(target, html=True, header=False), is_random=target == 'random')
+
+
+# Vary
+
+def _vary(value):
+    def handler(evaluation, match):
+        evaluation.collect('vary', value)
+    return handler
+
+
+def _finish_vary(evaluation):
+    evaluation.headers['Vary'] = ','.join(evaluation.collected['vary'])
+
+
+register_category('vary', finish=_finish_vary)
+
+register('vary_accept_encoding', 'vary', _vary('Accept-Encoding'))
+register('vary_user_agent', 'vary', _vary('User-Agent'))
+register('vary_cookie', 'vary', _vary('Cookie'))
+register('vary_referer', 'vary', _vary('Referer'))
+register('vary_referrer', 'vary', _vary('Referer'))
+
+
+# Delays
+
+def _delay_seconds(seconds):
+    def handler(evaluation, match):
+        evaluation.collect('delay', seconds)
+    return handler
+
+
+def _delay_ms(evaluation, match):
+    evaluation.collect('delay', min(int(match.group(1)), MAX_DELAY_MS) / 1000.0)
+
+
+def _finish_delay(evaluation):
+    evaluation.context['delay'] = max(evaluation.collected['delay'])
+
+
+register_category('delay', finish=_finish_delay)
+
+for seconds in range(1, 6):
+    register('delay_%d' % seconds, 'delay', _delay_seconds(seconds))
+register(r'delay_ms_(\d+)', 'delay', _delay_ms, pattern=True)
+
+
+# Pacing
+
+def _max_ms(key):
+    def handler(evaluation, match):
+        ms = min(int(match.group(1)), MAX_DELAY_MS)
+        evaluation.context[key] = max(evaluation.context[key], ms)
+    return handler
+
+
+def _throttle(evaluation, match):
+    kbps = int(match.group(1))
+    if kbps:
+        # The slowest throttle wins.
+        evaluation.context['throttle'] = min(evaluation.context['throttle'] or kbps, kbps)
+
+
+register_category('pacing', defaults={'ttfb': 0, 'throttle': 0, 'drip': 0})
+
+register(r'ttfb_(\d+)', 'pacing', _max_ms('ttfb'), pattern=True)
+register(r'throttle_(\d+)', 'pacing', _throttle, pattern=True)
+register(r'drip_(\d+)', 'pacing', _max_ms('drip'), pattern=True)
+
+
+# Body size and framing
+
+def _size(unit):
+    def handler(evaluation, match):
+        size = min(int(match.group(1)) * unit, MAX_SIZE_BYTES)
+        evaluation.context['size'] = max(evaluation.context['size'], size)
+    return handler
+
+
+register_category('body', defaults={'size': 0, 'chunked': False})
+
+register(r'size_(\d+)kb', 'body', _size(1024), pattern=True)
+register(r'size_(\d+)mb', 'body', _size(1024 * 1024), pattern=True)
+# Send the body without a Content-Length, so it is chunked.
+register('chunked', 'body', _context('chunked', True))
+
+
+# Content encoding
+
+def _encoding(mode):
+    def handler(evaluation, match):
+        evaluation.context['encoding'] = match.group(1)
+        evaluation.context['encoding_mode'] = mode
+    return handler
+
+
+register_category('encoding', defaults={'encoding': None, 'encoding_mode': 'normal'})
+
+_encodings = '|'.join(ENCODERS)
+register(r'encoding_(identity|%s)' % _encodings, 'encoding', _encoding('normal'), pattern=True)
+# Claim the encoding but send the body as is.
+register(r'encoding_lie_(%s)' % _encodings, 'encoding', _encoding('lie'), pattern=True)
+# Encode the body twice, but only say so once.
+register(r'encoding_double_(%s)' % _encodings, 'encoding', _encoding('double'), pattern=True)
+
+
+# Validators
+
+register_category('validators', defaults={'etag': 'strong'})
+
+register('etag_weak', 'validators', _context('etag', 'weak'))
+# A new ETag every time, so revalidation never succeeds.
+register('etag_changing', 'validators', _context('etag', 'changing'), is_random=True)
+
+
+# Seeds
+
+register_category('seed', defaults={'seed': None})
+
+# The seed is read when the URL is compiled, as it has to be known before
+# a block is picked (see crawlbin.core.url), and put in the context by
+# crawlbin.core.page.
+register(r'seed_\d+', 'seed', _ignore, pattern=True)
+
+
+# Synthetic sites (see crawlbin.core.graph)
+
+def _site(evaluation, match):
+    evaluation.context['site'] = int(match.group(1))
+
+
+def _links(evaluation, match):
+    evaluation.context['link_count'] = min(int(match.group(1)), MAX_LINKS)
+
+
+def _link_rate(evaluation, match):
+    evaluation.collect('link_rates', (match.group(1), min(int(match.group(2)), 100)))
+
+
+def _finish_graph(evaluation):
+    context = evaluation.context
+    site = context['site'] or 0
+    links = context['link_count']
+    if links is None:
+        links = DEFAULT_LINKS
+
+    # The links only depend on the path, so they are the same on any host.
+    path = evaluation.current_url[len(evaluation.base_url):]
+    rates = dict(evaluation.collected.get('link_rates', ()))
+    context['links'] = [evaluation.base_url + link
+                        for link in outlinks(path, site, links, rates)]
+
+
+register_category('graph', defaults={'site': None, 'link_count': None, 'links': ()},
+                  finish=_finish_graph)
+
+register(r'site_(\d+)', 'graph', _site, pattern=True)
+register(r'links_(\d+)', 'graph', _links, pattern=True)
+register(r'links_(%s)_(\d+)' % '|'.join(LINK_KINDS), 'graph', _link_rate, pattern=True)
+
+
+# Sitemaps (see crawlbin.core.sitemap)
+
+def _percent(key):
+    def handler(evaluation, match):
+        evaluation.context[key] = min(int(match.group(1)), 100)
+    return handler
+
+
+register_category('sitemap', defaults={'sitemap_malformed': 0, 'sitemap_bad_lastmod': 0})
+
+register(r'sitemap_malformed_(\d+)', 'sitemap', _percent('sitemap_malformed'), pattern=True)
+register(r'sitemap_bad_lastmod_(\d+)', 'sitemap', _percent('sitemap_bad_lastmod'), pattern=True)
+
+
+# Debugging
+
+register_category('debug', defaults={'server_timing': False})
+
+register('server_timing', 'debug', _context('server_timing', True))
+
+
+def handle_redirect(directives, previous_parts):
+    """Handle the redirect directives:
+
+    - response_301
+    - response_302
+    - response_303
+    - response_307
+    - response_308
+    - response_400
+    - response_401
+    - response_403
+    - response_404
+    - response_410
+    - response_418
+    - response_500
+    - response_503
+
+    In all cases the relevant status code needs returning, along with
+    and relevant headers (e.g Location or WWW-Authenticate).
+
+    """
+
+    evaluation = _evaluate_category('response', directives, '', '', previous_parts)
+
+    return evaluation.context, evaluation.headers, evaluation.status_code
+
+
+def h1_directive(directives):
+    """ Handle the H1 directives:
+
+    - h1_off
+    - h1_on
+    - h1_multiple
+
+    H1 is assumed to be on, so if off or multiple the h1 context
+    variable needs setting accordingly.
+
+    """
+
+    evaluation = _evaluate_category('h1', directives)
+
+    return evaluation.context, evaluation.headers
+
+
+def title_tag_directive(directives, rng=None):
+    """ Handle the title tag directive:
+
+    - random_title
+
+    Title is always 'Crawlbin' in the absence of a directive. rng is
+    what random_title chooses with, by default the random module.
+
+    """
+
+    evaluation = _evaluate_category('title', directives, rng=rng)
+
+    return evaluation.context, evaluation.headers
+
+
+def index_follow_directives(directives):
+    """Handle the index / follow directives:
+
+    - meta_follow
+    - meta_nofollow
+    - meta_index
+    - meta_noindex
+    - header_follow
+    - header_nofollow
+    - header_index
+    - header_noindex
+
+    Directives prefixed with meta require the meta_follow_index_string
+    context variable to be set. Those prefixed with header require the
+    X-Robots-Tag header variable to be set.
+
+    """
+
+    evaluation = _evaluate_category('index_follow', directives)
+
+    return evaluation.context, evaluation.headers
+
+
+def canonical_directives(directives, base, self, next_block):
+    """Add relevant context and headers for the canonical directives.
+
+    - canonical_next_block
+    - canonical_random
+    - canonical_self
+    - canonical_home
+    - header_canonical_next_block
+    - header_canonical_random
+    - header_canonical_self
+    - header_canonical_home
+    - html_canonical_next_block
+    - html_canonical_random
+    - html_canonical_self
+    - html_canonical_home
+
+    Directives prefixed with canonical require both the header and
+    context variable setting.
+
+    Directives prefixed with header, only need the header variable, and
+    those prefixed with html only need the context variable.
+
+    """
+
+    evaluation = _evaluate_category('canonical', directives, base, self, next_block)
+
+    return evaluation.context, evaluation.headers
+
+
+def vary_directives(directives):
+    """Handle the vary directives:
+
+    - vary_accept_encoding
+    - vary_user_agent
+    - vary_cookie
+    - vary_referer
+
+    If any of the above are set they need concatenating and outputting
+    in a header variable.
+
+    """
+
+    evaluation = _evaluate_category('vary', directives)
+
+    return evaluation.context, evaluation.headers
+
+
+def delay_directives(directives):
+    """Handle the delay directives:
+
+    - delay_1
+    - delay_2
+    - delay_3
+    - delay_4
+    - delay_5
+    - delay_ms_<n>, e.g. delay_ms_250
+
+    Nothing sleeps here, the delay in seconds is put in the delay
+    context variable and it's up to the caller to hold the response
+    back (see pages.delays). Delays don't stack, so the longest one
+    requested wins. delay_ms_<n> is capped at MAX_DELAY_MS.
+
+    """
+
+    evaluation = _evaluate_category('delay', directives)
+
+    return evaluation.context, evaluation.headers
+
+
+def get_random_url(base, rng=random):
+    """Return a random, valid crawlbin directive, concatenated to the
+    given base url, chosen with rng.
+
+    """
+
+    fragments = [
+        'meta_no_index+meta_nofollow',
+        'response_301',
+        'meta_noindex',
+        'canonical_self+vary_user_agent',
+        'canonical_self',
+        'vary_user_agent',
+        'meta_noindex+canonical_random'
+    ]
+
+    choice = rng.choice(fragments)
+
+    return base + '/{choice}/'.format(choice=choice)
@@ -0,0 +1,116 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Synthetic sites for crawl-scale load testing.
+
+A page with a site_<id> or links_<n> directive is a node of a large,
+virtual site and links to n other nodes of it. The links are picked from
+a hash of the page's path, so a page always has the same links, and
+nothing is stored: a crawler can discover millions of URLs while each
+page costs no more to make than its links.
+
+Node k of a site is at /n<k>/<directives>/, where directives are the
+site's graph directives in their canonical form, e.g.
+site_7+links_20+links_broken_10, so every node links on in the same way.
+
+A share of the links, set in percent by the links_<kind>_<percent>
+directives, point at variants of a node made with crawlbin's other
+directives instead:
+
+- redirect: /n<k>/<directives>/response_301/, which redirects to node k
+- broken: /n<k>/<directives>+response_404/
+- noindex: /n<k>/<directives>+meta_noindex/
+- canonical: /n<k>/<directives>/<directives>+canonical_next_block/, a
+  duplicate of node k with a canonical pointing at it
+
+"""
+
+import hashlib
+import logging
+import random
+
+logger = logging.getLogger('crawlbin.core.graph')
+
+# Nodes in each site.
+SITE_PAGES = 1000000
+# Links on a site_<id> page without a links_<n> directive.
+DEFAULT_LINKS = 10
+# Most links a links_<n> directive can ask for.
+MAX_LINKS = 1000
+
+LINK_KINDS = ('redirect', 'broken', 'noindex', 'canonical')
+# Percent of links of each kind, unless a links_<kind>_<percent>
+# directive says otherwise. The rest link to plain nodes.
+DEFAULT_RATES = {'redirect': 2, 'broken': 2, 'noindex': 5, 'canonical': 5}
+
+
+def graph_directives(site, links, rates):
+    """Return the canonical form of the graph directives for a site with
+    links links per page and the given link rates.
+
+    """
+
+    directives = ['site_%d' % site, 'links_%d' % links]
+    for kind in LINK_KINDS:
+        if rates[kind] != DEFAULT_RATES[kind]:
+            directives.append('links_%s_%d' % (kind, rates[kind]))
+    return '+'.join(directives)
+
+
+def node_path(node, directives, kind=None):
+    """Return the path of a node, or of a variant of it when kind is one
+    of LINK_KINDS.
+
+    """
+
+    path = '/n%d/%s' % (node, directives)
+    if kind is None:
+        return path + '/'
+    if kind == 'redirect':
+        return path + '/response_301/'
+    if kind == 'broken':
+        return path + '+response_404/'
+    if kind == 'noindex':
+        return path + '+meta_noindex/'
+    return '%s/%s+canonical_next_block/' % (path, directives)
+
+
+def _rng(site, path):
+    digest = hashlib.md5(('%d\0%s' % (site, path)).encode('utf-8')).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def outlinks(path, site=0, links=DEFAULT_LINKS, rates=None):
+    """Return the paths the page at path links to, for a site with links
+    links per page and the link rates given, which default to
+    DEFAULT_RATES.
+
+    """
+
+    rates = dict(DEFAULT_RATES, **(rates or {}))
+    directives = graph_directives(site, links, rates)
+    rng = _rng(site, path)
+
+    thresholds = []
+    total = 0
+    for kind in LINK_KINDS:
+        total += rates[kind]
+        thresholds.append((total, kind))
+
+    paths = []
+    for _ in range(links):
+        node = rng.randrange(SITE_PAGES)
+        draw = rng.random() * 100
+
+        kind = None
+        for threshold, candidate in thresholds:
+            if draw < threshold:
+                kind = candidate
+                break
+
+        paths.append(node_path(node, directives, kind))
+
+    return paths
@@ -0,0 +1,113 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Directive pages, evaluated without a request.
+
+evaluate() works out the status code, headers and template context a
+crawlbin URL is served with for a user agent, exactly as the handle view
+does, but from a path and a user agent string. The view adds what
+depends on the deployment on top: validators, Vary: Accept-Encoding and
+analytics links.
+
+"""
+
+import logging
+
+from crawlbin.core.directives import evaluate_directives
+from crawlbin.core.url import compile_url_path
+from crawlbin.core.url import seeded_random
+from crawlbin.core.user_agent import classify_user_agent
+
+logger = logging.getLogger('crawlbin.core.page')
+
+
+def evaluate_plan(url, plan, ua_mask, base_url, path, seed=None):
+    """Evaluate a compiled plan for the page at path, whose directive
+    page url is path without its slashes, for a user agent in the
+    categories ua_mask. base_url is the scheme and host.
+
+    seed, if given, seeds the request as a seed_<n> directive would. A
+    seed_<n> directive in the URL takes precedence over it.
+
+    Returns the Evaluation with the page context filled in, and with
+    cacheable set if the same request from the same category of user
+    agent always gets the same page.
+
+    """
+
+    if plan.seed is not None:
+        seed = plan.seed
+    rng = seeded_random(seed)
+
+    previous_parts = url.split("/")[:-1]
+    directives = plan.evaluate(ua_mask, rng)
+
+    current_url = '{base}{path}'.format(base=base_url, path=path)
+
+    # Avoid ending up with 2 trailing slashes for empty paths
+    previous_path = '/'.join(previous_parts)
+    if previous_path:
+        previous_parts_url = '{base}/{path}/'.format(base=base_url, path=previous_path)
+    else:
+        previous_parts_url = '{base}/'.format(base=base_url)
+
+    evaluation = evaluate_directives(
+        directives,
+        base_url,
+        current_url,
+        previous_parts_url,
+        rng=rng
+    )
+    evaluation.directives = directives
+    evaluation.cacheable = seed is not None or (plan.is_deterministic(ua_mask) and
+                                                not evaluation.is_random)
+
+    context = evaluation.context
+    context.update({
+        'url': url,
+        'previous_parts_url': previous_parts_url,
+        'directives': directives,
+        'unknown_directives': evaluation.unknown,
+        'seed': seed,
+        # for debug/output purposes
+        'headers': evaluation.headers,
+    })
+
+    return evaluation
+
+
+def split_path(path):
+    """Return the path of a directive page, with a leading slash added
+    if it was missing, and its url: the path without its slashes.
+    Raises ValueError for paths that aren't directive pages.
+
+    """
+
+    if not path.startswith('/'):
+        path = '/' + path
+    if len(path) < 2 or not path.endswith('/'):
+        raise ValueError('"%s" is not the path of a directive page' % path)
+
+    return path, path[1:-1]
+
+
+def evaluate(path, user_agent, host='crawlbin.com', scheme='http', seed=None):
+    """Evaluate the directive page at path, e.g. '/a/[meta_noindex]/',
+    as requested by user_agent.
+
+    Returns the Evaluation, with the status_code, headers and the
+    context the page is rendered with. Random directives are resolved
+    afresh on each call, just as they are for each request, unless the
+    page is seeded, either by a seed_<n> directive or by seed.
+
+    """
+
+    path, url = split_path(path)
+    plan = compile_url_path(url.split("/")[-1])
+    ua_mask = classify_user_agent(user_agent)
+
+    base_url = '{scheme}://{host}'.format(scheme=scheme, host=host)
+    return evaluate_plan(url, plan, ua_mask, base_url, path, seed)
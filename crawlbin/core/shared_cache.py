@@ -0,0 +1,389 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+A cache shared by every worker process on a host.
+
+Each pre-forked worker has its own in-process caches, so a plan compiled
+or a page rendered by one worker is compiled or rendered again by every
+other. A SharedCache is a fixed-size hash table in a memory-mapped file
+which every worker maps, so work done by one is reused by all of them,
+and the memory it takes doesn't grow with the number of workers.
+
+The table is made of slots of slot_size bytes, grouped into buckets of
+WAYS slots. A key hashes to a bucket, and when every slot in the bucket
+is taken the least recently used one is evicted. Values are pickled,
+and entries too large for a slot aren't cached. Keys are strings,
+integers, None, or tuples of them, as crawlbin's caches use, and are
+encoded so that equal keys always give the same bytes. Pickles don't:
+they depend on which objects are shared within the key.
+
+Writers take one of STRIPES locks, picked by bucket: a thread lock and
+an fcntl lock on a byte of the file, so writers in other processes and
+other threads wait. Readers don't lock at all. Each slot has a sequence
+number that a writer makes odd while it writes the slot and even again
+when it's done, and a reader that sees it odd or changed reads again.
+
+A hit does write to the slot, without a lock: the time it was last used.
+That can race a writer replacing the entry, leaving the new entry with
+the reader's time rather than the writer's, or a time a moment out of
+date. Only the choice of which entry to evict is affected, and it is
+allowed to be approximate, which is cheaper than taking a lock on every
+hit.
+
+The size of the table is fixed when its file is created. A file made
+with different sizes is replaced with one laid out afresh when it's
+opened: the new file is renamed over the old, so processes that still
+map the old one keep using it, and never see it change size under them.
+Anything that can write to the file can make workers unpickle what it
+likes, so it is only readable and writable by its owner.
+
+"""
+
+import cPickle as pickle
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+
+logger = logging.getLogger('crawlbin.core.shared_cache')
+
+WAYS = 4
+STRIPES = 64
+
+_MAGIC = b'CRWLBIN2'
+# magic, slots, slot size, ways, stripes
+_HEADER = struct.Struct('<8sIIII')
+# Each stripe's count of slots in use follows the header.
+_COUNT = struct.Struct('<I')
+_COUNTS_OFFSET = 64
+# sequence number, last used, key hash, key length, value length
+_SLOT = struct.Struct('<IQQII')
+_SEQUENCE = struct.Struct('<I')
+_USED = struct.Struct('<Q')
+_USED_OFFSET = 4
+
+# Times a reader tries a slot that's being written before giving up.
+_READ_ATTEMPTS = 10
+
+_MISSING = object()
+
+
+def _now():
+    # In microseconds, so entries written in a burst are still ordered.
+    return int(time.time() * 1000000)
+
+
+def _encode_key(key):
+    # Each part is tagged with its type, and strings with their length,
+    # so no two different keys encode the same. Unicode that is ASCII
+    # equals, and so encodes as, the same str.
+    if isinstance(key, unicode):
+        try:
+            key = key.encode('ascii')
+        except UnicodeEncodeError:
+            key = key.encode('utf-8')
+            return b'u%d:%s' % (len(key), key)
+    if isinstance(key, str):
+        return b's%d:%s' % (len(key), key)
+    if isinstance(key, (int, long)):
+        return b'i%d;' % key
+    if key is None:
+        return b'n'
+    if isinstance(key, tuple):
+        return b't%d:%s' % (len(key), b''.join(_encode_key(part) for part in key))
+    raise TypeError('Can\'t share a cache key of type %s' % type(key).__name__)
+
+
+def _hash(key_bytes):
+    # Never 0, which marks an empty slot.
+    return struct.unpack('<Q', hashlib.md5(key_bytes).digest()[:8])[0] | 1
+
+
+class SharedCache(object):
+    """A cache of up to max_size entries, of at most slot_size bytes
+    each pickled, in the memory-mapped file at path.
+
+    It has the same interface as crawlbin.core.cache.LRUCache, but for
+    resize(), and can be given to one as its shared cache. Hits, misses,
+    evictions and entries too large to cache are counted per process.
+
+    """
+
+    def __init__(self, path, max_size=4096, slot_size=1024):
+        self.path = path
+        self.buckets = max(1, max_size // WAYS)
+        self.max_size = self.buckets * WAYS
+        self.slot_size = slot_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversized = 0
+
+        self._data_offset = _page_align(_COUNTS_OFFSET + _COUNT.size * STRIPES)
+        self._locks = [threading.Lock() for _ in range(STRIPES)]
+
+        length = self._data_offset + self.max_size * slot_size
+        self._fd = self._open(length)
+        self._map = mmap.mmap(self._fd, length)
+
+    def __len__(self):
+        return sum(_COUNT.unpack_from(self._map, _COUNTS_OFFSET + stripe * _COUNT.size)[0]
+                   for stripe in range(STRIPES))
+
+    def __contains__(self, key):
+        key_bytes = _encode_key(key)
+        return self._find(key_bytes, _hash(key_bytes), touch=False) is not None
+
+    def get(self, key, default=None):
+        """Return the cached value for key, marking it as recently used,
+        or default if it isn't cached.
+
+        """
+
+        key_bytes = _encode_key(key)
+        value_bytes = self._find(key_bytes, _hash(key_bytes), touch=True)
+
+        if value_bytes is not None:
+            try:
+                value = pickle.loads(value_bytes)
+            except Exception:
+                logger.exception('Unreadable entry in shared cache %s', self.path)
+            else:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used entry
+        in its bucket if the bucket is full.
+
+        """
+
+        if self.max_size <= 0:
+            return
+
+        key_bytes = _encode_key(key)
+        try:
+            value_bytes = pickle.dumps(value, 2)
+        except (pickle.PicklingError, TypeError):
+            logger.warning('Not sharing an entry that can\'t be pickled: %r', key)
+            return
+
+        if _SLOT.size + len(key_bytes) + len(value_bytes) > self.slot_size:
+            self.oversized += 1
+            return
+
+        key_hash = _hash(key_bytes)
+        bucket = self._bucket(key_hash)
+
+        with self._stripe(bucket % STRIPES) as stripe:
+            offset, empty = self._slot_for(bucket, key_hash, key_bytes)
+            self._write(offset, key_hash, key_bytes, value_bytes)
+            if empty:
+                self._add_count(stripe, 1)
+
+    def get_or_create(self, key, factory):
+        """Return the cached value for key, building it with
+        factory(key) and caching it on a miss.
+
+        Exceptions raised by factory are not cached.
+
+        """
+
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory(key)
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        """Drop every entry, for every process, and reset this process's
+        counters.
+
+        """
+
+        for lock in self._locks:
+            lock.acquire()
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            empty = b'\0' * self.slot_size
+            for slot in range(self.max_size):
+                offset = self._data_offset + slot * self.slot_size
+                self._map[offset:offset + self.slot_size] = empty
+            for stripe in range(STRIPES):
+                _COUNT.pack_into(self._map, _COUNTS_OFFSET + stripe * _COUNT.size, 0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            for lock in self._locks:
+                lock.release()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.oversized = 0
+
+    def stats(self):
+        """Return a dictionary of the cache counters."""
+
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'oversized': self.oversized,
+        }
+
+    def close(self):
+        """Unmap the file. The cache can't be used after this."""
+
+        self._map.close()
+        os.close(self._fd)
+
+    def _open(self, length):
+        # The file at path, once it's laid out for these sizes. Whoever
+        # holds the lock on it decides whether to replace it, and anyone
+        # who was waiting for the lock opens the replacement.
+        expected = _HEADER.pack(_MAGIC, self.max_size, self.slot_size, WAYS, STRIPES)
+
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                stat = os.fstat(fd)
+                current = os.stat(self.path)
+                if (stat.st_dev, stat.st_ino) == (current.st_dev, current.st_ino):
+                    if stat.st_size == length and os.read(fd, _HEADER.size) == expected:
+                        return fd
+                    self._lay_out(length, expected)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _lay_out(self, length, header):
+        logger.info('Laying out shared cache %s: %d slots of %d bytes',
+                    self.path, self.max_size, self.slot_size)
+
+        directory, name = os.path.split(self.path)
+        fd, temporary = tempfile.mkstemp(prefix=name + '.', dir=directory or '.')
+        try:
+            try:
+                os.ftruncate(fd, length)
+                os.write(fd, header)
+            finally:
+                os.close(fd)
+            os.rename(temporary, self.path)
+        except Exception:
+            os.remove(temporary)
+            raise
+
+    @contextmanager
+    def _stripe(self, stripe):
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield stripe
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    def _bucket(self, key_hash):
+        # The bottom bit is always set, so it's left out.
+        return (key_hash >> 1) % self.buckets
+
+    def _slot_offsets(self, bucket):
+        first = self._data_offset + bucket * WAYS * self.slot_size
+        return [first + way * self.slot_size for way in range(WAYS)]
+
+    def _find(self, key_bytes, key_hash, touch):
+        for offset in self._slot_offsets(self._bucket(key_hash)):
+            value_bytes = self._read(offset, key_hash, key_bytes)
+            if value_bytes is not None:
+                if touch:
+                    # Unlocked, so may be lost to a writer, or overwrite
+                    # its time, which only makes the LRU approximate.
+                    _USED.pack_into(self._map, offset + _USED_OFFSET, _now())
+                return value_bytes
+        return None
+
+    def _read(self, offset, key_hash, key_bytes):
+        for _ in range(_READ_ATTEMPTS):
+            sequence, _, slot_hash, key_length, value_length = _SLOT.unpack_from(
+                self._map, offset)
+            if sequence & 1:
+                continue
+
+            found = None
+            if slot_hash == key_hash and key_length == len(key_bytes) and (
+                    _SLOT.size + key_length + value_length <= self.slot_size):
+                start = offset + _SLOT.size
+                entry = self._map[start:start + key_length + value_length]
+                if entry[:key_length] == key_bytes:
+                    found = entry[key_length:]
+
+            # A writer got to the slot while it was being read.
+            if _SEQUENCE.unpack_from(self._map, offset)[0] != sequence:
+                continue
+            return found
+
+        return None
+
+    def _slot_for(self, bucket, key_hash, key_bytes):
+        # The slot already holding key, else an empty one, else the
+        # least recently used one. Returns it and whether it was empty.
+        now = _now()
+        empty = None
+        oldest = None
+        oldest_age = None
+
+        for offset in self._slot_offsets(bucket):
+            _, used, slot_hash, key_length, _ = _SLOT.unpack_from(self._map, offset)
+            if slot_hash == 0:
+                if empty is None:
+                    empty = offset
+                continue
+
+            if slot_hash == key_hash and key_length == len(key_bytes):
+                start = offset + _SLOT.size
+                if self._map[start:start + key_length] == key_bytes:
+                    return offset, False
+
+            age = now - used
+            if oldest_age is None or age > oldest_age:
+                oldest, oldest_age = offset, age
+
+        if empty is not None:
+            return empty, True
+
+        self.evictions += 1
+        return oldest, False
+
+    def _write(self, offset, key_hash, key_bytes, value_bytes):
+        sequence = _SEQUENCE.unpack_from(self._map, offset)[0]
+        _SEQUENCE.pack_into(self._map, offset, (sequence + 1) & 0xffffffff)
+
+        start = offset + _SLOT.size
+        self._map[start:start + len(key_bytes) + len(value_bytes)] = key_bytes + value_bytes
+        _SLOT.pack_into(self._map, offset, (sequence + 1) & 0xffffffff, _now(), key_hash,
+                        len(key_bytes), len(value_bytes))
+
+        _SEQUENCE.pack_into(self._map, offset, (sequence + 2) & 0xffffffff)
+
+    def _add_count(self, stripe, delta):
+        offset = _COUNTS_OFFSET + stripe * _COUNT.size
+        _COUNT.pack_into(self._map, offset, _COUNT.unpack_from(self._map, offset)[0] + delta)
+
+
+def _page_align(length):
+    return -(-length // mmap.PAGESIZE) * mmap.PAGESIZE
@@ -0,0 +1,176 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Sitemaps of crawlbin URLs, for testing how crawlers ingest them.
+
+A sitemap lists every combination of up to COMBINATION_SIZE directives
+or, if it has site_<id> or links_<n> directives, every node of that
+synthetic site (see crawlbin.core.graph). It is split into shards of
+URLS_PER_SITEMAP URLs, the protocol's limit, listed by a sitemap index.
+
+Shards are written by generators a chunk of entries at a time, to be
+gzipped as they go, so not even the shards of a million page site are
+ever held in memory.
+
+sitemap_malformed_<percent> and sitemap_bad_lastmod_<percent> spoil
+that share of the entries, always the same ones:
+
+- malformed entries have no <loc>, a relative or another host's URL,
+  or an unescaped ampersand
+- bad lastmods are in the future, before the web, or not dates at all
+
+"""
+
+import itertools
+import logging
+import random
+
+from collections import namedtuple
+from xml.sax.saxutils import escape
+
+from crawlbin.core.directives import DIRECTIVES
+from crawlbin.core.directives import evaluate_directives
+from crawlbin.core.graph import DEFAULT_LINKS
+from crawlbin.core.graph import DEFAULT_RATES
+from crawlbin.core.graph import SITE_PAGES
+from crawlbin.core.graph import graph_directives
+from crawlbin.core.graph import node_path
+
+logger = logging.getLogger('crawlbin.core.sitemap')
+
+# The most URLs the sitemap protocol allows in one file.
+URLS_PER_SITEMAP = 50000
+# Directive sitemaps list every combination of this many directives or fewer.
+COMBINATION_SIZE = 3
+# Entries written at a time.
+ENTRIES_PER_CHUNK = 1000
+
+MALFORMED_ENTRIES = ('missing_loc', 'relative', 'other_host', 'unescaped')
+BAD_LASTMODS = ('2999-12-31T23:59:59+00:00', '1900-01-01', 'last tuesday', '2015-02-30')
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+
+def _combinations(count, size):
+    total = 0
+    for k in range(1, size + 1):
+        combinations = 1
+        for i in range(k):
+            combinations = combinations * (count - i) // (i + 1)
+        total += combinations
+    return total
+
+
+class Sitemap(namedtuple('Sitemap', ['graph', 'malformed', 'bad_lastmod'])):
+    """What a sitemap lists and how it is spoiled.
+
+    - graph: the graph directives of the synthetic site listed, or None
+      to list directive combinations
+    - malformed, bad_lastmod: percent of entries to spoil
+
+    """
+
+    __slots__ = ()
+
+    def count(self):
+        """Return the number of URLs in the sitemap."""
+
+        if self.graph is not None:
+            return SITE_PAGES
+        return _combinations(len(DIRECTIVES), COMBINATION_SIZE)
+
+    def shards(self):
+        """Return the number of shards the sitemap is split into."""
+
+        return max(1, -(-self.count() // URLS_PER_SITEMAP))
+
+    def paths(self, shard):
+        """Yield the paths in a shard, numbered from 1."""
+
+        start = (shard - 1) * URLS_PER_SITEMAP
+        stop = min(start + URLS_PER_SITEMAP, self.count())
+
+        if self.graph is not None:
+            for node in xrange(start, stop):
+                yield node_path(node, self.graph)
+            return
+
+        names = sorted(DIRECTIVES)
+        combinations = itertools.chain.from_iterable(
+            itertools.combinations(names, size) for size in range(1, COMBINATION_SIZE + 1))
+        for combination in itertools.islice(combinations, start, stop):
+            yield '/%s/' % '+'.join(combination)
+
+
+def compile_sitemap(directives):
+    """Return the Sitemap for a list of directives. Directives that
+    aren't about sites or sitemaps are ignored.
+
+    """
+
+    evaluation = evaluate_directives(directives, categories=('graph', 'sitemap'))
+    context = evaluation.context
+
+    graph = None
+    if context['site'] is not None or context['link_count'] is not None:
+        links = context['link_count']
+        if links is None:
+            links = DEFAULT_LINKS
+        rates = dict(DEFAULT_RATES, **dict(evaluation.collected.get('link_rates', ())))
+        graph = graph_directives(context['site'] or 0, links, rates)
+
+    return Sitemap(graph, context['sitemap_malformed'], context['sitemap_bad_lastmod'])
+
+
+def sitemap_index(sitemap_urls, lastmod):
+    """Return a sitemap index of sitemap_urls."""
+
+    entries = ''.join('<sitemap><loc>%s</loc><lastmod>%s</lastmod></sitemap>\n'
+                      % (escape(url), lastmod) for url in sitemap_urls)
+    return '%s<sitemapindex xmlns="%s">\n%s</sitemapindex>\n' % (
+        _XML_DECLARATION, _NAMESPACE, entries)
+
+
+def _entry(base_url, path, lastmod, rng, sitemap):
+    loc = escape(base_url + path)
+
+    if sitemap.bad_lastmod and rng.random() * 100 < sitemap.bad_lastmod:
+        lastmod = rng.choice(BAD_LASTMODS)
+
+    if sitemap.malformed and rng.random() * 100 < sitemap.malformed:
+        kind = rng.choice(MALFORMED_ENTRIES)
+        if kind == 'missing_loc':
+            return '<url><lastmod>%s</lastmod></url>\n' % lastmod
+        if kind == 'relative':
+            loc = escape(path)
+        elif kind == 'other_host':
+            loc = escape('http://example.com' + path)
+        else:
+            loc = base_url + path + '?a=1&b=2'
+
+    return '<url><loc>%s</loc><lastmod>%s</lastmod></url>\n' % (loc, lastmod)
+
+
+def urlset(sitemap, shard, base_url, lastmod):
+    """Yield a shard of a sitemap, numbered from 1, ENTRIES_PER_CHUNK
+    entries at a time.
+
+    """
+
+    # Seeded by the shard, so the same entries are spoiled every time.
+    rng = random.Random(shard)
+
+    yield '%s<urlset xmlns="%s">\n' % (_XML_DECLARATION, _NAMESPACE)
+
+    entries = []
+    for path in sitemap.paths(shard):
+        entries.append(_entry(base_url, path, lastmod, rng, sitemap))
+        if len(entries) >= ENTRIES_PER_CHUNK:
+            yield ''.join(entries)
+            entries = []
+
+    yield ''.join(entries) + '</urlset>\n'
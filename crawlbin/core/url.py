@@ -0,0 +1,401 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+It is helpful to understand the following definitions when reading this
+code.
+
+Directives:
+
+Each possible 'command', such as 'vary_cookie' or 'response_404' is
+called a 'directive'.
+
+Blocks:
+
+A 'block' is any set of directives wrapped in [].
+
+There are two blocks here, with three directives in total:
+http://crawlbin.com/[meta_noindex+vary_cookie][response_404]/
+
+One of the two blocks above would be selected at random. Directives in a
+block are joined with +.
+
+Nested blocks are possible, which introduces randomness within a block.
+
+For example, here there are two outer blocks (one has a nested block):
+http://crawlbin.com/[meta_index+[vary_cookie,vary_referer]][response_404]/
+
+Plans:
+
+Parsing a URL path is done once, by compile_url_path(), which turns it
+into an immutable DirectivePlan. The plan holds every block, grouped by
+user agent filter, with the nested choices left unresolved. Random
+choices are only made when the plan is evaluated for a request, so
+plans can be cached and shared between requests.
+
+Seeds:
+
+A seed_<n> directive anywhere in a URL seeds the whole request: every
+random choice, from picking a block onwards, is made with a
+random.Random(n) of its own, so the same URL always gives the same page.
+
+"""
+
+import logging
+import re
+import random
+
+from collections import namedtuple
+from collections import OrderedDict
+
+from crawlbin.core.cache import LRUCache
+from crawlbin.core.user_agent import USER_AGENT_CATEGORIES
+from crawlbin.core.user_agent import classify_user_agent
+
+logger = logging.getLogger('crawlbin.core.url')
+
+_WRAPPED_RE = re.compile(r'^\[.*\]$')
+_BLOCK_RE = re.compile(r'\[[^\]]*\]')
+_NESTED_BLOCK_RE = re.compile(r'\([^\)]*\)')
+_USER_AGENT_FILTER_RE = re.compile(r'^[a-z 0-9]+:')
+_SEED_RE = re.compile(r'^seed_(\d+)$')
+
+# Compiled plans keyed on the raw url path. Crawlers tend to hit the
+# same few thousand test URLs, so this is sized to hold all of them.
+plan_cache = LRUCache(max_size=4096)
+
+
+def parse_brackets(url_path):
+    """Verify the brackets in the URL match & are not too deeply nested.
+
+    If there are no outer brackets then add them to make matching
+    against them easier and more consistent later on.
+
+    If there are nested brackets then we swap them for parentheses here
+    so as to make matching pairs easier later on.
+
+    url_path is should not contain the domain name or forward slashes.
+
+    """
+
+    # Most URLs are a plain list of directives with no brackets at all.
+    if "[" not in url_path and "]" not in url_path:
+        return "[" + url_path + "]"
+
+    parsed_url = []
+    bracket_depth = 0
+
+    # If we aren't wrapped in [brackets] then add them now.
+    if not _WRAPPED_RE.search(url_path):
+        url_path = "["+url_path+"]"
+
+    for char in url_path:
+
+        if char == "]":
+            if bracket_depth == 0:
+                raise SyntaxError("Encountered an unexpected closing bracket.")
+            elif bracket_depth == 1:
+                parsed_url.append(char)
+            elif bracket_depth == 2:
+                parsed_url.append(")")
+
+            bracket_depth -= 1
+
+        elif char == "[":
+            if bracket_depth == 0:
+                parsed_url.append(char)
+            elif bracket_depth >= 1:
+                parsed_url.append("(")
+
+            bracket_depth += 1
+
+        else:
+            parsed_url.append(char)
+
+        if bracket_depth > 2:
+            raise SyntaxError("Too many nested levels of brackets.")
+
+    return "".join(parsed_url)
+
+
+def _split_directives(text):
+    """Split a + separated run of directives, dropping empty ones."""
+
+    return tuple(directive for directive in text.split("+") if directive)
+
+
+def compile_block(block):
+    """Compile a single block, without its outer brackets, into a tuple
+    of choice groups.
+
+    Each group is a tuple of options and each option is a tuple of
+    directives. Plain directives become a group with a single option,
+    whereas a nested block such as (vary_cookie,vary_referer) becomes a
+    group with one option per comma separated entry.
+
+    """
+
+    groups = []
+    position = 0
+
+    for match in _NESTED_BLOCK_RE.finditer(block):
+        fixed = _split_directives(block[position:match.start()])
+        if fixed:
+            groups.append((fixed,))
+
+        options = tuple(_split_directives(option) for option in match.group()[1:-1].split(","))
+        groups.append(options)
+        position = match.end()
+
+    fixed = _split_directives(block[position:])
+    if fixed:
+        groups.append((fixed,))
+
+    return tuple(groups)
+
+
+def seeded_random(seed=None):
+    """Return what a request makes its random choices with: a
+    random.Random seeded with seed, or the random module itself for
+    unseeded requests.
+
+    """
+
+    if seed is None:
+        return random
+    return random.Random(seed)
+
+
+def resolve_block(block, rng=random):
+    """Pick one option from each choice group in a compiled block and
+    return the resulting list of directives, in URL order.
+
+    """
+
+    directives = []
+
+    for options in block:
+        if len(options) == 1:
+            option = options[0]
+        else:
+            option = rng.choice(options)
+
+        for directive in option:
+            if directive not in directives:
+                directives.append(directive)
+
+    return directives
+
+
+def _unique(blocks):
+    """Drop repeated blocks whilst keeping their order."""
+
+    unique_blocks = []
+    for block in blocks:
+        if block not in unique_blocks:
+            unique_blocks.append(block)
+    return unique_blocks
+
+
+class DirectivePlan(namedtuple('DirectivePlan',
+                               ['all', 'none', 'filtered', 'filter_mask', 'seed'])):
+    """The compiled form of a crawlbin URL path.
+
+    - all: blocks that apply to every user agent
+    - none: blocks without a user agent filter, which are only used if
+      no filtered block matches
+    - filtered: (filter, category bit, blocks) for every other filter
+      used. Unknown filters have a category bit of 0 and never match.
+    - filter_mask: every category bit used in filtered
+    - seed: n of the first seed_<n> directive in the URL, or None
+
+    Plans are immutable so a single plan can safely be shared between
+    requests. Nothing random happens until evaluate() is called.
+
+    """
+
+    __slots__ = ()
+
+    def matching_blocks(self, ua_mask):
+        """Return the compiled blocks that could apply to a user agent
+        in the categories set in ua_mask.
+
+        """
+
+        if not ua_mask & self.filter_mask:
+            return _unique(self.all + self.none)
+
+        matched_blocks = list(self.all)
+
+        for ua_filter, category, blocks in self.filtered:
+            if ua_mask & category:
+                matched_blocks.extend(blocks)
+
+        return _unique(matched_blocks)
+
+    def is_deterministic(self, ua_mask):
+        """Return True if evaluating the plan for a user agent in the
+        categories set in ua_mask always gives the same directives,
+        i.e. the plan is seeded, or there is at most one matching block
+        and it has no nested choices.
+
+        """
+
+        if self.seed is not None:
+            return True
+
+        blocks = self.matching_blocks(ua_mask)
+
+        if len(blocks) > 1:
+            return False
+
+        return all(len(options) == 1 for block in blocks for options in block)
+
+    def evaluate(self, ua_mask, rng=None):
+        """Select a random block matching the user agent categories in
+        ua_mask and return its list of directives.
+
+        The choices are made with rng, which defaults to
+        seeded_random(self.seed).
+
+        """
+
+        if rng is None:
+            rng = seeded_random(self.seed)
+
+        blocks = self.matching_blocks(ua_mask)
+
+        if blocks:
+            return resolve_block(rng.choice(blocks), rng)
+
+        return []
+
+
+def _block_seed(block):
+    for options in block:
+        for option in options:
+            for directive in option:
+                match = _SEED_RE.match(directive)
+                if match:
+                    return int(match.group(1))
+    return None
+
+
+def _compile_url_path(url_path):
+    parsed_url = parse_brackets(url_path)
+
+    blocks_by_filter = OrderedDict()
+    seed = None
+
+    for this_block in _BLOCK_RE.findall(parsed_url):
+        this_block_trimmed = this_block[1:-1]
+
+        user_agent_directive = _USER_AGENT_FILTER_RE.match(this_block_trimmed)
+
+        if user_agent_directive:
+            ua_filter = user_agent_directive.group()[:-1]
+            this_block_trimmed = this_block_trimmed[user_agent_directive.end():]
+        else:
+            ua_filter = "none"
+
+        blocks = blocks_by_filter.setdefault(ua_filter, [])
+        block = compile_block(this_block_trimmed)
+        if seed is None:
+            seed = _block_seed(block)
+        if block not in blocks:
+            blocks.append(block)
+
+    all_blocks = tuple(blocks_by_filter.pop("all", ()))
+    none_blocks = tuple(blocks_by_filter.pop("none", ()))
+
+    filtered = []
+    filter_mask = 0
+    for ua_filter, blocks in blocks_by_filter.items():
+        category = USER_AGENT_CATEGORIES.get(ua_filter, 0)
+        filtered.append((ua_filter, category, tuple(blocks)))
+        filter_mask |= category
+
+    return DirectivePlan(all_blocks, none_blocks, tuple(filtered), filter_mask, seed)
+
+
+def compile_url_path(url_path):
+    """Return the DirectivePlan for url_path, compiling it the first
+    time it is seen and serving it from plan_cache after that.
+
+    url_path is should not contain the domain name or forward slashes.
+
+    A SyntaxError is raised for unbalanced or too deeply nested
+    brackets. Such paths are not cached.
+
+    """
+
+    return plan_cache.get_or_create(url_path, _compile_url_path)
+
+
+def random_nested_directives(block, rng=random):
+    """If the specified block contains any comma separated nested
+    directives, then randomly elimante all but one of those directives.
+
+    The block being passed in should be a single block without the outer
+    set of brackets. For example:
+
+    meta_index+(vary_cookie,vary_referer)
+
+    which would be one of the blocks in this URL:
+
+    http://crawlbin.com/[meta_index+[vary_cookie,vary_referer]][response_404]/
+
+    """
+
+    return "+".join(resolve_block(compile_block(block), rng))
+
+
+def collate_blocks_by_user_agent(url_path):
+    """Produce a dictionary keyed on user agent categories, with each
+    entry containing a list of all the blocks that are specific to that
+    category. Anything without a specified category goes into 'all'.
+
+    Also in this function we take the opportunity to randomly select
+    directives whenever there are multiple options within a nested block.
+
+    url_path is should not contain the domain name or forward slashes.
+
+    """
+
+    plan = compile_url_path(url_path)
+
+    trimmed_blocks_for_ua_filter = dict()
+    trimmed_blocks_for_ua_filter["none"] = set()
+
+    for ua in USER_AGENT_CATEGORIES:
+        trimmed_blocks_for_ua_filter[ua] = set()
+
+    pairs = [("all", plan.all), ("none", plan.none)]
+    pairs.extend((ua_filter, blocks) for ua_filter, category, blocks in plan.filtered)
+    for ua_filter, blocks in pairs:
+        resolved = trimmed_blocks_for_ua_filter.setdefault(ua_filter, set())
+        for block in blocks:
+            resolved.add("+".join(resolve_block(block)))
+
+    return trimmed_blocks_for_ua_filter
+
+
+def get_directives_from_random_matching_block(url, user_agent, rng=None):
+    """Select a random block from all those that could apply to this user
+    agent. Nested blocks with multiple choices to randomise between are
+    resolved once the block has been chosen.
+
+    url here is the last part of the url, without any slashes. Both its
+    compiled plan and the user agent's categories are cached, so only
+    the random choices are repeated for each request. They are made
+    with rng, if given, and otherwise as the plan's seed says.
+
+    We return a list of the directives within the block we selected.
+
+    """
+
+    plan = compile_url_path(url)
+
+    return plan.evaluate(classify_user_agent(user_agent), rng)
@@ -0,0 +1,121 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+User agent classification.
+
+Blocks in a crawlbin URL can be limited to a category of user agent,
+for example [googlebot:response_404]. Working out which categories a
+user agent string belongs to means running it through the full list of
+ua-parser regexes, so the result is reduced to a bitmask and cached on
+the raw user agent string. Our traffic comes from a small number of
+crawlers, so almost every request is a cache hit.
+
+user_agents, and the ua-parser regexes it loads, are only imported when
+the first user agent is classified, so importing crawlbin.core is quick.
+
+"""
+
+import logging
+
+from collections import OrderedDict
+
+from crawlbin.core.cache import LRUCache
+
+logger = logging.getLogger('crawlbin.core.user_agent')
+
+UA_ALL = 1 << 0
+UA_BOT = 1 << 1
+UA_GOOGLEBOT = 1 << 2
+UA_DESKTOP = 1 << 3
+UA_MOBILE = 1 << 4
+UA_TABLET = 1 << 5
+UA_IE = 1 << 6
+UA_FF = 1 << 7
+
+# The user agent filters that can prefix a block, and their bits.
+USER_AGENT_CATEGORIES = OrderedDict([
+    ('all', UA_ALL),
+    ('bot', UA_BOT),
+    ('googlebot', UA_GOOGLEBOT),
+    ('desktop', UA_DESKTOP),
+    ('mobile', UA_MOBILE),
+    ('tablet', UA_TABLET),
+    ('ie', UA_IE),
+    ('ff', UA_FF),
+])
+
+user_agent_cache = LRUCache(max_size=10000)
+
+
+def _classify(user_agent):
+    import user_agents
+
+    ua = user_agents.parse(user_agent)
+
+    mask = UA_ALL
+
+    if ua.is_bot:
+        mask |= UA_BOT
+    if ua.browser.family == "Googlebot":
+        mask |= UA_GOOGLEBOT
+    if ua.browser.family == "IE":
+        mask |= UA_IE
+    if ua.browser.family == "Firefox":
+        mask |= UA_FF
+    if ua.is_mobile:
+        mask |= UA_MOBILE
+    if ua.is_pc:
+        mask |= UA_DESKTOP
+    if ua.is_tablet:
+        mask |= UA_TABLET
+
+    return mask
+
+
+def classify_user_agent(user_agent):
+    """Return the bitmask of categories the user agent string falls
+    into. UA_ALL is always set.
+
+    """
+
+    return user_agent_cache.get_or_create(user_agent, _classify)
+
+
+def category_names(mask):
+    """Return the names of the categories set in mask."""
+
+    return [name for name, bit in USER_AGENT_CATEGORIES.items() if mask & bit]
+
+
+def configure_user_agent_cache(max_size):
+    """Set the maximum number of user agents to remember."""
+
+    user_agent_cache.resize(max_size)
+
+
+def warm_user_agent_cache(path):
+    """Classify every user agent in the file at path, one per line, so
+    that they are already cached when requests arrive. Blank lines and
+    lines starting with # are skipped.
+
+    Returns the number of user agents classified.
+
+    """
+
+    count = 0
+
+    with open(path) as user_agent_file:
+        for line in user_agent_file:
+            user_agent = line.strip()
+            if not user_agent or user_agent.startswith('#'):
+                continue
+
+            classify_user_agent(user_agent)
+            count += 1
+
+    logger.info('Warmed the user agent cache with %d user agents from %s', count, path)
+
+    return count
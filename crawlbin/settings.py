@@ -37,6 +37,7 @@ INSTALLED_APPS = (
     # 'django.contrib.sessions',
     # 'django.contrib.messages',
     'django.contrib.staticfiles',
+    'pages',
 )
 
 MIDDLEWARE_CLASSES = (
@@ -114,3 +115,79 @@ KEEN_PROJECT_ID = ''
 KEEN_WRITE_KEY = ''
 KEEN_READ_KEY = ''
 KEEN_MASTER_KEY = ''
+# The scoped key, made with keen.scoped_keys.encrypt(KEEN_MASTER_KEY,
+# {'allowed_operations': ['write']}), that pages record link clicks
+# with. Each encryption gives a different key, so without one every
+# worker makes its own and their pages differ in it.
+KEEN_SCOPED_WRITE_KEY = ''
+
+# Number of user agent strings to remember the categories of.
+CRAWLBIN_USER_AGENT_CACHE_SIZE = 10000
+
+# Optional file of user agent strings, one per line, to classify when a
+# worker starts so that known crawlers never miss the cache.
+CRAWLBIN_USER_AGENT_WARM_FILE = None
+
+# Load templates, URL plans, user agent regexes and the public suffix
+# list when the WSGI application is loaded, rather than on the first
+# requests (see pages.warmup). Paths in the optional file, one per line,
+# are compiled and run through the renderer along with the common ones,
+# though their pages are still rendered afresh when first requested.
+CRAWLBIN_WARM_UP = True
+CRAWLBIN_PATH_WARM_FILE = None
+
+# Maximum number of responses held back by delay_* directives at once.
+# Beyond this crawlbin answers with a 503 rather than delaying.
+CRAWLBIN_MAX_DELAYED_REQUESTS = 10000
+
+# Maximum number of responses being paced out by ttfb_*, throttle_* and
+# drip_* directives at once. Beyond this crawlbin answers with a 503.
+CRAWLBIN_MAX_PACED_RESPONSES = 10000
+
+# Analytics events are queued and sent to Keen in batches by a
+# background thread. Set the sink to 'local' to keep them in memory
+# instead, e.g. when working offline, or to None to turn analytics off.
+CRAWLBIN_ANALYTICS_SINK = 'keen'
+CRAWLBIN_ANALYTICS_QUEUE_SIZE = 10000
+CRAWLBIN_ANALYTICS_BATCH_SIZE = 500
+CRAWLBIN_ANALYTICS_FLUSH_INTERVAL = 5
+# Referring domains of visits, found from tldextract's bundled public
+# suffix list snapshot, are remembered for this many referring hosts.
+CRAWLBIN_REFERRER_CACHE_SIZE = 10000
+
+# Pages with no random element are rendered once and then served from
+# memory. These limit how many are kept, and their total size.
+CRAWLBIN_RESPONSE_CACHE_SIZE = 10000
+CRAWLBIN_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Share the plan, user agent and response caches between every worker
+# on the host, through memory-mapped files in this directory (see
+# crawlbin.core.shared_cache). Each worker keeps its own caches in front
+# of them. None keeps the caches to each worker. The sizes are numbers
+# of entries, and fixed when the files are made.
+CRAWLBIN_SHARED_CACHE_DIR = None
+CRAWLBIN_SHARED_PLAN_CACHE_SIZE = 16384
+CRAWLBIN_SHARED_USER_AGENT_CACHE_SIZE = 65536
+CRAWLBIN_SHARED_RESPONSE_CACHE_SIZE = 16384
+
+# Compress responses with the best encoding the client accepts: brotli,
+# if the brotli package is installed, gzip or deflate. The compressed
+# bodies of cached pages are cached too, within these limits.
+CRAWLBIN_COMPRESSION = True
+CRAWLBIN_ENCODED_CACHE_SIZE = 10000
+CRAWLBIN_ENCODED_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Render the directive page with crawlbin's own precompiled renderer
+# rather than the Django template engine. The output is identical.
+CRAWLBIN_FAST_RENDERER = True
+
+# Route directive paths straight to the handle view, bypassing the
+# middleware and URL resolution (see pages.dispatch). Directive responses
+# then get nothing from the middleware, such as X-Frame-Options, so this
+# is meant for the lean profile, crawlbin.settings_lean.
+CRAWLBIN_FRONT_DISPATCH = False
+
+# Send a Server-Timing header with the time spent in each stage of every
+# request. Without it the header is only sent for the server_timing
+# directive. Stage timings are always collected for /metrics.
+CRAWLBIN_SERVER_TIMING = False
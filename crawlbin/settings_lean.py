@@ -0,0 +1,20 @@
+"""
+Lean serving profile for crawlbin in production.
+
+None of the apps the default middleware is for are installed and there
+is no database, so the chain is emptied, and directive paths are routed
+straight to the handle view (see pages.dispatch). Use it with
+DJANGO_SETTINGS_MODULE=crawlbin.settings_lean, or --settings.
+"""
+
+from crawlbin.settings import *
+
+DEBUG = False
+
+TEMPLATE_DEBUG = False
+
+# Sessions, CSRF, auth and messages have nothing to work on, and
+# X-Frame-Options isn't wanted on pages made to be crawled.
+MIDDLEWARE_CLASSES = ()
+
+CRAWLBIN_FRONT_DISPATCH = True
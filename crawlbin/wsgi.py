@@ -12,3 +12,20 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "crawlbin.settings")
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+from django.conf import settings
+from crawlbin.core.user_agent import configure_user_agent_cache
+from crawlbin.core.user_agent import warm_user_agent_cache
+from pages.dispatch import DirectiveDispatcher
+from pages.warmup import warm_up
+
+configure_user_agent_cache(settings.CRAWLBIN_USER_AGENT_CACHE_SIZE)
+if settings.CRAWLBIN_SHARED_CACHE_DIR:
+    from pages.views import share_caches
+    share_caches(settings.CRAWLBIN_SHARED_CACHE_DIR)
+if settings.CRAWLBIN_USER_AGENT_WARM_FILE:
+    warm_user_agent_cache(settings.CRAWLBIN_USER_AGENT_WARM_FILE)
+if settings.CRAWLBIN_WARM_UP:
+    warm_up(application)
+if settings.CRAWLBIN_FRONT_DISPATCH:
+    application = DirectiveDispatcher(application)
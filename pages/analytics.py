@@ -0,0 +1,206 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Batched, background delivery of analytics events.
+
+Sending each event to Keen as it happens puts an HTTPS round trip on
+every request. Instead events are put on a bounded in-memory queue and
+a background thread sends them on in batches, through the client's bulk
+add_events() call. When the queue is full the oldest events are dropped
+and counted, so a slow or unreachable Keen can never hold up a request.
+
+"""
+
+import atexit
+import collections
+import datetime
+import logging
+import os
+import threading
+
+logger = logging.getLogger('crawlbin.pages.analytics')
+
+
+class KeenSink(object):
+    """Send batches of events to Keen. The client is made by calling
+    client_factory when the first batch is sent, so Keen and everything
+    it imports are only loaded by the background thread.
+
+    """
+
+    def __init__(self, client_factory):
+        self.client_factory = client_factory
+        self.client = None
+
+    def send(self, events):
+        """Send events, a dictionary of collection name to a list of
+        event bodies.
+
+        """
+
+        if self.client is None:
+            self.client = self.client_factory()
+        self.client.add_events(events)
+
+
+class LocalSink(object):
+    """Keep batches of events in memory rather than sending them
+    anywhere. Useful for development, tests and benchmarks.
+
+    Only the last max_batches batches are kept.
+
+    """
+
+    def __init__(self, max_batches=100):
+        self.batches = collections.deque(maxlen=max_batches)
+
+    def send(self, events):
+        self.batches.append(events)
+        logger.debug('Local analytics sink received %d events',
+                     sum(len(bodies) for bodies in events.values()))
+
+    @property
+    def events(self):
+        """Every (collection, body) pair in the kept batches."""
+
+        return [(collection, body)
+                for batch in self.batches
+                for collection, bodies in batch.items()
+                for body in bodies]
+
+
+class EventQueue(object):
+    """A bounded queue of analytics events, flushed to sink by a
+    background thread once batch_size events are waiting or every
+    flush_interval seconds, whichever comes first.
+
+    The thread is started by the first add_event() in each process, so
+    the queue is safe to create before a server forks its workers. It's
+    stopped, with a final flush, when the process exits. With background
+    set to False no thread is started and events are only sent when
+    flush() is called. Without a sink analytics are off: events are
+    dropped as they are added, and enabled is False.
+
+    """
+
+    def __init__(self, sink, max_size=10000, batch_size=500, flush_interval=5.0,
+                 background=True):
+        self.sink = sink
+        self.background = background
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._events = collections.deque()
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+
+    @property
+    def enabled(self):
+        return self.sink is not None
+
+    def add_event(self, collection, body):
+        """Queue an event for collection. The event is timestamped now,
+        rather than when it's eventually sent.
+
+        """
+
+        if self.sink is None:
+            return
+
+        body.setdefault('keen', {})['timestamp'] = datetime.datetime.utcnow().isoformat()
+
+        with self._condition:
+            if len(self._events) >= self.max_size:
+                self._events.popleft()
+                self.dropped += 1
+
+            self._events.append((collection, body))
+
+            if len(self._events) >= self.batch_size:
+                self._condition.notify()
+
+        if self.background and self._pid != os.getpid():
+            self._start()
+
+    def flush(self):
+        """Send everything that is currently queued."""
+
+        with self._flush_lock:
+            while True:
+                with self._condition:
+                    batch = [self._events.popleft()
+                             for _ in range(min(self.batch_size, len(self._events)))]
+
+                if not batch:
+                    return
+
+                events = collections.OrderedDict()
+                for collection, body in batch:
+                    events.setdefault(collection, []).append(body)
+
+                try:
+                    self.sink.send(events)
+                except Exception:
+                    self.failed += len(batch)
+                    logger.exception('Failed to send %d analytics events', len(batch))
+                else:
+                    self.sent += len(batch)
+
+    def stop(self, timeout=10):
+        """Stop the background thread, flushing any queued events."""
+
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+        self.flush()
+
+    def stats(self):
+        """Return a dictionary of the queue counters."""
+
+        return {
+            'queued': len(self._events),
+            'max_size': self.max_size,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+    def _start(self):
+        with self._condition:
+            if self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='crawlbin-analytics')
+            self._thread.daemon = True
+            self._thread.start()
+
+        atexit.register(self.stop)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._stopping and len(self._events) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+
+            self.flush()
+
+            if stopping:
+                return
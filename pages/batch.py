@@ -0,0 +1,126 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Batch evaluation input and output.
+
+The batch view and the crawlbin_eval command take a list of entries,
+each a path, a user agent and optionally a seed, either as a JSON array
+or with one entry per line. An entry is an object with path, user_agent
+and seed keys, or an array of the same in that order. On its own line
+it can also be tab separated: path, user agent and optionally the seed.
+The outcome for each entry is written as a line of NDJSON, in the same
+order.
+
+"""
+
+import json
+import logging
+
+logger = logging.getLogger('crawlbin.pages.batch')
+
+# Outcome lines are sent in chunks of this many.
+LINES_PER_CHUNK = 256
+
+
+class BatchEntry(object):
+    """One entry of a batch. error is set, and the rest may be None, if
+    the entry couldn't be understood.
+
+    """
+
+    __slots__ = ('index', 'path', 'user_agent', 'seed', 'error')
+
+    def __init__(self, index, path=None, user_agent=None, seed=None, error=None):
+        self.index = index
+        self.path = path
+        self.user_agent = user_agent
+        self.seed = seed
+        self.error = error
+
+
+def _entry(index, item):
+    if isinstance(item, dict):
+        path = item.get('path')
+        user_agent = item.get('user_agent', '')
+        seed = item.get('seed')
+    elif isinstance(item, list) and 2 <= len(item) <= 3:
+        path, user_agent = item[:2]
+        seed = item[2] if len(item) == 3 else None
+    else:
+        return BatchEntry(index, error='expected an object or a [path, user_agent, seed] array')
+
+    if not isinstance(path, basestring) or not isinstance(user_agent, basestring):
+        return BatchEntry(index, error='path and user_agent must be strings')
+    if seed is not None and (not isinstance(seed, (int, long)) or isinstance(seed, bool)):
+        return BatchEntry(index, error='seed must be an integer')
+
+    return BatchEntry(index, path, user_agent, seed)
+
+
+def parse_json(body):
+    """Yield the BatchEntry for each item of a JSON array."""
+
+    try:
+        items = json.loads(body)
+    except ValueError as e:
+        yield BatchEntry(0, error='invalid JSON: %s' % e)
+        return
+
+    if not isinstance(items, list):
+        yield BatchEntry(0, error='expected a JSON array')
+        return
+
+    for index, item in enumerate(items):
+        yield _entry(index, item)
+
+
+def parse_line(index, line):
+    """Return the BatchEntry for a line of JSON or tab separated values."""
+
+    if line[:1] not in ('{', '['):
+        fields = line.split('\t')
+        if not 2 <= len(fields) <= 3:
+            return BatchEntry(index, error='expected path, user agent and seed, tab separated')
+        if len(fields) == 3:
+            try:
+                fields[2] = int(fields[2])
+            except ValueError:
+                return BatchEntry(index, error='seed must be an integer')
+        return _entry(index, fields)
+
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        return BatchEntry(index, error='invalid JSON: %s' % e)
+    return _entry(index, item)
+
+
+def parse_lines(lines, start=0):
+    """Yield the BatchEntry for each line, numbering them from start.
+    Blank lines and lines starting with # are skipped, but counted.
+
+    """
+
+    for index, line in enumerate(lines, start):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield parse_line(index, line)
+
+
+def ndjson_chunks(records, lines_per_chunk=LINES_PER_CHUNK):
+    """Yield records serialised as NDJSON, a chunk of lines at a time."""
+
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, separators=(',', ':')))
+        if len(lines) >= lines_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
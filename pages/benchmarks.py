@@ -0,0 +1,576 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Benchmarks for the crawlbin hot path.
+
+Each benchmark is registered with @benchmark and returns a list of
+operations, zero argument callables, that are run in turn and timed
+individually. Results are reported as operations per second and latency
+percentiles, and can be compared with a saved baseline so regressions
+are caught. See manage.py crawlbin_bench.
+
+The same view workloads can also be run over HTTP against a running
+server, from concurrent keep-alive connections, to compare deployments,
+and startup measured in fresh interpreters: how long the application
+takes to import and how long its first requests take.
+
+"""
+
+import itertools
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import timeit
+
+from collections import OrderedDict
+from io import BytesIO
+
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+from crawlbin.core import directives as core_directives
+from crawlbin.core import graph as core_graph
+from crawlbin.core import url as core_url
+from crawlbin.core.shared_cache import SharedCache
+from pages.referrers import ReferrerDomains
+
+logger = logging.getLogger('crawlbin.pages.benchmarks')
+
+BENCHMARKS = OrderedDict()
+
+# A realistic mix of crawlbin URL paths.
+URLS = OrderedDict([
+    ('simple', 'meta_noindex'),
+    ('multi_block', '[meta_noindex][response_404][canonical_self+vary_cookie]'),
+    ('nested', '[meta_index+[vary_cookie,vary_referer]][h1_off+[response_301,response_302]]'),
+    ('ua_filtered', '[googlebot:response_404][mobile:canonical_home][all:vary_user_agent]'
+                    '[h1_multiple]'),
+    ('long', 'a/b/c/d/' + '+'.join([
+        'meta_follow', 'meta_noindex', 'header_nofollow', 'header_index', 'h1_multiple',
+        'canonical_self', 'html_canonical_home', 'vary_accept_encoding', 'vary_user_agent',
+        'vary_cookie', 'vary_referer', 'response_302',
+    ])),
+])
+
+USER_AGENTS = OrderedDict([
+    ('googlebot', 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'),
+    ('bingbot', 'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)'),
+    ('firefox', 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:35.0) Gecko/20100101 Firefox/35.0'),
+    ('ie', 'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; Trident/6.0)'),
+    ('iphone', 'Mozilla/5.0 (iPhone; CPU iPhone OS 8_1 like Mac OS X) AppleWebKit/600.1.4 '
+               '(KHTML, like Gecko) Version/8.0 Mobile/12B411 Safari/600.1.4'),
+    ('ipad', 'Mozilla/5.0 (iPad; CPU OS 8_1 like Mac OS X) AppleWebKit/600.1.4 '
+             '(KHTML, like Gecko) Version/8.0 Mobile/12B410 Safari/600.1.4'),
+])
+
+# The directives from every URL in the mix, for the directive helpers.
+DIRECTIVE_LISTS = [
+    ['meta_noindex'],
+    ['meta_noindex', 'response_404', 'canonical_self', 'vary_cookie'],
+    URLS['long'].split('/')[-1].split('+'),
+]
+
+
+def benchmark(name):
+    """Register the decorated function as the benchmark name. The
+    function is called once to set up and returns the operations.
+
+    """
+
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+def _last_parts():
+    return [url.split('/')[-1] for url in URLS.values()]
+
+
+@benchmark('url.parse_brackets')
+def _parse_brackets():
+    return [lambda part=part: core_url.parse_brackets(part) for part in _last_parts()]
+
+
+@benchmark('url.compile_url_path.uncached')
+def _compile_url_path():
+    return [lambda part=part: core_url._compile_url_path(part) for part in _last_parts()]
+
+
+@benchmark('url.collate_blocks_by_user_agent')
+def _collate_blocks_by_user_agent():
+    return [lambda part=part: core_url.collate_blocks_by_user_agent(part)
+            for part in _last_parts()]
+
+
+@benchmark('url.get_directives_from_random_matching_block')
+def _get_directives_from_random_matching_block():
+    return [lambda part=part, user_agent=user_agent:
+            core_url.get_directives_from_random_matching_block(part, user_agent)
+            for part in _last_parts()
+            for user_agent in USER_AGENTS.values()]
+
+
+REFERERS = [
+    'https://www.google.co.uk/',
+    'http://forums.example.com/thread/1?page=2',
+    'https://user@blog.example.co.jp:8443/post',
+    '/',
+]
+
+
+@benchmark('referrer.cold')
+def _referrer_cold():
+    # A new worker: the suffix list snapshot is loaded and every host
+    # looked up for the first time.
+    return [lambda: [ReferrerDomains().domain(referer) for referer in REFERERS]]
+
+
+@benchmark('referrer.warm')
+def _referrer_warm():
+    referrer_domains = ReferrerDomains()
+    referrer_domains.load()
+    return [lambda referer=referer: referrer_domains.domain(referer) for referer in REFERERS]
+
+
+def _shared_plan_cache():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'plans.cache')
+    cache = SharedCache(path, max_size=4096)
+    # The mapping outlives the file.
+    os.remove(path)
+    os.rmdir(directory)
+
+    for url in URLS.values():
+        cache.set(url, core_url.compile_url_path(url))
+    return cache
+
+
+@benchmark('shared_cache.get')
+def _shared_cache_get():
+    # A plan another worker compiled, read from the shared cache.
+    cache = _shared_plan_cache()
+    return [lambda url=url: cache.get(url) for url in URLS.values()]
+
+
+@benchmark('shared_cache.set')
+def _shared_cache_set():
+    cache = _shared_plan_cache()
+    plans = [(url, core_url.compile_url_path(url)) for url in URLS.values()]
+    return [lambda url=url, plan=plan: cache.set(url, plan) for url, plan in plans]
+
+
+@benchmark('graph.outlinks')
+def _outlinks():
+    return [lambda links=links: core_graph.outlinks('/n12345/site_1+links_%d/' % links, 1, links)
+            for links in (10, 100)]
+
+
+def _directive_benchmark(name, function, *args):
+    @benchmark('directive.' + name)
+    def setup():
+        return [lambda directives=directives: function(directives, *args)
+                for directives in DIRECTIVE_LISTS]
+
+
+_directive_benchmark('handle_redirect', core_directives.handle_redirect,
+                     'http://crawlbin.com/a/')
+_directive_benchmark('h1_directive', core_directives.h1_directive)
+_directive_benchmark('title_tag_directive', core_directives.title_tag_directive)
+_directive_benchmark('index_follow_directives', core_directives.index_follow_directives)
+_directive_benchmark('canonical_directives', core_directives.canonical_directives,
+                     'http://crawlbin.com', 'http://crawlbin.com/a/b/', 'http://crawlbin.com/a/')
+_directive_benchmark('vary_directives', core_directives.vary_directives)
+_directive_benchmark('delay_directives', core_directives.delay_directives)
+_directive_benchmark('evaluate_directives', core_directives.evaluate_directives,
+                     'http://crawlbin.com', 'http://crawlbin.com/a/b/', 'http://crawlbin.com/a/')
+
+
+def wsgi_environ(path, user_agent, host='crawlbin.com', extra=None):
+    """Return a WSGI environ for a GET of path, updated with extra."""
+
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': host,
+        'HTTP_USER_AGENT': user_agent,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(b''),
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    environ.update(extra or {})
+    return environ
+
+
+def wsgi_get(application, path, user_agent, extra=None):
+    """Request path from the WSGI application in-process and return the
+    status line and body. extra is added to the environ.
+
+    """
+
+    response_start = []
+
+    def start_response(status, headers, exc_info=None):
+        response_start.append(status)
+        return lambda data: None
+
+    result = application(wsgi_environ(path, user_agent, extra=extra), start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    return response_start[0], body
+
+
+def _wsgi_application():
+    from django.core.servers.basehttp import get_internal_wsgi_application
+    from pages import views
+    from pages.analytics import LocalSink
+
+    # Keep benchmark traffic out of the real analytics.
+    views.analytics.sink = LocalSink()
+
+    return get_internal_wsgi_application()
+
+
+def _handle_operations(application):
+    return [lambda url=url, user_agent=user_agent:
+            wsgi_get(application, '/' + url + '/', user_agent)
+            for url in URLS.values()
+            for user_agent in USER_AGENTS.values()]
+
+
+@benchmark('view.handle')
+def _handle():
+    return _handle_operations(_wsgi_application())
+
+
+@benchmark('view.handle.django')
+def _handle_django():
+    from pages.dispatch import DirectiveDispatcher
+
+    # Through Django's middleware and URL resolution, even if the
+    # application has a dispatcher in front.
+    application = _wsgi_application()
+    if isinstance(application, DirectiveDispatcher):
+        application = application.handler
+    return _handle_operations(application)
+
+
+@benchmark('view.handle.dispatch')
+def _handle_dispatch():
+    from pages.dispatch import DirectiveDispatcher
+
+    application = _wsgi_application()
+    if not isinstance(application, DirectiveDispatcher):
+        application = DirectiveDispatcher(application)
+    return _handle_operations(application)
+
+
+@benchmark('view.handle.gzip')
+def _handle_gzip():
+    application = _wsgi_application()
+    extra = {'HTTP_ACCEPT_ENCODING': 'gzip, deflate'}
+
+    return [lambda url=url, user_agent=user_agent:
+            wsgi_get(application, '/' + url + '/', user_agent, extra)
+            for url in URLS.values()
+            for user_agent in USER_AGENTS.values()]
+
+
+@benchmark('view.index')
+def _index():
+    application = _wsgi_application()
+    return [lambda: wsgi_get(application, '/', USER_AGENTS['firefox'])]
+
+
+@benchmark('view.robots')
+def _robots():
+    application = _wsgi_application()
+    return [lambda: wsgi_get(application, '/robots.txt', USER_AGENTS['googlebot'])]
+
+
+def _http_workloads():
+    handle = [('/' + url + '/', {'User-Agent': user_agent})
+              for url in URLS.values()
+              for user_agent in USER_AGENTS.values()]
+    gzip = [(path, dict(headers, **{'Accept-Encoding': 'gzip, deflate'}))
+            for path, headers in handle]
+
+    return OrderedDict([
+        ('http.handle', handle),
+        ('http.handle.gzip', gzip),
+        ('http.index', [('/', {'User-Agent': USER_AGENTS['firefox']})]),
+        ('http.robots', [('/robots.txt', {'User-Agent': USER_AGENTS['googlebot']})]),
+    ])
+
+
+HTTP_WORKLOADS = _http_workloads()
+
+
+def _percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def _summary(samples, seconds):
+    """Statistics for sorted latency samples taking seconds in all."""
+
+    return OrderedDict([
+        ('iterations', len(samples)),
+        ('ops_per_sec', round(len(samples) / seconds, 1) if seconds else None),
+        ('mean_us', round(sum(samples) / len(samples) * 1e6, 2) if samples else None),
+        ('p50_us', round(_percentile(samples, 0.5) * 1e6, 2) if samples else None),
+        ('p90_us', round(_percentile(samples, 0.9) * 1e6, 2) if samples else None),
+        ('p99_us', round(_percentile(samples, 0.99) * 1e6, 2) if samples else None),
+        ('max_us', round(samples[-1] * 1e6, 2) if samples else None),
+    ])
+
+
+def measure(operations, iterations, warmup=None):
+    """Run the operations in turn, iterations times in total, after a
+    warmup, and return the timing statistics.
+
+    """
+
+    timer = timeit.default_timer
+
+    if warmup is None:
+        warmup = max(len(operations), iterations // 10)
+    for i in range(warmup):
+        operations[i % len(operations)]()
+
+    samples = []
+    for i in range(iterations):
+        operation = operations[i % len(operations)]
+        start = timer()
+        operation()
+        samples.append(timer() - start)
+
+    total = sum(samples)
+    samples.sort()
+
+    return _summary(samples, total)
+
+
+def measure_http(host, port, requests, iterations, concurrency=10):
+    """GET the (path, headers) requests in turn, iterations times in
+    total, from concurrency threads each with its own keep-alive
+    connection, and return the timing statistics. Operations per second
+    are for the requests as a whole rather than per connection.
+
+    """
+
+    timer = timeit.default_timer
+    counter = itertools.count()
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        latencies = []
+        failures = 0
+        connection = None
+
+        while True:
+            i = next(counter)
+            if i >= iterations:
+                break
+
+            path, headers = requests[i % len(requests)]
+            if connection is None:
+                connection = httplib.HTTPConnection(host, port, timeout=30)
+
+            start = timer()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (httplib.HTTPException, socket.error):
+                failures += 1
+                connection.close()
+                connection = None
+                continue
+            latencies.append(timer() - start)
+
+            if response.will_close:
+                connection.close()
+                connection = None
+
+        if connection is not None:
+            connection.close()
+
+        with lock:
+            samples.extend(latencies)
+            errors.append(failures)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = timer() - start
+
+    samples.sort()
+    summary = _summary(samples, seconds)
+    summary['concurrency'] = concurrency
+    summary['errors'] = sum(errors)
+    return summary
+
+
+# Run in a fresh interpreter by measure_startup(), with the warm-up
+# setting substituted in.
+_STARTUP_SCRIPT = """
+import json
+import timeit
+
+from django.conf import settings
+
+settings.CRAWLBIN_WARM_UP = %r
+
+start = timeit.default_timer()
+from crawlbin.wsgi import application
+imported = timeit.default_timer()
+
+from pages.benchmarks import wsgi_get
+timings = [imported - start]
+for path, user_agent in %r:
+    start = timeit.default_timer()
+    wsgi_get(application, path, user_agent)
+    timings.append(timeit.default_timer() - start)
+
+print(json.dumps(timings))
+"""
+
+# What a fresh worker is asked for first: a page, the index and the same
+# page again.
+STARTUP_REQUESTS = [
+    ('/[googlebot:meta_noindex][response_404]/', USER_AGENTS['googlebot']),
+    ('/', USER_AGENTS['firefox']),
+    ('/[googlebot:meta_noindex][response_404]/', USER_AGENTS['googlebot']),
+]
+
+
+def measure_startup(runs=5):
+    """Start the application in runs fresh interpreters, with and
+    without warming it up, and return the median time to import it and
+    to serve each of STARTUP_REQUESTS, in milliseconds.
+
+    """
+
+    environ = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    names = ['import_ms'] + ['request_%d_ms' % (i + 1) for i in range(len(STARTUP_REQUESTS))]
+
+    results = OrderedDict()
+    for warm_up in (False, True):
+        logger.info('Measuring startup with warm up %s', 'on' if warm_up else 'off')
+        samples = []
+        for _ in range(runs):
+            output = subprocess.check_output(
+                [sys.executable, '-c', _STARTUP_SCRIPT % (warm_up, STARTUP_REQUESTS)],
+                env=environ)
+            samples.append(json.loads(output.splitlines()[-1]))
+
+        timings = OrderedDict()
+        for i, name in enumerate(names):
+            values = sorted(sample[i] for sample in samples)
+            timings[name] = round(values[len(values) // 2] * 1e3, 1)
+        results['warm_up' if warm_up else 'cold'] = timings
+
+    return OrderedDict([
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('runs', runs),
+        ('startup', results),
+    ])
+
+
+def run(names=None, iterations=1000):
+    """Run the named benchmarks, or all of them, and return the results
+    ready to be dumped as JSON.
+
+    """
+
+    results = OrderedDict()
+
+    for name, setup in BENCHMARKS.items():
+        if names and not any(selected in name for selected in names):
+            continue
+
+        logger.info('Running benchmark %s', name)
+        results[name] = measure(setup(), iterations)
+
+    return OrderedDict([
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('benchmarks', results),
+    ])
+
+
+def run_http(host, port, names=None, iterations=1000, concurrency=10):
+    """Run the named HTTP workloads, or all of them, against the server
+    at host and port, and return the results like run().
+
+    """
+
+    results = OrderedDict()
+
+    for name, requests in HTTP_WORKLOADS.items():
+        if names and not any(selected in name for selected in names):
+            continue
+
+        logger.info('Running HTTP workload %s against %s:%d', name, host, port)
+        # Warm up every path, so each worker has loaded the views.
+        measure_http(host, port, requests, len(requests) * concurrency, concurrency)
+        results[name] = measure_http(host, port, requests, iterations, concurrency)
+
+    return OrderedDict([
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('server', '%s:%d' % (host, port)),
+        ('benchmarks', results),
+    ])
+
+
+def compare(results, baseline, tolerance=0.2):
+    """Compare results with baseline results, returning a list of
+    (name, baseline ops/sec, current ops/sec) for each benchmark that
+    has slowed down by more than tolerance.
+
+    """
+
+    regressions = []
+
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if not previous or not previous.get('ops_per_sec') or not current['ops_per_sec']:
+            continue
+
+        if current['ops_per_sec'] < previous['ops_per_sec'] * (1 - tolerance):
+            regressions.append((name, previous['ops_per_sec'], current['ops_per_sec']))
+
+    return regressions
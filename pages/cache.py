@@ -0,0 +1,12 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+The request path caches moved to crawlbin.core.cache, which doesn't need
+Django. It is re-exported here for existing imports.
+
+"""
+
+from crawlbin.core.cache import LRUCache
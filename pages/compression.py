@@ -0,0 +1,17 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Content encodings moved to crawlbin.core.compression, which doesn't need
+Django. It is re-exported here for existing imports.
+
+"""
+
+from crawlbin.core.compression import COMPRESSION_LEVEL
+from crawlbin.core.compression import ENCODERS
+from crawlbin.core.compression import encode
+from crawlbin.core.compression import encoded_etag
+from crawlbin.core.compression import negotiate
+from crawlbin.core.compression import negotiation_cache
@@ -0,0 +1,74 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Validators and conditional GET support.
+
+Pages that are always the same for a host, path and resolved set of
+directives carry a strong ETag, a hash of exactly those things, and a
+Last-Modified date. Crawlers revalidating them with If-None-Match or
+If-Modified-Since get a 304 without the page being rendered.
+
+"""
+
+import hashlib
+import logging
+import random
+
+from django.utils.http import parse_etags
+from django.utils.http import parse_http_date_safe
+
+logger = logging.getLogger('crawlbin.pages.conditional')
+
+
+def page_etag(salt, parts, weak=False):
+    """Return an ETag for a page identified by salt and a sequence of
+    text parts.
+
+    """
+
+    digest = hashlib.sha1(salt)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+
+    etag = '"%s"' % digest.hexdigest()[:20]
+    if weak:
+        return 'W/' + etag
+    return etag
+
+
+def changing_etag(rng=random):
+    """Return an ETag that is different every time, drawn from rng."""
+
+    return '"%016x"' % rng.getrandbits(64)
+
+
+def is_not_modified(request, etag=None, last_modified=None):
+    """Whether the client already has the response with the etag and
+    Last-Modified header value given, according to the request's
+    If-None-Match and If-Modified-Since headers.
+
+    If-None-Match takes precedence, and ETags are compared weakly as is
+    required for GET requests.
+
+    """
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        return parse_etags(etag)[0] in parse_etags(if_none_match)
+
+    if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified:
+        since = parse_http_date_safe(if_modified_since)
+        modified = parse_http_date_safe(last_modified)
+        return since is not None and modified is not None and modified <= since
+
+    return False
+
@@ -0,0 +1,238 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Holding responses back for the delay_* directives, and pacing them out
+for the ttfb_*, throttle_* and drip_* directives.
+
+Under a normal WSGI server the only way to delay a response is to sleep
+in the worker, which ties it up for the whole delay. When crawlbin is
+served by its own event loop server (manage.py runcrawlbin) the request
+environ carries the event loop, and the delay is instead attached to the
+response for the server to schedule on a timer. Either way the number of
+delayed responses in flight is capped by CRAWLBIN_MAX_DELAYED_REQUESTS.
+
+Paced responses work the same way, with the Pacing attached to the
+response for the server to send it out a piece at a time on timers. The
+number of paced responses in flight is capped by
+CRAWLBIN_MAX_PACED_RESPONSES.
+
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+logger = logging.getLogger('crawlbin.pages.delays')
+
+# WSGI environ key under which the event loop server passes its loop.
+EVENT_LOOP_ENVIRON_KEY = 'crawlbin.event_loop'
+
+# Bytes sent each time a drip_<ms> response drips.
+DRIP_BYTES = 16
+
+# How often a throttled response is sent its next piece, in seconds.
+THROTTLE_INTERVAL = 0.1
+
+
+class DelayLimiter(object):
+    """Count the delayed responses in flight, refusing new ones once
+    max_in_flight is reached.
+
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Reserve a slot for a delayed response, returning False if
+        there are none left.
+
+        """
+
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                self.refused += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        """Give back a slot reserved by acquire()."""
+
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        """Return a dictionary of the limiter counters."""
+
+        return {
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'refused': self.refused,
+        }
+
+
+class Pacing(object):
+    """How to pace a response out: wait ttfb seconds before sending the
+    first byte, then send at most piece bytes every interval seconds.
+    piece is None if only the first byte is held back.
+
+    """
+
+    __slots__ = ('ttfb', 'piece', 'interval')
+
+    def __init__(self, ttfb=0, piece=None, interval=0):
+        self.ttfb = ttfb
+        self.piece = piece
+        self.interval = interval
+
+    def __repr__(self):
+        return 'Pacing(ttfb=%r, piece=%r, interval=%r)' % (self.ttfb, self.piece, self.interval)
+
+
+def make_pacing(ttfb_ms=0, throttle_kbps=0, drip_ms=0):
+    """Return the Pacing for the ttfb_<ms>, throttle_<kbps> and
+    drip_<ms> directives, or None if the response isn't paced.
+
+    throttle_kbps is in kilobits per second. When dripping and throttled
+    the response drips, but no faster than the throttle allows.
+
+    """
+
+    if not (ttfb_ms or throttle_kbps or drip_ms):
+        return None
+
+    pacing = Pacing(ttfb=ttfb_ms / 1000.0)
+
+    if throttle_kbps:
+        bytes_per_second = throttle_kbps * 1000 / 8.0
+        pacing.piece = max(1, int(bytes_per_second * THROTTLE_INTERVAL))
+        pacing.interval = pacing.piece / bytes_per_second
+
+    if drip_ms:
+        pacing.interval = drip_ms / 1000.0
+        if throttle_kbps:
+            pacing.interval = max(pacing.interval, DRIP_BYTES / bytes_per_second)
+        pacing.piece = DRIP_BYTES
+
+    return pacing
+
+
+delay_limiter = DelayLimiter(settings.CRAWLBIN_MAX_DELAYED_REQUESTS)
+pacing_limiter = DelayLimiter(settings.CRAWLBIN_MAX_PACED_RESPONSES)
+
+
+def _busy(message):
+    busy = HttpResponse(message, content_type="text/plain; charset=UTF-8", status=503)
+    busy['Retry-After'] = '1'
+    return busy
+
+
+def delay_response(request, response, delay):
+    """Hold response back for delay seconds.
+
+    If the request came through the event loop server the delay is
+    recorded on the response as crawlbin_delay and the server sends it
+    once the delay is up, releasing the slot. Otherwise we have no
+    choice but to sleep.
+
+    If too many delayed responses are already in flight a 503 is
+    returned straight away instead.
+
+    """
+
+    if not delay_limiter.acquire():
+        logger.warning('Refusing a %ss delay, %d delayed responses in flight',
+                       delay, delay_limiter.in_flight)
+        return _busy("Too many delayed responses in flight.\n")
+
+    if request.META.get(EVENT_LOOP_ENVIRON_KEY) is not None:
+        response.crawlbin_delay = delay
+        return response
+
+    try:
+        time.sleep(delay)
+    finally:
+        delay_limiter.release()
+
+    return response
+
+
+class _PacedBody(object):
+    """A streamed body holding a pacing slot until it is closed.
+
+    Without an event loop to pace it, the body paces itself by sleeping
+    between pieces.
+
+    """
+
+    def __init__(self, chunks, pacing, sleep):
+        self.chunks = chunks
+        self.pacing = pacing
+        self.sleep = sleep
+        self.closed = False
+
+    def __iter__(self):
+        if self.sleep:
+            return self._sleeping()
+        return iter(self.chunks)
+
+    def _sleeping(self):
+        pacing = self.pacing
+        time.sleep(pacing.ttfb)
+
+        for chunk in self.chunks:
+            if pacing.piece is None:
+                yield chunk
+                continue
+
+            for start in range(0, len(chunk), pacing.piece):
+                yield chunk[start:start + pacing.piece]
+                time.sleep(pacing.interval)
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        pacing_limiter.release()
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+
+
+def pace_response(request, response, pacing):
+    """Pace the streaming response out as pacing describes.
+
+    If the request came through the event loop server the pacing is
+    recorded on the response as crawlbin_pacing for the server to
+    schedule. Otherwise the body sleeps between pieces. Either way the
+    slot is released when the response is closed.
+
+    If too many paced responses are already in flight a 503 is returned
+    straight away instead.
+
+    """
+
+    if not pacing_limiter.acquire():
+        logger.warning('Refusing to pace a response, %d paced responses in flight',
+                       pacing_limiter.in_flight)
+        if getattr(response, 'crawlbin_delay', None):
+            # The 503 replaces a response the server would have delayed.
+            delay_limiter.release()
+        return _busy("Too many paced responses in flight.\n")
+
+    sleep = request.META.get(EVENT_LOOP_ENVIRON_KEY) is None
+    response.streaming_content = _PacedBody(response.streaming_content, pacing, sleep)
+    if not sleep:
+        response.crawlbin_pacing = pacing
+
+    return response
@@ -0,0 +1,112 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+A front WSGI dispatcher for directive paths.
+
+Almost every request crawlbin gets is for a directive path, which always
+ends up in pages.views.handle. Going through Django to get there means
+running the middleware chain, sending the request_started signal, which
+resets database connections crawlbin doesn't have, and matching the path
+against each pattern in pages.urls in turn.
+
+DirectiveDispatcher sits in front of Django's WSGI handler. Paths that
+pages.urls would route to handle are given straight to it, and anything
+else (the index, robots.txt, sitemaps, metrics, batches and static
+files) is passed on to Django. crawlbin.wsgi puts it in front when
+CRAWLBIN_FRONT_DISPATCH is on, as it is in crawlbin.settings_lean.
+
+Directive responses get none of the middleware's processing, so it is
+only turned on with a middleware chain that does nothing for them. They
+do get Django's response fixes, as every response through its handler
+does.
+
+"""
+
+import logging
+import re
+import sys
+
+from django.core import signals
+from django.core.exceptions import SuspiciousOperation
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.urlresolvers import get_resolver
+from django.http import HttpResponseBadRequest
+from django.utils.encoding import force_str
+
+logger = logging.getLogger('crawlbin.pages.dispatch')
+
+# The paths pages.urls routes to handle: anything ending in a slash but
+# the root and the old favicon URL. Like Django's, . stops at newlines.
+_DIRECTIVE_PATH_RE = re.compile(r'^/(?P<url>.*)/$')
+_DJANGO_PATHS = frozenset(['/favicon.ico/'])
+
+
+def directive_url(path_info):
+    """Return the url argument handle would be called with for
+    path_info, or None if pages.urls routes it elsewhere.
+
+    """
+
+    if path_info in _DJANGO_PATHS:
+        return None
+    match = _DIRECTIVE_PATH_RE.match(path_info)
+    return match.group('url') if match else None
+
+
+class DirectiveDispatcher(object):
+    """WSGI application calling the handle view directly for directive
+    paths and handler, Django's WSGI handler, for everything else.
+
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+
+        # Imported here, as the views need the application's settings.
+        from pages import views
+        self.view = views.handle
+
+    def __call__(self, environ, start_response):
+        if directive_url(environ.get('PATH_INFO', '/')) is None:
+            return self.handler(environ, start_response)
+
+        try:
+            request = WSGIRequest(environ)
+        except UnicodeDecodeError:
+            # Django turns it into a 400.
+            return self.handler(environ, start_response)
+
+        url = directive_url(request.path_info)
+        if url is None:
+            return self.handler(environ, start_response)
+
+        try:
+            response = self.view(request, url)
+        except SuspiciousOperation as e:
+            logging.getLogger('django.security.%s' % e.__class__.__name__).error(
+                force_str(e))
+            response = HttpResponseBadRequest()
+        except Exception:
+            signals.got_request_exception.send(sender=self.__class__, request=request)
+            response = self.handler.handle_uncaught_exception(request, get_resolver(None),
+                                                              sys.exc_info())
+
+        # As Django's handler does for every response: dropping the body
+        # of HEAD responses and making Location headers absolute.
+        try:
+            response = self.handler.apply_response_fixes(request, response)
+        except Exception:
+            signals.got_request_exception.send(sender=self.__class__, request=request)
+            response = self.handler.handle_uncaught_exception(request, get_resolver(None),
+                                                              sys.exc_info())
+        response._closable_objects.append(request)
+
+        status = '%s %s' % (response.status_code, response.reason_phrase)
+        response_headers = [(str(k), str(v)) for k, v in response.items()]
+        for cookie in response.cookies.values():
+            response_headers.append((str('Set-Cookie'), str(cookie.output(header=''))))
+        start_response(force_str(status), response_headers)
+        return response
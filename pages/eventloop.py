@@ -0,0 +1,230 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+A minimal single threaded event loop.
+
+This is just enough of an event loop for crawlbin's own server: file
+descriptor readiness callbacks and a heap of timers. Delayed and paced
+responses are timers rather than sleeping threads, so one process can
+hold thousands of them open at once.
+
+Signal handlers added with add_signal_handler() run from the loop like
+any other callback, never in the middle of one, so they are free to
+change the loop's state.
+
+"""
+
+import collections
+import errno
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import select
+import signal
+import time
+
+logger = logging.getLogger('crawlbin.pages.eventloop')
+
+
+class Timer(object):
+    """A callback scheduled by EventLoop.call_later(). Call cancel() to
+    stop it from running.
+
+    """
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class _Poller(object):
+    """Wrap epoll where it's available and poll everywhere else, which
+    both scale far beyond select's 1024 descriptor limit.
+
+    """
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poll = select.epoll()
+            self.READ = select.EPOLLIN
+            self.WRITE = select.EPOLLOUT
+            self.ERROR = select.EPOLLERR | select.EPOLLHUP
+            self._timeout_scale = 1.0
+            self._no_timeout = -1
+        else:
+            self._poll = select.poll()
+            self.READ = select.POLLIN
+            self.WRITE = select.POLLOUT
+            self.ERROR = select.POLLERR | select.POLLHUP
+            self._timeout_scale = 1000.0
+            self._no_timeout = None
+
+        self._masks = {}
+
+    def update(self, fd, mask):
+        current = self._masks.get(fd)
+
+        if not mask:
+            if current is not None:
+                del self._masks[fd]
+                self._poll.unregister(fd)
+        elif current is None:
+            self._masks[fd] = mask
+            self._poll.register(fd, mask)
+        elif current != mask:
+            self._masks[fd] = mask
+            self._poll.modify(fd, mask)
+
+    def mask(self, fd):
+        return self._masks.get(fd, 0)
+
+    def poll(self, timeout):
+        if timeout is None:
+            timeout = self._no_timeout
+        else:
+            timeout = timeout * self._timeout_scale
+
+        try:
+            return self._poll.poll(timeout)
+        except (IOError, OSError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+class EventLoop(object):
+    """Run callbacks when file descriptors become readable or writable
+    and when timers expire.
+
+    """
+
+    def __init__(self):
+        self._poller = _Poller()
+        self._readers = {}
+        self._writers = {}
+        self._timers = []
+        self._sequence = itertools.count()
+        self._running = False
+
+        self._signal_handlers = {}
+        self._pending_signals = collections.deque()
+        self._wakeup = None
+
+    def time(self):
+        return time.time()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds. Returns a Timer."""
+
+        timer = Timer(self.time() + delay, callback, args)
+        heapq.heappush(self._timers, (timer.when, next(self._sequence), timer))
+        return timer
+
+    def call_soon(self, callback, *args):
+        """Run callback(*args) on the next pass of the loop."""
+
+        return self.call_later(0, callback, *args)
+
+    def add_reader(self, fd, callback):
+        self._readers[fd] = callback
+        self._poller.update(fd, self._poller.mask(fd) | self._poller.READ)
+
+    def remove_reader(self, fd):
+        if self._readers.pop(fd, None) is not None:
+            self._poller.update(fd, self._poller.mask(fd) & ~self._poller.READ)
+
+    def add_writer(self, fd, callback):
+        self._writers[fd] = callback
+        self._poller.update(fd, self._poller.mask(fd) | self._poller.WRITE)
+
+    def remove_writer(self, fd):
+        if self._writers.pop(fd, None) is not None:
+            self._poller.update(fd, self._poller.mask(fd) & ~self._poller.WRITE)
+
+    def add_signal_handler(self, signum, callback, *args):
+        """Run callback(*args) from the loop when the process receives
+        the signal signum.
+
+        """
+
+        if self._wakeup is None:
+            # The C level signal handler writes to the pipe, waking the
+            # poll even if the signal arrives just before it starts.
+            self._wakeup = os.pipe()
+            for fd in self._wakeup:
+                flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            signal.set_wakeup_fd(self._wakeup[1])
+            self.add_reader(self._wakeup[0], self._drain_wakeup)
+
+        self._signal_handlers[signum] = (callback, args)
+        signal.signal(signum, self._on_signal)
+
+    def _on_signal(self, signum, frame):
+        self._pending_signals.append(signum)
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup[0], 4096):
+                pass
+        except OSError as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                raise
+
+    def _run_signal_handlers(self):
+        while self._pending_signals:
+            handler = self._signal_handlers.get(self._pending_signals.popleft())
+            if handler is not None:
+                self._run(handler[0], *handler[1])
+
+    def stop(self):
+        """Stop run_forever() after the current pass of the loop."""
+
+        self._running = False
+
+    def run_forever(self):
+        self._running = True
+        while self._running:
+            self.run_once()
+
+    def run_once(self):
+        """Wait for the next file descriptor event or timer, and run
+        every callback that is due.
+
+        """
+
+        timeout = None
+        if self._timers:
+            timeout = max(0, self._timers[0][0] - self.time())
+
+        for fd, event in self._poller.poll(timeout):
+            if event & (self._poller.READ | self._poller.ERROR) and fd in self._readers:
+                self._run(self._readers[fd])
+            if event & (self._poller.WRITE | self._poller.ERROR) and fd in self._writers:
+                self._run(self._writers[fd])
+
+        self._run_signal_handlers()
+
+        now = self.time()
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)[2]
+            if not timer.cancelled:
+                self._run(timer.callback, *timer.args)
+
+    def _run(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception('Unhandled error in event loop callback %r', callback)
@@ -0,0 +1,68 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Large bodies for the size_<n>kb and size_<n>mb directives.
+
+The directive page is padded out to the size asked for with filler text
+in a div just before </body>, so the body is still valid HTML. The
+filler is a single preallocated chunk yielded over and over, so a
+gigabyte body takes no more memory to send than a kilobyte one.
+
+"""
+
+import itertools
+import logging
+
+logger = logging.getLogger('crawlbin.pages.filler')
+
+CHUNK_BYTES = 64 * 1024
+
+_WORDS = b'crawlbin filler text, to make this page as large as it was asked to be. '
+FILLER_CHUNK = (_WORDS * (CHUNK_BYTES // len(_WORDS) + 1))[:CHUNK_BYTES]
+
+_OPEN = b'<div class="filler">\n'
+_CLOSE = b'\n</div>\n'
+
+
+def padded_length(content, size):
+    """The length of content padded out to size bytes. Pages that are
+    already larger aren't cut short.
+
+    """
+
+    return max(len(content), size)
+
+
+def padded_body(content, size, chunk=FILLER_CHUNK):
+    """Yield the bytes of the HTML page content padded out to exactly
+    padded_length(content, size) bytes.
+
+    """
+
+    end = content.rfind(b'</body>')
+    if end == -1:
+        end = len(content)
+
+    padding = size - len(content)
+    if padding <= 0:
+        yield content
+        return
+
+    filler = padding - len(_OPEN) - len(_CLOSE)
+    if filler < 0:
+        # Too close to the page size to fit the div, pad with whitespace.
+        yield content[:end] + b' ' * padding + content[end:]
+        return
+
+    yield content[:end] + _OPEN
+
+    whole, rest = divmod(filler, len(chunk))
+    for piece in itertools.repeat(chunk, whole):
+        yield piece
+    if rest:
+        yield chunk[:rest]
+
+    yield _CLOSE + content[end:]
@@ -0,0 +1,25 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+User agent classification moved to crawlbin.core.user_agent, which
+doesn't need Django. It is re-exported here for existing imports.
+
+"""
+
+from crawlbin.core.user_agent import UA_ALL
+from crawlbin.core.user_agent import UA_BOT
+from crawlbin.core.user_agent import UA_DESKTOP
+from crawlbin.core.user_agent import UA_FF
+from crawlbin.core.user_agent import UA_GOOGLEBOT
+from crawlbin.core.user_agent import UA_IE
+from crawlbin.core.user_agent import UA_MOBILE
+from crawlbin.core.user_agent import UA_TABLET
+from crawlbin.core.user_agent import USER_AGENT_CATEGORIES
+from crawlbin.core.user_agent import category_names
+from crawlbin.core.user_agent import classify_user_agent
+from crawlbin.core.user_agent import configure_user_agent_cache
+from crawlbin.core.user_agent import user_agent_cache
+from crawlbin.core.user_agent import warm_user_agent_cache
@@ -0,0 +1,85 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+import json
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from pages import benchmarks
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--iterations', type='int', dest='iterations', default=1000,
+                    help='Number of timed operations per benchmark.'),
+        make_option('--only', action='append', dest='only', default=[],
+                    help='Only run benchmarks whose name contains this. Can be repeated.'),
+        make_option('--save', dest='save', default=None,
+                    help='Write the results to this file, e.g. to use as a baseline.'),
+        make_option('--baseline', dest='baseline', default=None,
+                    help='Compare against results saved with --save.'),
+        make_option('--tolerance', type='float', dest='tolerance', default=0.2,
+                    help='Fractional slowdown against the baseline that counts as a '
+                         'regression. Defaults to 0.2.'),
+        make_option('--list', action='store_true', dest='list', default=False,
+                    help='List the benchmarks and exit.'),
+        make_option('--server', dest='server', default=None,
+                    help='Run the HTTP workloads against the server at address:port, '
+                         'e.g. one started with runserver or runcrawlbin.'),
+        make_option('--concurrency', type='int', dest='concurrency', default=10,
+                    help='Number of concurrent connections for --server. Defaults to 10.'),
+        make_option('--startup', action='store_true', dest='startup', default=False,
+                    help='Measure import time and time to first request in fresh '
+                         'interpreters, with and without warm up, instead.'),
+        make_option('--runs', type='int', dest='runs', default=5,
+                    help='Number of interpreters started for --startup. Defaults to 5.'),
+    )
+    help = ("Benchmark the URL parser, directive helpers and views, or the views over "
+            "HTTP against a running server, reporting operations per second and latency "
+            "percentiles as JSON, or measure startup time.")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name in list(benchmarks.BENCHMARKS) + list(benchmarks.HTTP_WORKLOADS):
+                self.stdout.write(name)
+            return
+
+        if options['startup']:
+            self.stdout.write(json.dumps(benchmarks.measure_startup(options['runs']), indent=2))
+            return
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        if options['server']:
+            host, _, port = options['server'].rpartition(':')
+            if not port.isdigit():
+                raise CommandError('--server must be address:port, not "%s".' %
+                                   options['server'])
+            results = benchmarks.run_http(host or '127.0.0.1', int(port), options['only'],
+                                          options['iterations'], options['concurrency'])
+        else:
+            results = benchmarks.run(options['only'], options['iterations'])
+        output = json.dumps(results, indent=2)
+
+        self.stdout.write(output)
+
+        if options['save']:
+            with open(options['save'], 'w') as save_file:
+                save_file.write(output + '\n')
+
+        if baseline is not None:
+            regressions = benchmarks.compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Performance regressions against %s:\n%s' % (
+                    options['baseline'],
+                    '\n'.join('  %s: %.1f -> %.1f ops/sec (%+.0f%%)' % (
+                        name, before, after, (after / before - 1) * 100)
+                        for name, before, after in regressions)))
@@ -0,0 +1,141 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+import threading
+import timeit
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from pages.batch import parse_lines
+from pages.views import batch_outcome
+
+# Lines sent to a worker process at a time.
+CHUNK_LINES = 1000
+# Chunks in flight for each worker process. Reading stops until results
+# are written, so memory use doesn't grow with the size of the input.
+CHUNKS_PER_PROCESS = 4
+
+_scheme = None
+_host = None
+
+
+def _init_worker(scheme, host):
+    global _scheme, _host
+    _scheme, _host = scheme, host
+
+    # Forked workers start with the same random state, so would all pick
+    # the same random blocks.
+    random.seed()
+
+
+def _evaluate_chunk(chunk):
+    start, lines = chunk
+    return ''.join(json.dumps(batch_outcome(entry, _scheme, _host), separators=(',', ':')) + '\n'
+                   for entry in parse_lines(lines, start))
+
+
+def _chunks(lines, size):
+    """Yield (number of the first line, lines) for each size lines."""
+
+    start = 0
+    while True:
+        chunk = list(itertools.islice(lines, size))
+        if not chunk:
+            return
+        yield start, chunk
+        start += len(chunk)
+
+
+def _bounded(chunks, semaphore):
+    for chunk in chunks:
+        semaphore.acquire()
+        yield chunk
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--output', dest='output', default=None,
+                    help='Write the expectations to this file rather than stdout.'),
+        make_option('--processes', type='int', dest='processes', default=None,
+                    help='Number of worker processes. Defaults to the number of CPUs.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=CHUNK_LINES,
+                    help='Lines sent to a worker at a time. Defaults to %d.' % CHUNK_LINES),
+        make_option('--unordered', action='store_true', dest='unordered', default=False,
+                    help="Write each chunk's expectations as soon as they are ready, rather "
+                         "than in the order of the input. Each line has its input line "
+                         "number as its index."),
+        make_option('--host', dest='host', default='crawlbin.com',
+                    help='Host the pages are requested from. Defaults to crawlbin.com.'),
+        make_option('--scheme', dest='scheme', default='http',
+                    help='Scheme the pages are requested with. Defaults to http.'),
+    )
+    help = ("Evaluate a file of paths and user agents, one per line as JSON or tab separated "
+            "(see pages.batch), writing what crawlbin would send for each as NDJSON. Use - "
+            "to read from stdin.")
+    args = '<file>'
+
+    def handle(self, path=None, *args, **options):
+        if path is None:
+            raise CommandError('Give a file of paths and user agents to evaluate, or -.')
+
+        processes = options['processes'] or multiprocessing.cpu_count()
+        chunk_size = options['chunk_size']
+        if processes < 1 or chunk_size < 1:
+            raise CommandError('--processes and --chunk-size must be at least 1.')
+
+        input_file = sys.stdin if path == '-' else open(path)
+        output_file = open(options['output'], 'w') if options['output'] else self.stdout
+
+        start = timeit.default_timer()
+        try:
+            count = self._evaluate(input_file, output_file, processes, chunk_size, options)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if output_file is not self.stdout:
+                output_file.close()
+
+        seconds = timeit.default_timer() - start
+        self.stderr.write('Evaluated %d entries in %.1fs (%.0f/s) with %d processes' % (
+            count, seconds, count / seconds if seconds else 0, processes))
+
+    def _evaluate(self, input_file, output_file, processes, chunk_size, options):
+        chunks = _chunks(iter(input_file), chunk_size)
+        initargs = (options['scheme'], options['host'])
+
+        if processes == 1:
+            _init_worker(*initargs)
+            results = itertools.imap(_evaluate_chunk, chunks)
+            return self._write(results, output_file)
+
+        semaphore = threading.Semaphore(processes * CHUNKS_PER_PROCESS)
+        pool = multiprocessing.Pool(processes, _init_worker, initargs)
+        try:
+            imap = pool.imap_unordered if options['unordered'] else pool.imap
+            results = imap(_evaluate_chunk, _bounded(chunks, semaphore))
+            return self._write(results, output_file, semaphore)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _write(self, results, output_file, semaphore=None):
+        """Write the results, returning the number of entries written."""
+
+        count = 0
+        for result in results:
+            output_file.write(result)
+            count += result.count('\n')
+            if semaphore is not None:
+                semaphore.release()
+
+        return count
@@ -0,0 +1,114 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+import logging
+import signal
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.core.servers.basehttp import get_internal_wsgi_application
+
+from pages.delays import delay_limiter
+from pages.delays import pacing_limiter
+from pages.server import GRACEFUL_TIMEOUT
+from pages.server import Server
+from pages.server import bind_socket
+from pages.workers import WorkerPool
+
+logger = logging.getLogger('crawlbin.pages.management.runcrawlbin')
+
+DEFAULT_ADDRESS = '127.0.0.1'
+DEFAULT_PORT = 8000
+
+
+def parse_address(addrport):
+    """Split an optional 'address:port' or 'port' argument."""
+
+    if not addrport:
+        return DEFAULT_ADDRESS, DEFAULT_PORT
+
+    address, _, port = addrport.rpartition(':')
+
+    if not port.isdigit():
+        raise CommandError('"%s" is not a valid port number or address:port pair.' % addrport)
+
+    return address or DEFAULT_ADDRESS, int(port)
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--max-delayed', type='int', dest='max_delayed', default=None,
+                    help='Maximum number of delayed responses in flight. Defaults to '
+                         'CRAWLBIN_MAX_DELAYED_REQUESTS.'),
+        make_option('--max-paced', type='int', dest='max_paced', default=None,
+                    help='Maximum number of paced responses in flight. Defaults to '
+                         'CRAWLBIN_MAX_PACED_RESPONSES.'),
+        make_option('--workers', type='int', dest='workers', default=1,
+                    help='Number of worker processes sharing the listening socket. 0 serves '
+                         'from this process, without a master to reload it on SIGHUP. '
+                         'Defaults to 1.'),
+        make_option('--graceful-timeout', type='int', dest='graceful_timeout',
+                    default=GRACEFUL_TIMEOUT,
+                    help='Seconds to wait for responses in progress when stopping or '
+                         'reloading. Defaults to %d.' % GRACEFUL_TIMEOUT),
+        make_option('--preload', action='store_true', dest='preload', default=False,
+                    help='Load and warm up the application once, before forking the '
+                         'workers, rather than in each worker. Workers start faster, but '
+                         'a reload on SIGHUP no longer picks up changes to the '
+                         'application. Without it, a reload still doesn\'t pick up changes '
+                         'to the settings or to the server itself, which this process has '
+                         'already loaded.'),
+    )
+    help = ("Serve crawlbin from an event loop, so that delay_*, ttfb_*, throttle_* and "
+            "drip_* directives don't tie up a worker.")
+    args = '[optional port number, or ipaddr:port]'
+
+    def handle(self, addrport='', *args, **options):
+        address, port = parse_address(addrport)
+
+        if options.get('max_delayed') is not None:
+            delay_limiter.max_in_flight = options['max_delayed']
+        if options.get('max_paced') is not None:
+            pacing_limiter.max_in_flight = options['max_paced']
+
+        workers = options['workers']
+        graceful_timeout = options['graceful_timeout']
+        if workers < 0:
+            raise CommandError('--workers must be 0 or more.')
+
+        sock = bind_socket(address, port)
+
+        # Loaded, and so warmed up, before the workers are forked if
+        # preloading, so that they share the work and start ready.
+        # Otherwise each worker loads it, which is what lets a reload
+        # pick up changes to it; the modules imported above and the
+        # settings are only ever loaded here, so a reload keeps them.
+        preloaded = get_internal_wsgi_application() if options['preload'] else None
+
+        def serve(sock):
+            server = Server(preloaded or get_internal_wsgi_application(), address, port,
+                            sock=sock)
+            server.loop.add_signal_handler(signal.SIGTERM, server.shutdown, graceful_timeout)
+            try:
+                server.serve_forever()
+            finally:
+                server.close()
+
+        self.stdout.write(
+            'Serving crawlbin at http://%s:%d/ with %s (%d delayed and %d paced responses '
+            'max per process)' % (
+                address, sock.getsockname()[1],
+                '%d workers' % workers if workers else 'a single process',
+                delay_limiter.max_in_flight, pacing_limiter.max_in_flight))
+
+        try:
+            if workers:
+                WorkerPool(sock, serve, workers, graceful_timeout).run()
+            else:
+                serve(sock)
+        except KeyboardInterrupt:
+            pass
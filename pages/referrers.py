@@ -0,0 +1,79 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Referring domains for analytics events.
+
+Visit events record the registered domain the visitor came from, e.g.
+example.co.uk for http://www.example.co.uk/page. tldextract works that
+out from the public suffix list, but left to itself it fetches the list
+over the network the first time it's used, stalling cold workers, and
+writes it to a cache file. Here it only ever uses the snapshot of the
+list it ships with, and each referring host is only looked up once.
+tldextract itself takes a while to import, so that's put off until the
+first lookup, or until load() is called when a worker warms up.
+
+"""
+
+import logging
+import re
+
+from urlparse import scheme_chars
+
+from crawlbin.core.cache import LRUCache
+
+logger = logging.getLogger('crawlbin.pages.referrers')
+
+# The same as tldextract's, so hosts are found exactly as it finds them.
+_SCHEME_RE = re.compile(r'^([' + scheme_chars + r']+:)?//')
+
+
+def referer_host(referer):
+    """Return the host of a Referer header value, as tldextract sees it."""
+
+    return (_SCHEME_RE.sub('', referer)
+            .partition('/')[0]
+            .partition('?')[0]
+            .partition('#')[0]
+            .split('@')[-1]
+            .partition(':')[0]
+            .rstrip('.'))
+
+
+class ReferrerDomains(object):
+    """Registered domains of referers, memoised by host in an LRUCache
+    of max_size hosts.
+
+    """
+
+    def __init__(self, max_size=10000):
+        self.extractor = None
+        self.cache = LRUCache(max_size=max_size)
+
+    def load(self):
+        """Import tldextract and load the suffix list snapshot now,
+        rather than on the first lookup.
+
+        """
+
+        if self.extractor is None:
+            import tldextract
+
+            extractor = tldextract.TLDExtract(suffix_list_url=None, cache_file=False,
+                                              fallback_to_snapshot=True)
+            extractor('crawlbin.com')
+            self.extractor = extractor
+
+    def domain(self, referer):
+        """Return the registered domain and suffix of referer, joined by
+        a dot, e.g. example.co.uk.
+
+        """
+
+        return self.cache.get_or_create(referer_host(referer), self._domain)
+
+    def _domain(self, host):
+        self.load()
+        return '.'.join(self.extractor(host)[1:])
@@ -0,0 +1,338 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+A fast renderer for the crawlbin directive page.
+
+Every crawlbin URL renders pages/template.html, and going through the
+Django template engine each time is one of the larger costs of a
+request. The template only uses a small subset of the template
+language, so it is compiled once, at startup, into fixed byte fragments
+and a handful of slots. Rendering is then a matter of filling the slots
+with escaped values and joining the bytes.
+
+The output is byte for byte the same as Django's. Templates using
+anything outside the supported subset raise UnsupportedTemplate when
+compiled, and callers should fall back to Django.
+
+Supported:
+
+- {{ var }} and {{ var.attr }}, optionally with the safe filter
+- {% if var %}, {% if not var %}, {% if var == "x" %} and
+  {% if var != "x" %}, with an optional {% else %}
+- {% for x in var %} and {% for x, y in var %}, with an optional
+  {% empty %}
+- {# comments #}
+
+"""
+
+import logging
+import re
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.loader import find_template_loader
+from django.utils.encoding import force_text
+from django.utils.safestring import SafeData
+
+logger = logging.getLogger('crawlbin.pages.renderer')
+
+# The same tokenising expression as django.template.base.tag_re.
+_TAG_RE = re.compile(r'(\{%.*?%\}|\{\{.*?\}\}|\{#.*?#\})')
+_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z0-9_]+)*$')
+_COMPARISON_RE = re.compile(r'^(\S+)\s+(==|!=)\s+"([^"]*)"$')
+_FOR_RE = re.compile(r'^for\s+(\w+)(?:\s*,\s*(\w+))?\s+in\s+(\S+)$')
+
+_MISSING = object()
+
+
+class UnsupportedTemplate(Exception):
+    """The template uses something the fast renderer can't handle."""
+
+
+def escape(text):
+    """HTML escape text exactly as django.utils.html.escape does."""
+
+    return (text.replace('&', '&amp;')
+                .replace('<', '&lt;')
+                .replace('>', '&gt;')
+                .replace('"', '&quot;')
+                .replace("'", '&#39;'))
+
+
+def _lookup(bits):
+    """Return a function that resolves a dotted variable against a
+    context dictionary the way Django does: dictionary lookup, then
+    attribute, then list index, calling anything callable.
+
+    Missing variables resolve to _MISSING.
+
+    """
+
+    def resolve(context):
+        current = context
+        for bit in bits:
+            try:
+                current = current[bit]
+            except (TypeError, AttributeError, KeyError, ValueError, IndexError):
+                try:
+                    current = getattr(current, bit)
+                except (TypeError, AttributeError):
+                    try:
+                        current = current[int(bit)]
+                    except (IndexError, ValueError, KeyError, TypeError):
+                        return _MISSING
+
+            if callable(current):
+                try:
+                    current = current()
+                except TypeError:
+                    return _MISSING
+
+        return current
+
+    if len(bits) == 1:
+        name = bits[0]
+
+        def resolve_name(context):
+            value = context.get(name, _MISSING)
+            if callable(value):
+                return resolve(context)
+            return value
+
+        return resolve_name
+
+    return resolve
+
+
+def _variable(expression):
+    if not _NAME_RE.match(expression):
+        raise UnsupportedTemplate('Unsupported variable: %s' % expression)
+
+    return _lookup(expression.split('.'))
+
+
+def _render_value(value):
+    if value is _MISSING:
+        return ''
+
+    text = force_text(value)
+    if isinstance(value, SafeData) or isinstance(text, SafeData):
+        return text
+    return escape(text)
+
+
+def _var_node(expression):
+    parts = [part.strip() for part in expression.split('|')]
+    resolve = _variable(parts[0])
+
+    filters = parts[1:]
+    if filters == ['safe']:
+        def node(context, out):
+            value = resolve(context)
+            out.append((u'' if value is _MISSING else force_text(value)).encode('utf-8'))
+    elif not filters:
+        def node(context, out):
+            out.append(_render_value(resolve(context)).encode('utf-8'))
+    else:
+        raise UnsupportedTemplate('Unsupported filters: %s' % expression)
+
+    return node
+
+
+def _condition(expression):
+    if expression.startswith('not '):
+        resolve = _variable(expression[4:].strip())
+        return lambda context: not _truth(resolve(context))
+
+    comparison = _COMPARISON_RE.match(expression)
+    if comparison:
+        resolve = _variable(comparison.group(1))
+        literal = comparison.group(3)
+        if comparison.group(2) == '==':
+            return lambda context: _value(resolve(context)) == literal
+        return lambda context: _value(resolve(context)) != literal
+
+    resolve = _variable(expression)
+    return lambda context: _truth(resolve(context))
+
+
+def _value(value):
+    return None if value is _MISSING else value
+
+
+def _truth(value):
+    return value is not _MISSING and bool(value)
+
+
+def _run(nodes, context, out):
+    for node in nodes:
+        node(context, out)
+
+
+def _if_node(expression, true_nodes, false_nodes):
+    condition = _condition(expression)
+
+    def node(context, out):
+        if condition(context):
+            _run(true_nodes, context, out)
+        else:
+            _run(false_nodes, context, out)
+
+    return node
+
+
+def _for_node(expression, loop_nodes, empty_nodes):
+    match = _FOR_RE.match(expression)
+    if not match:
+        raise UnsupportedTemplate('Unsupported for loop: %s' % expression)
+
+    first, second, sequence = match.groups()
+    resolve = _variable(sequence)
+
+    def node(context, out):
+        values = resolve(context)
+        if values is _MISSING or values is None:
+            values = []
+        elif not hasattr(values, '__len__'):
+            values = list(values)
+
+        if not len(values):
+            _run(empty_nodes, context, out)
+            return
+
+        # Loop variables shadow the outer context, as in Django.
+        saved = dict((name, context.get(name, _MISSING)) for name in (first, second) if name)
+        for value in values:
+            if second:
+                context[first], context[second] = value
+            else:
+                context[first] = value
+            _run(loop_nodes, context, out)
+
+        for name, value in saved.items():
+            if value is _MISSING:
+                context.pop(name, None)
+            else:
+                context[name] = value
+
+    return node
+
+
+class _Parser(object):
+
+    def __init__(self, source):
+        self.tokens = [token for token in _TAG_RE.split(source) if token]
+        self.position = 0
+
+    def parse(self, until=()):
+        """Parse nodes until one of the block tags in until, returning
+        the nodes and the tag that ended them.
+
+        """
+
+        nodes = []
+
+        while self.position < len(self.tokens):
+            token = self.tokens[self.position]
+            self.position += 1
+
+            if token.startswith('{#') and token.endswith('#}'):
+                continue
+
+            if token.startswith('{{') and token.endswith('}}'):
+                nodes.append(_var_node(token[2:-2].strip()))
+                continue
+
+            if not (token.startswith('{%') and token.endswith('%}')):
+                text = token.encode('utf-8')
+                nodes.append(lambda context, out, text=text: out.append(text))
+                continue
+
+            tag = token[2:-2].strip()
+            name = tag.split()[0] if tag else ''
+
+            if name in until:
+                return nodes, name
+
+            if name == 'if':
+                true_nodes, end = self.parse(('else', 'endif'))
+                false_nodes = []
+                if end == 'else':
+                    false_nodes, end = self.parse(('endif',))
+                nodes.append(_if_node(tag[2:].strip(), true_nodes, false_nodes))
+            elif name == 'for':
+                loop_nodes, end = self.parse(('empty', 'endfor'))
+                empty_nodes = []
+                if end == 'empty':
+                    empty_nodes, end = self.parse(('endfor',))
+                nodes.append(_for_node(tag, loop_nodes, empty_nodes))
+            else:
+                raise UnsupportedTemplate('Unsupported tag: %s' % tag)
+
+        if until:
+            raise UnsupportedTemplate('Unclosed tag, expected one of %s' % ', '.join(until))
+
+        return nodes, None
+
+
+class CompiledTemplate(object):
+    """A template compiled by compile_template()."""
+
+    def __init__(self, nodes, name=None):
+        self.nodes = nodes
+        self.name = name
+
+    def render(self, context):
+        """Render the template with the context dictionary, returning
+        UTF-8 encoded bytes. The dictionary is used as is, so it must
+        not be shared with another thread whilst rendering.
+
+        """
+
+        out = []
+        _run(self.nodes, context, out)
+        return b''.join(out)
+
+
+def compile_template(source, name=None):
+    """Compile template source text into a CompiledTemplate."""
+
+    nodes, end = _Parser(force_text(source)).parse()
+    return CompiledTemplate(nodes, name)
+
+
+def load_template_source(template_name):
+    """Find the source of template_name using the configured template
+    loaders.
+
+    """
+
+    for loader_name in settings.TEMPLATE_LOADERS:
+        loader = find_template_loader(loader_name)
+        if loader is None:
+            continue
+
+        try:
+            source, origin = loader.load_template_source(template_name)
+        except TemplateDoesNotExist:
+            continue
+
+        return source
+
+    raise TemplateDoesNotExist(template_name)
+
+
+def load_template(template_name):
+    """Compile the named template, returning None if it needs features
+    the fast renderer doesn't support.
+
+    """
+
+    try:
+        return compile_template(load_template_source(template_name), template_name)
+    except UnsupportedTemplate as e:
+        logger.warning('Falling back to Django to render %s: %s', template_name, e)
+        return None
@@ -0,0 +1,653 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+An event loop HTTP server for crawlbin.
+
+The WSGI application is still called synchronously, as rendering a
+crawlbin page only takes a moment. What the server adds is that slow
+responses don't hold anything but a socket: a response carrying a
+crawlbin_delay (see pages.delays) is only written once a timer fires.
+
+Large bodies are streamed, taking the next chunk from the application
+only once the previous one has been sent. They are sent with the
+application's Content-Length if it gave one, and chunked otherwise.
+
+Responses carrying a crawlbin_pacing are written a piece at a time,
+with the connection taken off the event loop between pieces, so slow
+responses cost a timer each rather than a thread.
+
+Connections are kept alive as HTTP/1.1 allows, and pipelined requests
+are answered in turn. A server can be given a listening socket shared
+with other processes (see pages.workers), and shut down gracefully,
+finishing the responses in progress before it stops.
+
+"""
+
+import email.utils
+import errno
+import logging
+import socket
+import sys
+
+from io import BytesIO
+from urllib import unquote
+
+from delays import EVENT_LOOP_ENVIRON_KEY
+from delays import delay_limiter
+from eventloop import EventLoop
+
+logger = logging.getLogger('crawlbin.pages.server')
+
+MAX_HEADER_BYTES = 65536
+# Large enough for a batch of tens of thousands of entries (see pages.batch).
+MAX_BODY_BYTES = 32 * 1024 * 1024
+RECV_BYTES = 65536
+# Bodies up to this size are buffered and sent with a Content-Length,
+# larger ones are streamed.
+STREAM_BYTES = 65536
+# Seconds to wait for the next request on a connection.
+KEEP_ALIVE_TIMEOUT = 15
+# Seconds a graceful shutdown waits for responses in progress.
+GRACEFUL_TIMEOUT = 30
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+# Responses that never have a body, so have no Content-Length.
+_BODILESS_STATUSES = ('204', '304')
+# The interim response to requests sent with Expect: 100-continue.
+_CONTINUE = b'HTTP/1.1 100 Continue\r\n\r\n'
+
+def keep_alive(version, headers):
+    """Whether a request asks for its connection to be kept open after
+    the response: the default for HTTP/1.1, and opt in for HTTP/1.0.
+
+    """
+
+    tokens = set()
+    for name, value in headers:
+        if name.lower() == 'connection':
+            tokens.update(token.strip().lower() for token in value.split(','))
+
+    if version == 'HTTP/1.1':
+        return 'close' not in tokens
+    return 'keep-alive' in tokens
+
+
+class Connection(object):
+    """A single client connection.
+
+    Each request is read and the application called once the full
+    request has arrived. The response is then written out as the socket
+    allows, after which the connection either waits for the next request
+    or is closed.
+
+    """
+
+    def __init__(self, server, sock, address):
+        self.server = server
+        self.loop = server.loop
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.address = address
+        self.closed = False
+        # Whether the connection is waiting for a request.
+        self.idle = False
+
+        self._keep_alive = False
+        self._idle_timer = None
+
+        self._input = b''
+        # Whether 100 Continue has been sent for the request being read.
+        self._continued = False
+        self._output = []
+        self._offset = 0
+        self._delay_timer = None
+
+        # Set for paced responses, along with the bytes that can be sent
+        # before the next pause.
+        self._pacing = None
+        self._budget = None
+        self._pace_timer = None
+
+        # The application's result and its iterator while streaming.
+        self._result = None
+        self._body = None
+        self._chunked = False
+
+        sock.setblocking(0)
+        # Don't hold back the end of a response waiting for an ACK that
+        # the client may be delaying, which stalls kept alive connections.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._wait_for_request()
+
+    def _wait_for_request(self):
+        """Handle the next request, straight away if it was pipelined
+        behind the last one.
+
+        """
+
+        self.idle = True
+        if self._input:
+            self._read_request()
+
+        if self.idle and not self.closed:
+            self.loop.add_reader(self.fd, self._on_readable)
+            self._idle_timer = self.loop.call_later(self.server.keep_alive_timeout, self.close)
+
+    def _stop_waiting(self):
+        self.idle = False
+        self.loop.remove_reader(self.fd)
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _on_readable(self):
+        try:
+            data = self.sock.recv(RECV_BYTES)
+        except socket.error as e:
+            if e.args[0] in _WOULD_BLOCK:
+                return
+            self.close()
+            return
+
+        if not data:
+            self.close()
+            return
+
+        self._input += data
+        self._read_request()
+
+    def _read_request(self):
+        request = self._parse_request()
+        if request is not None:
+            self._handle(*request)
+
+    def _parse_request(self):
+        """Return (method, target, version, headers, body) once a full
+        request has been read, or None if more input is needed.
+
+        """
+
+        head_end = self._input.find(b'\r\n\r\n')
+        if head_end == -1:
+            if len(self._input) > MAX_HEADER_BYTES:
+                self._send_error(431, 'Request Header Fields Too Large')
+            return None
+
+        lines = self._input[:head_end].split('\r\n')
+
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            self._send_error(400, 'Bad Request')
+            return None
+
+        headers = []
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers.append((name.strip(), value.strip()))
+
+        # Bodies are only framed by Content-Length. Anything else would
+        # leave the body to be read as the next request, so the
+        # connection is closed instead.
+        lengths = set()
+        for name, value in headers:
+            name = name.lower()
+            if name == 'transfer-encoding':
+                self._send_error(501, 'Not Implemented')
+                return None
+            if name == 'content-length':
+                lengths.update(length.strip() for length in value.split(','))
+
+        if len(lengths) > 1 or not all(length.isdigit() for length in lengths):
+            self._send_error(400, 'Bad Request')
+            return None
+        content_length = int(lengths.pop()) if lengths else 0
+
+        if content_length > MAX_BODY_BYTES:
+            self._send_error(413, 'Payload Too Large')
+            return None
+
+        body_start = head_end + 4
+        if len(self._input) - body_start < content_length:
+            # Clients that asked wait to be told to send the body.
+            if not self._continued and version == 'HTTP/1.1' and any(
+                    name.lower() == 'expect' and value.lower() == '100-continue'
+                    for name, value in headers):
+                self._continued = True
+                self._send_continue()
+            return None
+
+        body = self._input[body_start:body_start + content_length]
+        self._input = self._input[body_start + content_length:]
+        self._continued = False
+
+        return method, target, version, headers, body
+
+    def _environ(self, method, target, version, headers, body):
+        path, _, query = target.partition('?')
+
+        environ = self.server.base_environ.copy()
+        environ.update({
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': self.address[0] if self.address else '',
+            'wsgi.input': BytesIO(body),
+            EVENT_LOOP_ENVIRON_KEY: self.loop,
+        })
+
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key == 'CONTENT_TYPE' or key == 'CONTENT_LENGTH':
+                environ[key] = value
+                continue
+
+            key = 'HTTP_' + key
+            if key in environ:
+                value = environ[key] + ',' + value
+            environ[key] = value
+
+        return environ
+
+    def _handle(self, method, target, version, headers, body):
+        self._stop_waiting()
+        self._keep_alive = self.server.accepting and keep_alive(version, headers)
+
+        environ = self._environ(method, target, version, headers, body)
+        response_start = []
+        written = []
+
+        def start_response(status, response_headers, exc_info=None):
+            response_start[:] = [status, response_headers]
+            return written.append
+
+        result = None
+        try:
+            result = self.server.application(environ, start_response)
+            self._pacing = getattr(result, 'crawlbin_pacing', None)
+            chunks, size, body = self._buffer(result, written)
+        except Exception:
+            logger.exception('Error handling %s %s', method, target)
+            self._close_result(result)
+            self._pacing = None
+            self._send_error(500, 'Internal Server Error')
+            return
+
+        status, response_headers = response_start
+
+        if body is None:
+            self._close_result(result)
+            # One write, so a small response goes out in a single packet.
+            head = self._head(status, response_headers, size) + b''.join(chunks)
+            chunks = []
+        else:
+            self._result = result
+            self._body = body
+            has_length = any(name.lower() == 'content-length'
+                             for name, value in response_headers)
+            self._chunked = version == 'HTTP/1.1' and not has_length
+            # Without either, the end of the body is the end of the connection.
+            self._keep_alive = self._keep_alive and (has_length or self._chunked)
+            head = self._head(status, response_headers, None, self._chunked)
+            chunks = self._frame(chunks)
+
+        delay = getattr(result, 'crawlbin_delay', None)
+        if delay:
+            self._delay_timer = self.loop.call_later(delay, self._send_delayed, head, chunks)
+        else:
+            self._send(head, *chunks)
+
+    def _buffer(self, result, written):
+        """Read the start of the body, returning the chunks read, their
+        size and, if there is more to come, the body's iterator.
+
+        Streaming responses, such as Django's StreamingHttpResponse, are
+        always streamed.
+
+        """
+
+        chunks = [chunk for chunk in written if chunk]
+        size = sum(len(chunk) for chunk in chunks)
+
+        body = iter(result)
+        if getattr(result, 'streaming', False):
+            return chunks, size, body
+
+        while size <= STREAM_BYTES:
+            try:
+                chunk = next(body)
+            except StopIteration:
+                return chunks, size, None
+
+            if chunk:
+                chunks.append(chunk)
+                size += len(chunk)
+
+        return chunks, size, body
+
+    def _frame(self, chunks):
+        if not self._chunked:
+            return chunks
+
+        framed = []
+        for chunk in chunks:
+            framed.extend(['%x\r\n' % len(chunk), chunk, b'\r\n'])
+        return framed
+
+    def _close_result(self, result):
+        if hasattr(result, 'close'):
+            try:
+                result.close()
+            except Exception:
+                logger.exception('Error closing the response')
+
+    def _head(self, status, response_headers, content_length, chunked=False):
+        lines = ['HTTP/1.1 ' + status]
+        seen = set()
+
+        for name, value in response_headers:
+            seen.add(name.lower())
+            lines.append(name + ': ' + value)
+
+        if chunked:
+            lines.append('Transfer-Encoding: chunked')
+        elif (content_length is not None and 'content-length' not in seen and
+                status[:3] not in _BODILESS_STATUSES):
+            lines.append('Content-Length: %d' % content_length)
+        if 'date' not in seen:
+            lines.append('Date: ' + email.utils.formatdate(usegmt=True))
+        lines.append('Server: crawlbin')
+        lines.append('Connection: ' + ('keep-alive' if self._keep_alive else 'close'))
+
+        return '\r\n'.join(lines) + '\r\n\r\n'
+
+    def _send_delayed(self, head, chunks):
+        self._delay_timer = None
+        delay_limiter.release()
+        self._send(head, *chunks)
+
+    def _send_error(self, status_code, reason):
+        self._stop_waiting()
+        self._keep_alive = False
+
+        body = reason + '\n'
+        head = self._head('%d %s' % (status_code, reason),
+                          [('Content-Type', 'text/plain; charset=UTF-8')],
+                          len(body))
+        self._send(head, body)
+
+    def _send_continue(self):
+        # Sent straight away, while the connection is still reading. It
+        # is all that's been written since the last response finished,
+        # so only fails to fit when the client has stopped reading.
+        try:
+            sent = self.sock.send(_CONTINUE)
+        except socket.error as e:
+            if e.args[0] in _WOULD_BLOCK:
+                return
+            self.close()
+            return
+
+        if sent < len(_CONTINUE):
+            self.close()
+
+    def _send(self, *chunks):
+        if self.closed:
+            return
+
+        self._output.extend(chunks)
+        self.loop.remove_reader(self.fd)
+
+        if self._pacing is not None:
+            self._pause(self._pacing.ttfb)
+        else:
+            self.loop.add_writer(self.fd, self._on_writable)
+
+    def _pause(self, seconds):
+        self.loop.remove_writer(self.fd)
+        self._pace_timer = self.loop.call_later(seconds, self._resume)
+
+    def _resume(self):
+        self._pace_timer = None
+        self._budget = self._pacing.piece
+        self.loop.add_writer(self.fd, self._on_writable)
+
+    def _next_chunk(self):
+        """Queue the next part of a streamed body, returning False once
+        there is nothing left to send.
+
+        """
+
+        if self._body is None:
+            return False
+
+        try:
+            chunk = next(self._body)
+        except StopIteration:
+            return self._end_body()
+        except Exception:
+            # Too late for a 500, the head has been sent.
+            logger.exception('Error streaming the response')
+            self.close()
+            return False
+
+        if chunk:
+            self._output.extend(self._frame([chunk]))
+        return True
+
+    def _end_body(self):
+        self._body = None
+        self._close_result(self._result)
+        self._result = None
+
+        if self._chunked:
+            self._output.append(b'0\r\n\r\n')
+            return True
+        return False
+
+    def _on_writable(self):
+        while self._output or self._next_chunk():
+            if not self._output:
+                continue
+
+            if self._budget == 0:
+                self._pause(self._pacing.interval)
+                return
+
+            chunk = self._output[0]
+            end = len(chunk)
+            if self._budget is not None:
+                end = min(end, self._offset + self._budget)
+
+            try:
+                sent = self.sock.send(memoryview(chunk)[self._offset:end])
+            except socket.error as e:
+                if e.args[0] in _WOULD_BLOCK:
+                    return
+                self.close()
+                return
+
+            self._offset += sent
+            if self._budget is not None:
+                self._budget -= sent
+
+            if self._offset < len(chunk):
+                if self._budget == 0:
+                    continue
+                # The socket's buffer is full.
+                return
+
+            self._output.pop(0)
+            self._offset = 0
+
+        self._finish()
+
+    def _finish(self):
+        """Close the connection now the response has been sent, or wait
+        for the next request on it.
+
+        """
+
+        self.loop.remove_writer(self.fd)
+
+        if not (self._keep_alive and self.server.accepting):
+            self.close()
+            return
+
+        self._pacing = None
+        self._budget = None
+        self._wait_for_request()
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.idle = False
+
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+        if self._delay_timer is not None:
+            self._delay_timer.cancel()
+            self._delay_timer = None
+            delay_limiter.release()
+
+        if self._pace_timer is not None:
+            self._pace_timer.cancel()
+            self._pace_timer = None
+
+        if self._result is not None:
+            self._close_result(self._result)
+            self._result = None
+            self._body = None
+
+        self.loop.remove_reader(self.fd)
+        self.loop.remove_writer(self.fd)
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
+
+        self.server.discard(self)
+
+
+class Server(object):
+    """Serve a WSGI application from an event loop.
+
+    The server listens on sock if it is given one, which must already be
+    bound and listening, or on a socket of its own bound to host and
+    port otherwise.
+
+    """
+
+    def __init__(self, application, host='127.0.0.1', port=8000, loop=None, backlog=1024,
+                 sock=None, keep_alive_timeout=KEEP_ALIVE_TIMEOUT):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.loop = loop or EventLoop()
+        self.backlog = backlog
+        self.keep_alive_timeout = keep_alive_timeout
+        self.connections = set()
+        self.sock = sock
+        self.accepting = False
+        self.draining = False
+
+        self.base_environ = {
+            'SERVER_NAME': host,
+            'SERVER_PORT': str(port),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+    def listen(self):
+        if self.sock is None:
+            self.sock = bind_socket(self.host, self.port, self.backlog)
+        self.sock.setblocking(0)
+
+        # Pick up the real port if we were asked for any free one.
+        self.port = self.sock.getsockname()[1]
+        self.base_environ['SERVER_PORT'] = str(self.port)
+
+        self.accepting = True
+        self.loop.add_reader(self.sock.fileno(), self._on_accept)
+
+    def _on_accept(self):
+        while self.accepting:
+            try:
+                sock, address = self.sock.accept()
+            except socket.error as e:
+                if e.args[0] in _WOULD_BLOCK or e.args[0] == errno.ECONNABORTED:
+                    return
+                if e.args[0] in (errno.EMFILE, errno.ENFILE):
+                    logger.error('Out of file descriptors, not accepting connections')
+                    return
+                raise
+
+            self.connections.add(Connection(self, sock, address))
+
+    def discard(self, connection):
+        self.connections.discard(connection)
+        if self.draining and not self.connections:
+            self.loop.stop()
+
+    def serve_forever(self):
+        if not self.accepting:
+            self.listen()
+
+        logger.info('Serving crawlbin on %s:%d', self.host, self.port)
+        self.loop.run_forever()
+
+    def _stop_accepting(self):
+        self.accepting = False
+        if self.sock is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+    def shutdown(self, timeout=GRACEFUL_TIMEOUT):
+        """Stop accepting connections, and stop the loop once every
+        response in progress has been sent, or after timeout seconds.
+
+        """
+
+        logger.info('Shutting down with %d connections open', len(self.connections))
+
+        self._stop_accepting()
+        self.draining = True
+
+        for connection in list(self.connections):
+            if connection.idle and not connection._input:
+                connection.close()
+
+        if self.connections:
+            self.loop.call_later(timeout, self.close)
+        else:
+            self.loop.stop()
+
+    def close(self):
+        self.loop.stop()
+        self._stop_accepting()
+        for connection in list(self.connections):
+            connection.close()
+
+
+def bind_socket(host, port, backlog=1024):
+    """Return a listening TCP socket bound to host and port."""
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
@@ -0,0 +1,51 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+The source crawlbin is running: its code and templates.
+
+Every page crawlbin serves follows from its source, so the source says
+when pages were last modified, the same way in every worker process,
+and versions what workers share (see pages.views.share_caches).
+
+"""
+
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+
+logger = logging.getLogger('crawlbin.pages.source')
+
+SOURCE_DIRECTORIES = ('crawlbin', 'pages', 'templates')
+SOURCE_EXTENSIONS = ('.py', '.html', '.txt')
+
+
+def source_files():
+    """Yield the path of every source file, always in the same order."""
+
+    for directory in SOURCE_DIRECTORIES:
+        for root, directories, files in os.walk(os.path.join(settings.BASE_DIR, directory)):
+            directories.sort()
+            for name in sorted(files):
+                if name.endswith(SOURCE_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def source_version():
+    """A hash of the source, which everything crawlbin caches depends on."""
+
+    digest = hashlib.sha1()
+    for path in source_files():
+        with open(path, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:12]
+
+
+def source_modified():
+    """The time, in seconds since the epoch, the source was last changed."""
+
+    return int(max(os.path.getmtime(path) for path in source_files()))
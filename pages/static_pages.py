@@ -0,0 +1,122 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Pages that are the same for every request, served from memory.
+
+The index page and robots.txt are rendered once per process, along with
+a copy in every supported encoding, a strong ETag and a Last-Modified
+date, that of crawlbin's source (see pages.source). After that,
+monitoring tools and crawlers hitting them constantly only cost a
+lookup. With DEBUG on, the template is read again on each request and
+the page rebuilt if it has changed.
+
+"""
+
+import hashlib
+import logging
+
+from collections import namedtuple
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+from django.template.loader import render_to_string
+from django.utils.http import http_date
+
+from conditional import is_not_modified
+from renderer import load_template_source
+from source import source_modified
+
+from crawlbin.core.compression import ENCODERS
+from crawlbin.core.compression import encode
+from crawlbin.core.compression import encoded_etag
+from crawlbin.core.compression import negotiate
+
+logger = logging.getLogger('crawlbin.pages.static_pages')
+
+# How long browsers and caches may reuse the pages without revalidating.
+CACHE_MAX_AGE = 300
+
+
+class StaticPage(namedtuple('StaticPage', ['content', 'encoded', 'content_type', 'etag',
+                                           'last_modified', 'source'])):
+    """ A rendered page. encoded holds the content in each encoding and
+    source is the template it was rendered from.
+
+    """
+
+    __slots__ = ()
+
+
+_pages = {}
+
+
+def build_page(template_name, content_type, context=None):
+    """ Render template_name with context into a StaticPage. """
+
+    source = load_template_source(template_name)
+    content = render_to_string(template_name, context or {}).encode('utf-8')
+
+    return StaticPage(
+        content=content,
+        encoded=dict((encoding, encode(content, encoding)) for encoding in ENCODERS),
+        content_type=content_type,
+        etag='"%s"' % hashlib.sha1(content).hexdigest()[:20],
+        last_modified=http_date(source_modified()),
+        source=source,
+    )
+
+
+def static_page(template_name, content_type, context=None):
+    """ Return the StaticPage for template_name, building it the first
+    time it's asked for and, in DEBUG, whenever the template changes.
+
+    context must be the same on every call.
+
+    """
+
+    page = _pages.get(template_name)
+
+    if page is not None and settings.DEBUG:
+        if load_template_source(template_name) != page.source:
+            logger.info('%s has changed, rebuilding it', template_name)
+            page = None
+
+    if page is None:
+        page = _pages[template_name] = build_page(template_name, content_type, context)
+
+    return page
+
+
+def static_response(request, page):
+    """ Return the response to request for a StaticPage: a 304 if the
+    client already has it, and otherwise the page in the best encoding
+    the client accepts.
+
+    """
+
+    encoding = None
+    if settings.CRAWLBIN_COMPRESSION:
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING'))
+
+    etag = page.etag
+    if encoding is not None:
+        etag = encoded_etag(etag, encoding)
+
+    if is_not_modified(request, etag, page.last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(page.encoded[encoding] if encoding else page.content,
+                                content_type=page.content_type)
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Last-Modified'] = page.last_modified
+    response['Cache-Control'] = 'public, max-age=%d' % CACHE_MAX_AGE
+    response['Vary'] = 'Accept-Encoding'
+
+    return response
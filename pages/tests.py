@@ -1,5 +1,91 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import zlib
+
 from unittest import TestCase  # Use unittest to avoid creating a database
-from pages.helpers_directive import handle_redirect
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.http import HttpResponseRedirect
+from django.http import StreamingHttpResponse
+from django.template.loader import render_to_string
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils.http import http_date
+from django.utils.safestring import mark_safe
+
+from keen import scoped_keys
+
+from crawlbin.core import evaluate
+from crawlbin.core.cache import LRUCache
+from crawlbin.core.compression import ENCODERS
+from crawlbin.core.compression import encode
+from crawlbin.core.compression import encoded_etag
+from crawlbin.core.compression import gzip_stream
+from crawlbin.core.compression import negotiate
+from crawlbin.core.directives import DIRECTIVES
+from crawlbin.core.directives import MAX_SIZE_BYTES
+from crawlbin.core.directives import delay_directives
+from crawlbin.core.directives import evaluate_directives
+from crawlbin.core.directives import handle_redirect
+from crawlbin.core.graph import SITE_PAGES
+from crawlbin.core.shared_cache import SharedCache
+from crawlbin.core.sitemap import URLS_PER_SITEMAP
+from crawlbin.core.sitemap import compile_sitemap
+from crawlbin.core.sitemap import sitemap_index
+from crawlbin.core.sitemap import urlset
+from crawlbin.core.url import compile_url_path
+from crawlbin.core.url import get_directives_from_random_matching_block
+from crawlbin.core.url import plan_cache
+from crawlbin.core.user_agent import UA_ALL
+from crawlbin.core.user_agent import UA_BOT
+from crawlbin.core.user_agent import UA_FF
+from crawlbin.core.user_agent import UA_GOOGLEBOT
+from crawlbin.core.user_agent import category_names
+from crawlbin.core.user_agent import classify_user_agent
+from crawlbin.core.user_agent import user_agent_cache
+
+from pages import benchmarks
+from pages import static_pages
+from pages import views
+from pages.analytics import EventQueue
+from pages.analytics import LocalSink
+from pages.batch import ndjson_chunks
+from pages.batch import parse_json
+from pages.batch import parse_lines
+from pages.conditional import is_not_modified
+from pages.conditional import page_etag
+from pages.delays import EVENT_LOOP_ENVIRON_KEY
+from pages.delays import make_pacing
+from pages.delays import pace_response
+from pages.delays import pacing_limiter
+from pages.dispatch import DirectiveDispatcher
+from pages.dispatch import directive_url
+from pages.eventloop import EventLoop
+from pages.filler import FILLER_CHUNK
+from pages.filler import padded_body
+from pages.filler import padded_length
+from pages.referrers import ReferrerDomains
+from pages.referrers import referer_host
+from pages.renderer import UnsupportedTemplate
+from pages.renderer import compile_template
+from pages.renderer import load_template
+from pages.server import Server
+from pages.server import keep_alive
+from pages.source import source_modified
+from pages.timing import StageMetrics
+from pages.timing import StageTimer
+from pages.timing import format_stats
+from pages.warmup import COMMON_PATHS
+from pages.warmup import warm_up
+
+GOOGLEBOT = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
+FIREFOX = 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:35.0) Gecko/20100101 Firefox/35.0'
 
 
 class RedirectTestCase(TestCase):
@@ -104,3 +190,1162 @@ class RedirectTestCase(TestCase):
         self.assertEqual(context_418, {})
         self.assertEqual(context_500, {})
         self.assertEqual(context_503, {})
+
+
+class PlanTestCase(TestCase):
+
+    def test_plain_directives(self):
+        """Plain directives keep their URL order"""
+
+        directives = get_directives_from_random_matching_block(
+            'meta_noindex+vary_cookie+meta_noindex', FIREFOX)
+
+        self.assertEqual(directives, ['meta_noindex', 'vary_cookie'])
+
+    def test_nested_choices(self):
+        """Nested blocks are resolved to one of their options"""
+
+        plan = compile_url_path('[meta_index+[vary_cookie,vary_referer]]')
+
+        self.assertEqual(plan.none, (
+            ((('meta_index',),), (('vary_cookie',), ('vary_referer',))),
+        ))
+        for _ in range(20):
+            directives = get_directives_from_random_matching_block(
+                '[meta_index+[vary_cookie,vary_referer]]', FIREFOX)
+            self.assertIn(directives, [
+                ['meta_index', 'vary_cookie'],
+                ['meta_index', 'vary_referer'],
+            ])
+
+    def test_user_agent_filters(self):
+        """Filtered blocks replace unfiltered ones when they match"""
+
+        url = '[googlebot:response_404][all:vary_cookie][h1_off]'
+
+        googlebot = set(tuple(get_directives_from_random_matching_block(url, GOOGLEBOT))
+                        for _ in range(40))
+        firefox = set(tuple(get_directives_from_random_matching_block(url, FIREFOX))
+                      for _ in range(40))
+
+        self.assertEqual(googlebot, set([('response_404',), ('vary_cookie',)]))
+        self.assertEqual(firefox, set([('h1_off',), ('vary_cookie',)]))
+
+    def test_bracket_errors(self):
+        """Unbalanced or deeply nested brackets are rejected"""
+
+        self.assertRaises(SyntaxError, compile_url_path, 'meta_index]')
+        self.assertRaises(SyntaxError, compile_url_path, '[a+[b+[c]]]')
+
+    def test_deterministic(self):
+        """Plans with a single choice-free block are deterministic"""
+
+        firefox = classify_user_agent(FIREFOX)
+
+        self.assertTrue(compile_url_path('meta_noindex+vary_cookie').is_deterministic(firefox))
+        self.assertTrue(compile_url_path('[googlebot:response_404][h1_off]')
+                        .is_deterministic(firefox))
+        self.assertFalse(compile_url_path('[response_404][h1_off]').is_deterministic(firefox))
+        self.assertFalse(compile_url_path('[h1_off+[vary_cookie,vary_referer]]')
+                         .is_deterministic(firefox))
+
+    def test_plan_cache(self):
+        """Plans are compiled once and then served from the cache"""
+
+        plan_cache.clear()
+        first = compile_url_path('vary_cookie')
+        second = compile_url_path('vary_cookie')
+
+        self.assertIs(first, second)
+        self.assertEqual(plan_cache.stats()['hits'], 1)
+        self.assertEqual(plan_cache.stats()['misses'], 1)
+
+
+class LRUCacheTestCase(TestCase):
+
+    def test_eviction(self):
+        """The least recently used entry is evicted first"""
+
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_max_bytes(self):
+        """The total size of cached values is capped"""
+
+        cache = LRUCache(max_size=10, max_bytes=10)
+        cache.set('a', 'x' * 6)
+        cache.set('b', 'x' * 4)
+        cache.set('c', 'x' * 3)
+        cache.set('d', 'x' * 11)
+
+        self.assertNotIn('a', cache)
+        self.assertNotIn('d', cache)
+        self.assertEqual(cache.stats()['bytes'], 7)
+
+
+class UserAgentTestCase(TestCase):
+
+    def test_categories(self):
+        """User agents are reduced to a bitmask of categories"""
+
+        googlebot = classify_user_agent(GOOGLEBOT)
+        firefox = classify_user_agent(FIREFOX)
+
+        crawler = UA_ALL | UA_BOT | UA_GOOGLEBOT
+
+        self.assertEqual(googlebot & crawler, crawler)
+        self.assertFalse(googlebot & UA_FF)
+        self.assertEqual(category_names(firefox), ['all', 'desktop', 'ff'])
+
+    def test_cache(self):
+        """Each user agent string is only parsed once"""
+
+        user_agent_cache.clear()
+        classify_user_agent(FIREFOX)
+        classify_user_agent(FIREFOX)
+
+        self.assertEqual(user_agent_cache.stats()['misses'], 1)
+        self.assertEqual(user_agent_cache.stats()['hits'], 1)
+
+
+class DelayTestCase(TestCase):
+
+    def test_delay_context(self):
+        """Delays are reported in seconds and don't stack"""
+
+        self.assertEqual(delay_directives([]), ({}, {}))
+        self.assertEqual(delay_directives(['delay_3']), ({'delay': 3}, {}))
+        self.assertEqual(delay_directives(['delay_1', 'delay_5']), ({'delay': 5}, {}))
+        self.assertEqual(delay_directives(['delay_ms_250']), ({'delay': 0.25}, {}))
+        self.assertEqual(delay_directives(['delay_ms_999999']), ({'delay': 60.0}, {}))
+
+    def test_timers(self):
+        """Timers run in order and cancelled timers don't run"""
+
+        loop = EventLoop()
+        calls = []
+
+        loop.call_later(0.02, calls.append, 'second')
+        loop.call_later(0.01, calls.append, 'first')
+        loop.call_later(0.01, calls.append, 'cancelled').cancel()
+        loop.call_later(0.03, loop.stop)
+        loop.run_forever()
+
+        self.assertEqual(calls, ['first', 'second'])
+
+
+class PacingTestCase(TestCase):
+
+    def test_make_pacing(self):
+        """Throttles and drips become a piece size and interval"""
+
+        self.assertIsNone(make_pacing())
+
+        pacing = make_pacing(ttfb_ms=500)
+        self.assertEqual((pacing.ttfb, pacing.piece), (0.5, None))
+
+        # 80 kilobits per second is 10000 bytes per second.
+        pacing = make_pacing(throttle_kbps=80)
+        self.assertAlmostEqual(pacing.piece / pacing.interval, 10000)
+
+        pacing = make_pacing(drip_ms=250)
+        self.assertEqual((pacing.piece, pacing.interval), (16, 0.25))
+
+        # Dripping no faster than 1000 bytes per second.
+        pacing = make_pacing(throttle_kbps=8, drip_ms=1)
+        self.assertEqual((pacing.piece, pacing.interval), (16, 0.016))
+
+    def test_directives(self):
+        """The longest waits and the slowest throttle win"""
+
+        context = evaluate_directives(['ttfb_10', 'ttfb_20', 'throttle_64', 'throttle_8',
+                                       'throttle_0', 'drip_5']).context
+
+        self.assertEqual((context['ttfb'], context['throttle'], context['drip']), (20, 8, 5))
+        self.assertEqual(evaluate_directives(['drip_9999999']).context['drip'], 60000)
+
+    def test_pace_without_event_loop(self):
+        """Without an event loop the body is paced by sleeping"""
+
+        request = RequestFactory().get('/')
+        response = StreamingHttpResponse([b'a' * 40])
+        in_flight = pacing_limiter.in_flight
+
+        response = pace_response(request, response, make_pacing(drip_ms=1))
+        self.assertEqual(pacing_limiter.in_flight, in_flight + 1)
+        self.assertFalse(hasattr(response, 'crawlbin_pacing'))
+
+        self.assertEqual(list(response), [b'a' * 16, b'a' * 16, b'a' * 8])
+        response.close()
+        self.assertEqual(pacing_limiter.in_flight, in_flight)
+
+    def test_pace_with_event_loop(self):
+        """With an event loop the pacing is left to the server"""
+
+        request = RequestFactory().get('/', **{EVENT_LOOP_ENVIRON_KEY: EventLoop()})
+        pacing = make_pacing(throttle_kbps=8)
+
+        response = pace_response(request, StreamingHttpResponse([b'a' * 1000]), pacing)
+
+        self.assertIs(response.crawlbin_pacing, pacing)
+        self.assertEqual(list(response), [b'a' * 1000])
+        response.close()
+
+
+class EventQueueTestCase(TestCase):
+
+    def test_batches(self):
+        """Queued events are sent in batches grouped by collection"""
+
+        sink = LocalSink()
+        queue = EventQueue(sink, batch_size=2, background=False)
+
+        queue.add_event('visit', {'page': 'a'})
+        queue.add_event('crawlbin', {'directives': []})
+        queue.add_event('visit', {'page': 'b'})
+        queue.flush()
+
+        self.assertEqual(len(sink.batches), 2)
+        self.assertEqual(sorted(sink.batches[0]), ['crawlbin', 'visit'])
+        self.assertEqual([body['page'] for body in sink.batches[1]['visit']], ['b'])
+        self.assertEqual(queue.stats()['sent'], 3)
+
+    def test_drop_oldest(self):
+        """The oldest events are dropped when the queue is full"""
+
+        sink = LocalSink()
+        queue = EventQueue(sink, max_size=2, background=False)
+
+        for page in 'abc':
+            queue.add_event('visit', {'page': page})
+        queue.stop()
+
+        self.assertEqual([body['page'] for collection, body in sink.events], ['b', 'c'])
+        self.assertEqual(queue.stats()['dropped'], 1)
+
+    def test_disabled(self):
+        """Without a sink, events are dropped as they are added"""
+
+        queue = EventQueue(None)
+        queue.add_event('visit', {'page': 'a'})
+
+        self.assertFalse(queue.enabled)
+        self.assertIsNone(queue._thread)
+        self.assertEqual(queue.stats()['dropped'], 0)
+
+
+class ReferrerDomainsTestCase(TestCase):
+
+    def test_domain(self):
+        """Referring domains come from the bundled snapshot, once per host"""
+
+        referrer_domains = ReferrerDomains(max_size=10)
+        self.assertEqual(referrer_domains.domain('http://www.bbc.co.uk/news'), 'bbc.co.uk')
+        self.assertEqual(referrer_domains.extractor.suffix_list_urls, ())
+        self.assertEqual(referrer_domains.domain('https://u@www.bbc.co.uk:443/?q#f'),
+                         'bbc.co.uk')
+        self.assertEqual(referrer_domains.domain('example.org/a'), 'example.org')
+        self.assertEqual(referrer_domains.domain('/'), '.')
+        self.assertEqual(len(referrer_domains.cache), 3)
+        self.assertEqual(referer_host('https://u@www.bbc.co.uk:443/?q#f'), 'www.bbc.co.uk')
+
+
+class EvaluateDirectivesTestCase(TestCase):
+
+    def test_single_pass(self):
+        """Directives from every category are applied together"""
+
+        evaluation = evaluate_directives(
+            ['h1_off', 'meta_noindex', 'header_nofollow', 'vary_cookie', 'response_301'],
+            'http://crawlbin.com', 'http://crawlbin.com/a/', 'http://crawlbin.com/')
+
+        self.assertEqual(evaluation.status_code, 301)
+        self.assertEqual(evaluation.context['h1'], 'off')
+        self.assertEqual(evaluation.context['title'], 'Crawlbin')
+        self.assertEqual(evaluation.context['meta_follow_index_string'], 'noindex')
+        self.assertEqual(evaluation.headers, {
+            'Location': 'http://crawlbin.com/',
+            'X-Robots-Tag': 'nofollow',
+            'Vary': 'Cookie',
+        })
+
+    def test_precedence(self):
+        """Later registered directives win, whatever the URL order"""
+
+        evaluation = evaluate_directives(['response_404', 'h1_off', 'h1_multiple', 'response_301'])
+
+        self.assertEqual(evaluation.status_code, 404)
+        self.assertEqual(evaluation.context['h1'], 'off')
+
+    def test_unknown(self):
+        """Unknown directives are reported in URL order"""
+
+        evaluation = evaluate_directives(['meta_noindx', 'vary_cookie', 'delay_ms_x', ''])
+
+        self.assertEqual(evaluation.unknown, ['meta_noindx', 'delay_ms_x'])
+        self.assertEqual(evaluation.headers, {'Vary': 'Cookie'})
+
+    def test_random(self):
+        """Random directives are flagged"""
+
+        self.assertFalse(evaluate_directives(['canonical_self']).is_random)
+        self.assertTrue(evaluate_directives(['canonical_self', 'random_title']).is_random)
+        self.assertTrue(evaluate_directives(['html_canonical_random']).is_random)
+
+
+class RendererTestCase(TestCase):
+
+    def page_context(self, directives, url):
+        evaluation = evaluate_directives(
+            directives, 'http://crawlbin.com', 'http://crawlbin.com/%s/' % url,
+            'http://crawlbin.com/')
+
+        context = evaluation.context
+        context.update({
+            'url': url,
+            'previous_parts_url': 'http://crawlbin.com/',
+            'directives': directives,
+            'unknown_directives': evaluation.unknown,
+            'headers': evaluation.headers,
+            'keeniod_url': 'https://api.keen.io/?api_key=a&b=<c>&redirect=',
+        })
+        return context
+
+    def assertRendersLikeDjango(self, directives, url=None):
+        url = url or '+'.join(directives)
+        template = load_template('pages/template.html')
+        context = self.page_context(directives, url)
+
+        self.assertIsNotNone(template)
+        self.assertEqual(
+            template.render(dict(context)),
+            render_to_string('pages/template.html', dict(context)).encode('utf-8'))
+
+    def test_every_directive(self):
+        """Every directive renders exactly as it does with Django"""
+
+        names = sorted(DIRECTIVES) + ['delay_ms_10', 'links_3', 'unknown_directive']
+
+        self.assertRendersLikeDjango([])
+        for name in names:
+            self.assertRendersLikeDjango([name], 'a/b/' + name)
+        self.assertRendersLikeDjango(names)
+
+    def test_escaping(self):
+        """Values are escaped as Django escapes them"""
+
+        self.assertRendersLikeDjango([u'<b>&"\'\u00e9'], u'x/<script>\u2603')
+
+    def test_subset(self):
+        """Constructs outside the supported subset are refused"""
+
+        context = {'a': [1, 2], 'b': mark_safe('<i>'), 'c': '<i>'}
+
+        self.assertEqual(
+            compile_template('{% for x in a %}{{x}}{% empty %}-{% endfor %}{{b}}{{c}}')
+            .render(context), b'12<i>&lt;i&gt;')
+        self.assertRaises(UnsupportedTemplate, compile_template, '{% url "index" %}')
+        self.assertRaises(UnsupportedTemplate, compile_template, '{{ a|length }}')
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_measure(self):
+        """Latency percentiles and throughput are reported"""
+
+        result = benchmarks.measure([lambda: None], 100)
+
+        self.assertEqual(result['iterations'], 100)
+        self.assertTrue(result['p50_us'] <= result['p99_us'] <= result['max_us'])
+
+    def test_compare(self):
+        """Slowdowns beyond the tolerance are regressions"""
+
+        baseline = {'benchmarks': {'a': {'ops_per_sec': 100.0}, 'b': {'ops_per_sec': 100.0}}}
+        results = {'benchmarks': {'a': {'ops_per_sec': 85.0}, 'b': {'ops_per_sec': 70.0},
+                                  'c': {'ops_per_sec': 1.0}}}
+
+        self.assertEqual(benchmarks.compare(results, baseline, 0.2), [('b', 100.0, 70.0)])
+
+
+class TimingTestCase(TestCase):
+
+    def test_server_timing(self):
+        """Stages are reported in order, in milliseconds, with a total"""
+
+        timer = StageTimer()
+        timer.add('parse', 0.001)
+        timer.add('delay', 2)
+
+        self.assertEqual(timer.server_timing(),
+                         'parse;dur=1.000, delay;dur=2000.000, total;dur=2001.000')
+
+    def test_histograms(self):
+        """Stage timings are aggregated into cumulative histograms"""
+
+        metrics = StageMetrics()
+        for seconds in (0.0002, 0.003, 100):
+            timer = StageTimer()
+            timer.add('render', seconds)
+            metrics.record('handle', timer)
+
+        text = metrics.render()
+
+        self.assertIn('# TYPE crawlbin_stage_duration_seconds histogram', text)
+        self.assertIn('crawlbin_stage_duration_seconds_bucket'
+                      '{view="handle",stage="render",le="0.005"} 2', text)
+        self.assertIn('crawlbin_stage_duration_seconds_bucket'
+                      '{view="handle",stage="render",le="+Inf"} 3', text)
+        self.assertIn('crawlbin_stage_duration_seconds_count'
+                      '{view="handle",stage="total"} 3', text)
+
+    def test_server_timing_directive(self):
+        """The server_timing directive is known and flags the page"""
+
+        evaluation = evaluate_directives(['server_timing'])
+
+        self.assertEqual(evaluation.unknown, [])
+        self.assertTrue(evaluation.context['server_timing'])
+        self.assertFalse(evaluate_directives([]).context['server_timing'])
+
+    def test_format_stats(self):
+        """Stats dictionaries are formatted as labelled gauges"""
+
+        text = format_stats('crawlbin_cache', 'cache', {'plan': {'hits': 3}}, 'Cache stats')
+
+        self.assertIn('# TYPE crawlbin_cache_hits gauge', text)
+        self.assertIn('crawlbin_cache_hits{cache="plan"} 3', text)
+
+
+class ConditionalTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_etags(self):
+        """ETags identify the parts, and weak ones are marked"""
+
+        etag = page_etag(b'salt', [u'http', u'crawlbin.com', u'/meta_noindex/'])
+
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assertEqual(page_etag(b'salt', [u'http', u'crawlbin.com', u'/meta_noindex/'],
+                                   weak=True), 'W/' + etag)
+        self.assertNotEqual(etag, page_etag(b'salt', [u'http', u'crawlbin.com', u'/']))
+        self.assertNotEqual(etag, page_etag(b'other', [u'http', u'crawlbin.com',
+                                                       u'/meta_noindex/']))
+
+    def test_if_none_match(self):
+        """If-None-Match matches weakly and takes precedence"""
+
+        request = self.factory.get('/', HTTP_IF_NONE_MATCH='"a", W/"b"',
+                                   HTTP_IF_MODIFIED_SINCE='Sun, 18 Oct 2026 00:00:00 GMT')
+        last_modified = 'Sat, 17 Oct 2026 00:00:00 GMT'
+
+        self.assertTrue(is_not_modified(request, '"a"', last_modified))
+        self.assertTrue(is_not_modified(request, '"b"', last_modified))
+        self.assertTrue(is_not_modified(request, 'W/"a"', last_modified))
+        self.assertFalse(is_not_modified(request, '"c"', last_modified))
+        self.assertFalse(is_not_modified(request, None, last_modified))
+        self.assertTrue(is_not_modified(self.factory.get('/', HTTP_IF_NONE_MATCH='*'), '"c"'))
+
+    def test_same_everywhere(self):
+        """Pages are dated by the source, and link with the configured Keen key"""
+
+        self.assertEqual(views.last_modified, http_date(source_modified()))
+
+        with override_settings(KEEN_MASTER_KEY='0' * 32):
+            self.assertEqual(scoped_keys.decrypt('0' * 32, views.scoped_write_key()),
+                             {'allowed_operations': ['write']})
+            with override_settings(KEEN_SCOPED_WRITE_KEY='abc123'):
+                self.assertEqual(views.scoped_write_key(), 'abc123')
+
+    def test_seed_header(self):
+        """Pages seeded by X-Crawlbin-Seed vary on it, and are cached by the seed used"""
+
+        def get(url, seed):
+            request = self.factory.get('/%s/' % url, HTTP_USER_AGENT=FIREFOX,
+                                       HTTP_X_CRAWLBIN_SEED=seed)
+            with override_settings(KEEN_MASTER_KEY='0' * 32):
+                return views.handle(request, url)
+
+        self.assertIn('X-Crawlbin-Seed', get('random_title', '9')['Vary'])
+
+        views.response_cache.clear()
+        first = get('seed_3+random_title', '1')
+        self.assertEqual(get('seed_3+random_title', '2').content, first.content)
+        self.assertNotIn('X-Crawlbin-Seed', first['Vary'])
+        self.assertEqual(len(views.response_cache), 1)
+
+    def test_if_modified_since(self):
+        """If-Modified-Since compares dates"""
+
+        request = self.factory.get('/', HTTP_IF_MODIFIED_SINCE='Sun, 18 Oct 2026 00:00:00 GMT')
+
+        self.assertTrue(is_not_modified(request, '"a"', 'Sat, 17 Oct 2026 00:00:00 GMT'))
+        self.assertFalse(is_not_modified(request, '"a"', 'Mon, 19 Oct 2026 00:00:00 GMT'))
+        self.assertFalse(is_not_modified(request, '"a"'))
+        self.assertFalse(is_not_modified(self.factory.get('/'), '"a"',
+                                         'Sat, 17 Oct 2026 00:00:00 GMT'))
+
+    def test_etag_directives(self):
+        """The etag directives are known, and changing ETags aren't cached"""
+
+        self.assertEqual(evaluate_directives([]).context['etag'], 'strong')
+        self.assertEqual(evaluate_directives(['etag_weak']).context['etag'], 'weak')
+        self.assertTrue(evaluate_directives(['etag_changing']).is_random)
+        self.assertEqual(evaluate_directives(['response_304']).status_code, 304)
+
+
+class FillerTestCase(TestCase):
+
+    page = b'<html><body><h1>crawlbin</h1></body></html>'
+
+    def test_sizes(self):
+        """Pages are padded to exactly the size asked for, but never cut"""
+
+        for size in (0, 10, len(self.page), len(self.page) + 1, len(self.page) + 30, 1024,
+                     3 * len(FILLER_CHUNK) + 7):
+            body = b''.join(padded_body(self.page, size))
+
+            self.assertEqual(len(body), padded_length(self.page, size))
+            self.assertEqual(len(body), max(size, len(self.page)))
+            self.assertTrue(body.startswith(b'<html><body><h1>crawlbin</h1>'))
+            self.assertTrue(body.endswith(b'</body></html>'))
+
+    def test_chunk_reused(self):
+        """The filler is the same preallocated chunk every time"""
+
+        chunks = list(padded_body(self.page, 10 * len(FILLER_CHUNK)))
+
+        self.assertTrue(all(chunk is FILLER_CHUNK for chunk in chunks[1:-2]))
+
+    def test_directives(self):
+        """The largest size wins, capped at MAX_SIZE_BYTES"""
+
+        context = evaluate_directives(['size_10kb', 'size_2mb', 'chunked']).context
+
+        self.assertEqual(context['size'], 2 * 1024 * 1024)
+        self.assertTrue(context['chunked'])
+        self.assertEqual(evaluate_directives(['size_99999999mb']).context['size'],
+                         MAX_SIZE_BYTES)
+        self.assertEqual(evaluate_directives([]).context['size'], 0)
+
+
+class CompressionTestCase(TestCase):
+
+    page = b'<html><body>' + b'crawlbin ' * 100 + b'</body></html>'
+
+    def test_negotiate(self):
+        """The most preferred acceptable encoding is picked"""
+
+        best = list(ENCODERS)[0]
+
+        self.assertIsNone(negotiate(None))
+        self.assertIsNone(negotiate(''))
+        self.assertIsNone(negotiate('identity'))
+        self.assertEqual(negotiate('deflate, gzip, br'), best)
+        self.assertEqual(negotiate('deflate'), 'deflate')
+        self.assertEqual(negotiate('x-gzip'), 'gzip')
+        self.assertEqual(negotiate('gzip;q=0.5, deflate;q=0.8'), 'deflate')
+        self.assertEqual(negotiate('br;q=0, gzip;q=0, *'), 'deflate')
+        self.assertIsNone(negotiate('gzip;q=0'))
+
+    def test_encode(self):
+        """Bodies are encoded, not encoded or encoded twice"""
+
+        gzip_body = encode(self.page, 'gzip')
+
+        self.assertEqual(zlib.decompress(gzip_body, 16 + zlib.MAX_WBITS), self.page)
+        self.assertEqual(zlib.decompress(encode(self.page, 'deflate')), self.page)
+        self.assertEqual(encode(self.page, 'gzip', 'lie'), self.page)
+        self.assertEqual(zlib.decompress(encode(self.page, 'gzip', 'double'),
+                                         16 + zlib.MAX_WBITS), gzip_body)
+
+    def test_encoded_etag(self):
+        """Each encoding gets its own ETag"""
+
+        self.assertEqual(encoded_etag('"abc"', 'gzip'), '"abc-gzip"')
+        self.assertEqual(encoded_etag('W/"abc"', 'br'), 'W/"abc-br"')
+
+    def test_directives(self):
+        """Encoding directives force, lie about or double an encoding"""
+
+        def encoding(directive):
+            context = evaluate_directives([directive]).context
+            return context['encoding'], context['encoding_mode']
+
+        self.assertEqual(encoding('encoding_gzip'), ('gzip', 'normal'))
+        self.assertEqual(encoding('encoding_identity'), ('identity', 'normal'))
+        self.assertEqual(encoding('encoding_lie_deflate'), ('deflate', 'lie'))
+        self.assertEqual(encoding('encoding_double_gzip'), ('gzip', 'double'))
+        self.assertEqual(evaluate_directives(['encoding_zip']).unknown, ['encoding_zip'])
+
+
+class ServerTestCase(TestCase):
+
+    def test_keep_alive(self):
+        """HTTP/1.1 keeps connections alive unless told not to, HTTP/1.0 only if asked"""
+
+        self.assertTrue(keep_alive('HTTP/1.1', []))
+        self.assertFalse(keep_alive('HTTP/1.1', [('Connection', 'Close')]))
+        self.assertFalse(keep_alive('HTTP/1.0', []))
+        self.assertTrue(keep_alive('HTTP/1.0', [('connection', 'TE, keep-alive')]))
+
+    def test_pipelining(self):
+        """Pipelined requests are answered in turn on the one connection"""
+
+        def application(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [environ['PATH_INFO'].encode('ascii')]
+
+        server = Server(application, port=0)
+        server.listen()
+
+        client = socket.create_connection(('127.0.0.1', server.port))
+        client.sendall(b'GET /a HTTP/1.1\r\n\r\n'
+                       b'GET /b HTTP/1.0\r\nConnection: keep-alive\r\n\r\n'
+                       b'GET /c HTTP/1.1\r\nConnection: close\r\n\r\n')
+
+        server.loop.run_once()
+        while server.connections:
+            server.loop.run_once()
+        server.close()
+
+        response = b''
+        data = client.recv(65536)
+        while data:
+            response += data
+            data = client.recv(65536)
+        client.close()
+
+        self.assertEqual(response.count(b'HTTP/1.1 200 OK'), 3)
+        self.assertEqual(response.count(b'Connection: keep-alive'), 2)
+        self.assertTrue(response.endswith(b'Connection: close\r\n\r\n/c'))
+        self.assertLess(response.index(b'\r\n\r\n/a'), response.index(b'\r\n\r\n/b'))
+
+    def test_framing(self):
+        """Requests that can't be framed by Content-Length close the connection"""
+
+        def application(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [environ['wsgi.input'].read()]
+
+        def send(request, body=None):
+            # The body, if given, is only sent once told to continue.
+            server = Server(application, port=0)
+            server.listen()
+
+            client = socket.create_connection(('127.0.0.1', server.port))
+            client.sendall(request)
+            server.loop.run_once()
+            if body is not None:
+                server.loop.run_once()
+                client.settimeout(5)
+                self.assertEqual(client.recv(65536), b'HTTP/1.1 100 Continue\r\n\r\n')
+                client.sendall(body)
+            while server.connections:
+                server.loop.run_once()
+            server.close()
+
+            response = b''
+            while True:
+                data = client.recv(65536)
+                if not data:
+                    break
+                response += data
+            client.close()
+            return response
+
+        response = send(b'POST /_batch HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n'
+                        b'5\r\nhello\r\n0\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 501 '))
+        self.assertEqual(response.count(b'HTTP/1.1'), 1)
+
+        for length in (b'-1', b'5, 6', b'+5'):
+            response = send(b'POST / HTTP/1.1\r\nContent-Length: ' + length + b'\r\n\r\nhello')
+            self.assertTrue(response.startswith(b'HTTP/1.1 400 '), length)
+
+        response = send(b'POST / HTTP/1.1\r\nContent-Length: 5\r\nContent-Length: 5\r\n'
+                        b'Connection: close\r\n\r\nhello')
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 '))
+        self.assertTrue(response.endswith(b'hello'))
+
+        # Clients expecting 100 Continue are sent it before the body.
+        response = send(b'POST / HTTP/1.1\r\nContent-Length: 5\r\nExpect: 100-continue\r\n'
+                        b'Connection: close\r\n\r\n', b'hello')
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 '))
+        self.assertTrue(response.endswith(b'hello'))
+
+        # But not when the body came with the head, or can't be taken.
+        response = send(b'POST / HTTP/1.1\r\nContent-Length: 5\r\nExpect: 100-continue\r\n'
+                        b'Connection: close\r\n\r\nhello')
+        self.assertNotIn(b'100 Continue', response)
+        response = send(b'POST / HTTP/1.1\r\nContent-Length: 99999999999\r\n'
+                        b'Expect: 100-continue\r\n\r\n')
+        self.assertTrue(response.startswith(b'HTTP/1.1 413 '))
+
+
+class CoreTestCase(TestCase):
+
+    def test_evaluate(self):
+        """Pages are evaluated from a path and user agent string"""
+
+        evaluation = evaluate('/a/b/[googlebot:response_404]/', GOOGLEBOT)
+        self.assertEqual(evaluation.status_code, 404)
+        self.assertEqual(evaluation.context['previous_parts_url'], 'http://crawlbin.com/a/b/')
+        self.assertTrue(evaluation.cacheable)
+
+        evaluation = evaluate('a/b/[googlebot:response_404]/', FIREFOX,
+                              host='example.com', scheme='https')
+        self.assertEqual(evaluation.status_code, 200)
+        self.assertEqual(evaluation.context['previous_parts_url'], 'https://example.com/a/b/')
+
+        self.assertRaises(ValueError, evaluate, '/', FIREFOX)
+        self.assertRaises(ValueError, evaluate, '/meta_noindex', FIREFOX)
+
+    def test_seed(self):
+        """Seeded pages make the same random choices every time"""
+
+        path = ('/[seed_3+random_title+canonical_random][meta_noindex]'
+                '[response_404+(h1_on,h1_off)]/')
+
+        evaluations = [evaluate(path, FIREFOX) for _ in range(10)]
+        self.assertTrue(all(evaluation.cacheable for evaluation in evaluations))
+        self.assertEqual(evaluations[0].context['seed'], 3)
+        self.assertEqual(set(tuple(evaluation.directives) for evaluation in evaluations),
+                         set([tuple(evaluations[0].directives)]))
+        self.assertEqual(set(evaluation.context['title'] for evaluation in evaluations),
+                         set([evaluations[0].context['title']]))
+
+        # A seed from the request only counts if the URL hasn't got one.
+        unseeded = '/[random_title][response_404]/'
+        self.assertFalse(evaluate(unseeded, FIREFOX).cacheable)
+        directives = [evaluate(unseeded, FIREFOX, seed=9).directives for _ in range(10)]
+        self.assertEqual(len(set(tuple(d) for d in directives)), 1)
+        self.assertEqual(evaluate(path, FIREFOX, seed=9).context['seed'], 3)
+
+        self.assertEqual(evaluate('/seed_3/', FIREFOX).context['unknown_directives'], [])
+
+    def test_site_graph(self):
+        """Synthetic site pages always link to the same nodes and variants"""
+
+        directives = ('site_7+links_50+links_redirect_20+links_broken_0+links_noindex_0'
+                      '+links_canonical_20')
+        evaluation = evaluate('/%s/' % directives, FIREFOX)
+        links = evaluation.context['links']
+        self.assertTrue(evaluation.cacheable)
+        self.assertEqual(len(links), 50)
+        self.assertEqual(evaluate('/%s/' % directives, FIREFOX, host='example.com')
+                         .context['links'],
+                         [link.replace('crawlbin.com', 'example.com') for link in links])
+        self.assertNotEqual(evaluate('/site_8+links_50/', FIREFOX).context['links'],
+                            evaluate('/site_7+links_50/', FIREFOX).context['links'])
+
+        kinds = set()
+        for link in links:
+            path = link[len('http://crawlbin.com'):]
+            node = '/%s/%s/' % (path.split('/')[1], directives)
+            linked = evaluate(path, FIREFOX)
+
+            if path.endswith('/response_301/'):
+                kinds.add('redirect')
+                self.assertEqual(linked.headers['Location'], 'http://crawlbin.com' + node)
+            elif path.endswith('+canonical_next_block/'):
+                kinds.add('canonical')
+                self.assertEqual(linked.context['canonical_next_block'],
+                                 'http://crawlbin.com' + node)
+            else:
+                self.assertEqual(path, node)
+                self.assertEqual(len(linked.context['links']), 50)
+
+        self.assertEqual(kinds, set(['redirect', 'canonical']))
+
+    def test_no_django(self):
+        """crawlbin.core imports without Django or the user agent parser"""
+
+        modules = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, crawlbin.core; print(" ".join(sys.modules))',
+        ]).split()
+
+        for module in ('django', 'keen', 'tldextract', 'user_agents', 'pages'):
+            self.assertNotIn(module, modules)
+
+
+class BatchTestCase(TestCase):
+
+    def test_parse(self):
+        """Entries are objects or arrays, and bad ones are reported in place"""
+
+        entries = list(parse_lines([
+            '{"path": "/meta_noindex/", "user_agent": "a", "seed": 3}',
+            '',
+            '["/response_404/", "b"]',
+            '/canonical_self/\tGooglebot/2.1 (x; y)\t5',
+            '# a comment',
+            '{not json',
+            '["/response_404/", "b", "seed"]',
+            '/response_404/',
+        ]))
+
+        self.assertEqual([entry.index for entry in entries], [0, 2, 3, 5, 6, 7])
+        self.assertEqual((entries[0].path, entries[0].user_agent, entries[0].seed),
+                         ('/meta_noindex/', 'a', 3))
+        self.assertEqual((entries[1].path, entries[1].seed), ('/response_404/', None))
+        self.assertEqual((entries[2].user_agent, entries[2].seed), ('Googlebot/2.1 (x; y)', 5))
+        self.assertEqual([entry.error is None for entry in entries[3:]], [False] * 3)
+
+        entries = list(parse_json('[["/a/", "b"], {"path": "/c/"}, 5]'))
+        self.assertEqual([entry.error is None for entry in entries], [True, True, False])
+        self.assertIsNotNone(list(parse_json('{"path": "/a/"}'))[0].error)
+
+    def test_outcome(self):
+        """Outcomes are worked out without rendering, so without Keen"""
+
+        views._keeniod_url = None
+        entries = parse_lines(['/meta_noindex/\t' + GOOGLEBOT, '/a]/\t' + GOOGLEBOT,
+                               '/response_404/\t' + GOOGLEBOT])
+        outcomes = [views.batch_outcome(entry, 'http', 'crawlbin.com') for entry in entries]
+
+        self.assertEqual([outcome.get('status_code') for outcome in outcomes], [200, None, 404])
+        self.assertEqual(outcomes[0]['directives'], ['meta_noindex'])
+        self.assertIn('bracket', outcomes[1]['error'])
+        # The same in every process, and for the server.
+        self.assertEqual(outcomes[0]['headers']['Last-Modified'], http_date(source_modified()))
+        self.assertIsNone(views._keeniod_url)
+
+    def test_eval_command(self):
+        """crawlbin_eval writes an error for a malformed line and carries on"""
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'paths.txt')
+            output = os.path.join(directory, 'expectations.ndjson')
+            with open(path, 'w') as paths:
+                paths.write('/meta_noindex/\tx\n/a]/\tx\n/response_404/\tx\n')
+
+            for processes in (1, 2):
+                call_command('crawlbin_eval', path, processes=processes, output=output,
+                             stderr=open(os.devnull, 'w'))
+                with open(output) as expectations:
+                    outcomes = [json.loads(line) for line in expectations]
+
+                self.assertEqual([outcome['index'] for outcome in outcomes], [0, 1, 2])
+                self.assertIn('error', outcomes[1])
+                self.assertEqual(outcomes[2]['status_code'], 404)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_ndjson_chunks(self):
+        """Outcomes are sent a chunk of lines at a time"""
+
+        chunks = list(ndjson_chunks(({'index': i} for i in range(5)), lines_per_chunk=2))
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(''.join(chunks).splitlines(),
+                         ['{"index":%d}' % i for i in range(5)])
+
+
+class SitemapTestCase(TestCase):
+
+    def test_shards(self):
+        """Sitemaps are split into shards of at most 50,000 URLs"""
+
+        sitemap = compile_sitemap(['site_3', 'links_20', 'meta_noindex'])
+        self.assertEqual(sitemap.graph, 'site_3+links_20')
+        self.assertEqual(sitemap.shards(), -(-SITE_PAGES // URLS_PER_SITEMAP))
+
+        paths = list(sitemap.paths(2))
+        self.assertEqual(len(paths), URLS_PER_SITEMAP)
+        self.assertEqual(paths[0], '/n%d/site_3+links_20/' % URLS_PER_SITEMAP)
+
+        directives = compile_sitemap([])
+        self.assertEqual(directives.count(), len(list(directives.paths(1))))
+        self.assertIn('/meta_noindex+response_404/', directives.paths(1))
+
+        index = sitemap_index(['http://crawlbin.com/sitemap_1.xml.gz'], '2015-01-01')
+        self.assertIn('<loc>http://crawlbin.com/sitemap_1.xml.gz</loc>', index)
+
+    def test_urlset(self):
+        """Shards are gzipped as they are written and spoiled the same way every time"""
+
+        sitemap = compile_sitemap(['links_5', 'sitemap_malformed_10', 'sitemap_bad_lastmod_10'])
+        chunks = list(gzip_stream(urlset(sitemap, 1, 'http://crawlbin.com', '2015-01-01')))
+        self.assertGreater(len(chunks), 2)
+
+        xml = zlib.decompress(b''.join(chunks), 16 + zlib.MAX_WBITS)
+        self.assertTrue(xml.endswith('</urlset>\n'))
+        self.assertEqual(xml.count('<url>'), URLS_PER_SITEMAP)
+        self.assertIn('<url><lastmod>', xml)
+        self.assertIn('&b=2</loc>', xml)
+        self.assertIn('<lastmod>2999-12-31T23:59:59+00:00</lastmod>', xml)
+        self.assertEqual(''.join(urlset(sitemap, 1, 'http://crawlbin.com', '2015-01-01')), xml)
+
+        clean = ''.join(urlset(compile_sitemap(['links_5']), 1, 'http://crawlbin.com', 'x'))
+        self.assertEqual(clean.count('<loc>http://crawlbin.com/n'), URLS_PER_SITEMAP)
+
+
+class StaticPageTestCase(TestCase):
+
+    def test_response(self):
+        """Static pages are rendered once and served with validators"""
+
+        page = static_pages.static_page('pages/robots.txt', 'text/plain')
+        self.assertIs(static_pages.static_page('pages/robots.txt', 'text/plain'), page)
+        self.assertIn(b'User-agent', page.content)
+
+        response = static_pages.static_response(RequestFactory().get('/robots.txt'), page)
+        self.assertEqual(response.content, page.content)
+        self.assertEqual(response['ETag'], page.etag)
+        self.assertIn('max-age', response['Cache-Control'])
+
+        response = static_pages.static_response(
+            RequestFactory().get('/robots.txt', HTTP_ACCEPT_ENCODING='gzip'), page)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(response.content, 16 + zlib.MAX_WBITS), page.content)
+
+        response = static_pages.static_response(
+            RequestFactory().get('/robots.txt', HTTP_IF_NONE_MATCH=page.etag), page)
+        self.assertEqual(response.status_code, 304)
+
+    def test_debug(self):
+        """In DEBUG, pages are rebuilt when their template changes"""
+
+        page = static_pages.static_page('pages/robots.txt', 'text/plain')
+        static_pages._pages['pages/robots.txt'] = page._replace(source='old')
+
+        with override_settings(DEBUG=False):
+            self.assertEqual(static_pages.static_page('pages/robots.txt', 'text/plain').source,
+                             'old')
+        with override_settings(DEBUG=True):
+            self.assertEqual(static_pages.static_page('pages/robots.txt', 'text/plain').source,
+                             page.source)
+
+
+class WarmUpTestCase(TestCase):
+
+    def test_warm_up(self):
+        """Warming up compiles the common paths and builds the static pages"""
+
+        plan_cache.clear()
+        static_pages._pages.clear()
+        # Pages link through Keen, whose scoped keys need a master key.
+        with override_settings(KEEN_MASTER_KEY='0' * 32):
+            warm_up()
+
+        for path in COMMON_PATHS:
+            self.assertIn(path[1:-1].split('/')[-1], plan_cache)
+        self.assertIn('pages/index.html', static_pages._pages)
+        self.assertIn('pages/robots.txt', static_pages._pages)
+
+    def test_warm_file(self):
+        """Bad lines in the path warm file are skipped"""
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'paths.txt')
+            with open(path, 'w') as path_file:
+                path_file.write('# Paths\n/meta_nofollow\n/robots.txt\n/favicon.ico/\n/a]/\n'
+                                '/c/h1_off/\n')
+
+            plan_cache.clear()
+            with override_settings(KEEN_MASTER_KEY='0' * 32, CRAWLBIN_PATH_WARM_FILE=path):
+                warm_up()
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertIn('h1_off', plan_cache)
+        self.assertNotIn('meta_nofollow', plan_cache)
+
+
+class DirectiveDispatcherTestCase(TestCase):
+
+    def test_directive_url(self):
+        """Only the paths pages.urls routes to handle are dispatched"""
+
+        self.assertEqual(directive_url('/meta_noindex/'), 'meta_noindex')
+        self.assertEqual(directive_url('/a/b/[googlebot:response_404]/'),
+                         'a/b/[googlebot:response_404]')
+        for path in ('/', '/robots.txt', '/sitemap.xml', '/metrics', '/_batch',
+                     '/favicon.ico/', '/static/favicon.ico', '/a\n/'):
+            self.assertIsNone(directive_url(path), path)
+
+    def test_dispatch(self):
+        """Directive pages are the same whether dispatched or resolved"""
+
+        handler = WSGIHandler()
+        dispatcher = DirectiveDispatcher(handler)
+
+        with override_settings(KEEN_MASTER_KEY='0' * 32):
+            for path in ('/meta_noindex+canonical_self/', '/[googlebot:response_404]/'):
+                self.assertEqual(benchmarks.wsgi_get(dispatcher, path, GOOGLEBOT),
+                                 benchmarks.wsgi_get(handler, path, GOOGLEBOT))
+            status, body = benchmarks.wsgi_get(dispatcher, '/[googlebot:response_404]/',
+                                               GOOGLEBOT)
+            self.assertEqual(status, '404 NOT FOUND')
+            status, body = benchmarks.wsgi_get(dispatcher, '/robots.txt', GOOGLEBOT)
+            self.assertIn(b'User-agent', body)
+
+    def _get(self, application, path, method='GET'):
+        # The status line, headers and body of a request for path.
+        response_start = []
+
+        def start_response(status, headers, exc_info=None):
+            response_start.append((status, dict(headers)))
+
+        result = application(benchmarks.wsgi_environ(path, GOOGLEBOT,
+                                                     extra={'REQUEST_METHOD': method}),
+                             start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            result.close()
+        return response_start[0] + (body,)
+
+    def test_head(self):
+        """HEAD responses have no body, whether dispatched or resolved"""
+
+        handler = WSGIHandler()
+        dispatcher = DirectiveDispatcher(handler)
+
+        with override_settings(KEEN_MASTER_KEY='0' * 32):
+            for path in ('/size_1mb/', '/meta_noindex/', '/[googlebot:response_404]/'):
+                status, headers, body = self._get(dispatcher, path, 'HEAD')
+                self.assertEqual(body, b'', path)
+                self.assertEqual(status, self._get(handler, path, 'HEAD')[0])
+                self.assertEqual(headers.get('Content-Length'),
+                                 self._get(handler, path, 'HEAD')[1].get('Content-Length'))
+
+    def test_redirect(self):
+        """Redirects get the same absolute Location either way"""
+
+        handler = WSGIHandler()
+        dispatcher = DirectiveDispatcher(handler)
+
+        with override_settings(KEEN_MASTER_KEY='0' * 32):
+            status, headers, body = self._get(dispatcher, '/a/response_301/')
+            self.assertEqual(status, '301 MOVED PERMANENTLY')
+            self.assertEqual(headers['Location'], 'http://crawlbin.com/a/')
+            self.assertEqual(headers['Location'],
+                             self._get(handler, '/a/response_301/')[1]['Location'])
+
+        # Relative ones are made absolute, as Django's handler would.
+        dispatcher.view = lambda request, url: HttpResponseRedirect('/%s/next/' % url)
+        status, headers, body = self._get(dispatcher, '/a/')
+        self.assertEqual(status, '302 FOUND')
+        self.assertEqual(headers['Location'], 'http://crawlbin.com/a/next/')
+
+    def test_exception(self):
+        """Uncaught exceptions get Django's 500 response"""
+
+        def view(request, url):
+            raise RuntimeError(url)
+
+        handler = WSGIHandler()
+        dispatcher = DirectiveDispatcher(handler)
+        dispatcher.view = view
+
+        with override_settings(DEBUG=False, DEBUG_PROPAGATE_EXCEPTIONS=False):
+            status, headers, body = self._get(dispatcher, '/a/')
+            self.assertEqual(status, '500 INTERNAL SERVER ERROR')
+            self.assertEqual(self._get(dispatcher, '/a/', 'HEAD')[2], b'')
+
+
+class SharedCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared(self):
+        """Entries written in one process are read in another"""
+
+        cache = SharedCache(self.path, max_size=64, slot_size=256)
+        cache.set('meta_noindex', compile_url_path('meta_noindex'))
+
+        pid = os.fork()
+        if not pid:
+            SharedCache(self.path, max_size=64, slot_size=256).set(('child', 1), 'written')
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(cache.get(('child', 1)), 'written')
+        self.assertEqual(SharedCache(self.path, max_size=64, slot_size=256).get('meta_noindex'),
+                         compile_url_path('meta_noindex'))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('missing'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        cache.set('large', 'x' * 256)
+        self.assertNotIn('large', cache)
+        self.assertEqual(cache.stats()['oversized'], 1)
+
+        # Different sizes lay out a new file, leaving the old one to
+        # those who still map it.
+        self.assertEqual(len(SharedCache(self.path, max_size=128, slot_size=256)), 0)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(('child', 1)), 'written')
+        self.assertEqual(os.listdir(self.directory), ['test.cache'])
+
+    def test_equal_keys(self):
+        """Equal keys find the same entry however they were built"""
+
+        cache = SharedCache(self.path, max_size=4, slot_size=128)
+        path = '/a/'
+        cache.set(('crawlbin.com', path, path, 1, None), 'page')
+
+        for key in [('crawlbin.com', '/a/', ''.join(['/a', '/']), 1, None),
+                    ('crawlbin.com', u'/a/', '/a/', 1L, None)]:
+            self.assertEqual(cache.get(key), 'page')
+            cache.set(key, 'page')
+        self.assertEqual(len(cache), 1)
+
+        cache.set((u'caf\xe9', 1), 'unicode')
+        cache.set(('caf\xc3\xa9', 1), 'utf-8')
+        self.assertEqual(cache.get((u'caf\xe9', 1)), 'unicode')
+        self.assertIsNone(cache.get(('1', 1)))
+        self.assertIsNone(cache.get(((1, 1), )))
+
+    def test_eviction(self):
+        """Full buckets evict their least recently used entry"""
+
+        # A single bucket.
+        cache = SharedCache(self.path, max_size=4, slot_size=128)
+        for key in range(4):
+            cache.set(key, key)
+        cache.get(0)
+        cache.set(4, 4)
+
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertIn(0, cache)
+        self.assertIn(4, cache)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get(4))
+
+    def test_lru_cache(self):
+        """LRUCaches look up misses in their shared cache"""
+
+        first = LRUCache(max_size=10, shared=SharedCache(self.path))
+        second = LRUCache(max_size=10, shared=SharedCache(self.path))
+
+        first.set('key', 'value')
+        self.assertEqual(second.get('key'), 'value')
+        self.assertIn('key', second)
+        self.assertEqual(second.stats()['shared_hits'], 1)
+        self.assertEqual(second.stats()['misses'], 0)
+        self.assertIsNone(second.get('other'))
+        self.assertEqual(second.stats()['misses'], 1)
@@ -0,0 +1,161 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Per-stage request timing.
+
+Views time each stage of a request (parsing, user agent classification,
+evaluation, rendering, analytics, delays) with a StageTimer. The stage
+timings can be sent back in a Server-Timing header, and are aggregated
+into histograms which the metrics view serves in the Prometheus text
+format.
+
+"""
+
+import bisect
+import logging
+import threading
+import timeit
+
+logger = logging.getLogger('crawlbin.pages.timing')
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 60.0)
+
+_timer = timeit.default_timer
+
+
+class StageTimer(object):
+    """Time consecutive stages of a request.
+
+    Each call to lap(stage) records the time since the previous lap, or
+    since the timer was created, against stage.
+
+    """
+
+    __slots__ = ('stages', '_last')
+
+    def __init__(self):
+        self.stages = []
+        self._last = _timer()
+
+    def lap(self, stage):
+        now = _timer()
+        self.stages.append((stage, now - self._last))
+        self._last = now
+
+    def add(self, stage, seconds):
+        """Record seconds against stage without timing anything, e.g. a
+        delay that happens after the view returns.
+
+        """
+
+        self.stages.append((stage, seconds))
+
+    def total(self):
+        return sum(seconds for stage, seconds in self.stages)
+
+    def server_timing(self):
+        """Return the stages as a Server-Timing header value."""
+
+        return ', '.join('{stage};dur={ms:.3f}'.format(stage=stage, ms=seconds * 1000)
+                         for stage, seconds in self.stages + [('total', self.total())])
+
+
+class Histogram(object):
+    """A Prometheus style histogram of durations in seconds."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative_counts(self):
+        """Return (upper bound, count) pairs, ending with +Inf."""
+
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class StageMetrics(object):
+    """Histograms of stage durations, keyed on view and stage."""
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, view, timer):
+        """Add the stages of a finished StageTimer for view."""
+
+        with self._lock:
+            for stage, seconds in timer.stages + [('total', timer.total())]:
+                histogram = self.histograms.get((view, stage))
+                if histogram is None:
+                    histogram = self.histograms[(view, stage)] = Histogram()
+                histogram.observe(seconds)
+
+    def render(self):
+        """Return the histograms in the Prometheus text format."""
+
+        name = 'crawlbin_stage_duration_seconds'
+        lines = [
+            '# HELP {name} Time spent in each stage of a request.'.format(name=name),
+            '# TYPE {name} histogram'.format(name=name),
+        ]
+
+        with self._lock:
+            for (view, stage), histogram in sorted(self.histograms.items()):
+                labels = 'view="{view}",stage="{stage}"'.format(view=view, stage=stage)
+                for bound, count in histogram.cumulative_counts():
+                    lines.append('{name}_bucket{{{labels},le="{le}"}} {count}'.format(
+                        name=name, labels=labels, le=_format_bound(bound), count=count))
+                lines.append('{name}_sum{{{labels}}} {sum!r}'.format(
+                    name=name, labels=labels, sum=histogram.sum))
+                lines.append('{name}_count{{{labels}}} {count}'.format(
+                    name=name, labels=labels, count=histogram.count))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _format_bound(bound):
+    if bound == float('inf'):
+        return '+Inf'
+    return repr(bound)
+
+
+def format_stats(name, label, stats, help_text):
+    """Format a dictionary of {label value: {stat: value}}, such as the
+    stats() of each cache, as Prometheus gauges named name_<stat>.
+
+    """
+
+    lines = []
+    keys = sorted(set(key for values in stats.values() for key in values))
+
+    for key in keys:
+        metric = '{name}_{key}'.format(name=name, key=key)
+        lines.append('# HELP {metric} {help} ({key}).'.format(
+            metric=metric, help=help_text, key=key))
+        lines.append('# TYPE {metric} gauge'.format(metric=metric))
+        for label_value, values in sorted(stats.items()):
+            if key in values:
+                lines.append('{metric}{{{label}="{value}"}} {stat}'.format(
+                    metric=metric, label=label, value=label_value, stat=values[key]))
+
+    return '\n'.join(lines) + '\n'
+
+
+stage_metrics = StageMetrics()
@@ -8,6 +8,15 @@ urlpatterns = patterns('',
 
     url(r'^robots.txt$', views.robots, name='robots'),
 
+    url(r'^(?:(?P<directives>[^/]+)/)?sitemap\.xml$', views.sitemap, name='sitemap'),
+
+    url(r'^(?:(?P<directives>[^/]+)/)?sitemap_(?P<shard>\d+)\.xml\.gz$', views.sitemap_shard,
+        name='sitemap_shard'),
+
+    url(r'^metrics$', views.metrics, name='metrics'),
+
+    url(r'^_batch$', views.batch, name='batch'),
+
     url(r'^(?P<url>.*)/$', views.handle, name='handle'),
 
     url(r'^$', views.index, name='index'),
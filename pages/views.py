@@ -3,44 +3,254 @@
 # Licensed under the Apache License, Version 2.0 (the "License");
 # you may not use this file except in compliance with the License.
 
+import errno
+import glob
+import hashlib
 import logging
-import tldextract
+import os
+import time
 
-from django.shortcuts import render
+from collections import OrderedDict
+from collections import namedtuple
+
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+from django.http import StreamingHttpResponse
 from django.conf import settings
+from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from analytics import EventQueue
+from analytics import KeenSink
+from analytics import LocalSink
+from batch import ndjson_chunks
+from batch import parse_json
+from batch import parse_lines
+from delays import delay_limiter
+from delays import delay_response
+from delays import make_pacing
+from delays import pace_response
+from delays import pacing_limiter
+from conditional import changing_etag
+from conditional import is_not_modified
+from conditional import page_etag
+from filler import padded_body
+from filler import padded_length
+from referrers import ReferrerDomains
+from renderer import load_template
+from renderer import load_template_source
+from source import source_modified
+from source import source_version
+from static_pages import static_page
+from static_pages import static_response
+from timing import StageTimer
+from timing import format_stats
+from timing import stage_metrics
+
+from crawlbin.core.cache import LRUCache
+from crawlbin.core.compression import encode
+from crawlbin.core.compression import encoded_etag
+from crawlbin.core.compression import gzip_stream
+from crawlbin.core.compression import negotiate
+from crawlbin.core.compression import negotiation_cache
+from crawlbin.core.page import evaluate_plan
+from crawlbin.core.page import split_path
+from crawlbin.core.shared_cache import SharedCache
+from crawlbin.core.sitemap import compile_sitemap
+from crawlbin.core.sitemap import sitemap_index
+from crawlbin.core.sitemap import urlset
+from crawlbin.core.url import compile_url_path
+from crawlbin.core.url import plan_cache
+from crawlbin.core.user_agent import classify_user_agent
+from crawlbin.core.user_agent import user_agent_cache
 
-from helpers_directive import canonical_directives
-from helpers_directive import delay_directives
-from helpers_directive import h1_directive
-from helpers_directive import title_tag_directive
-from helpers_directive import handle_redirect
-from helpers_directive import index_follow_directives
-from helpers_directive import vary_directives
-from helpers_url import get_directives_from_random_matching_block
+logger = logging.getLogger('crawlbin.pages.views')
 
-from keen.client import KeenClient
-from keen import scoped_keys
 
-logger = logging.getLogger('crawlbin.pages.views')
+def keen_client():
+    """ Make the Keen client. Keen is imported here, rather than when
+    crawlbin starts, as it's slow to import and only the analytics
+    thread needs it.
+
+    """
+
+    from keen.client import KeenClient
 
-keen = KeenClient(
-    project_id=settings.KEEN_PROJECT_ID,
-    write_key=settings.KEEN_WRITE_KEY,
-    read_key=settings.KEEN_READ_KEY,
-    master_key=settings.KEEN_MASTER_KEY,
+    return KeenClient(
+        project_id=settings.KEEN_PROJECT_ID,
+        write_key=settings.KEEN_WRITE_KEY,
+        read_key=settings.KEEN_READ_KEY,
+        master_key=settings.KEEN_MASTER_KEY,
+    )
+
+
+if settings.CRAWLBIN_ANALYTICS_SINK is None:
+    analytics_sink = None
+elif settings.CRAWLBIN_ANALYTICS_SINK == 'local':
+    analytics_sink = LocalSink()
+else:
+    analytics_sink = KeenSink(keen_client)
+
+analytics = EventQueue(
+    analytics_sink,
+    max_size=settings.CRAWLBIN_ANALYTICS_QUEUE_SIZE,
+    batch_size=settings.CRAWLBIN_ANALYTICS_BATCH_SIZE,
+    flush_interval=settings.CRAWLBIN_ANALYTICS_FLUSH_INTERVAL,
 )
 
-scoped_write_key = scoped_keys.encrypt(settings.KEEN_MASTER_KEY, {"allowed_operations": ["write"]})
-keeniod_url = "https://api.keen.io/3.0/projects/"+settings.KEEN_PROJECT_ID+\
-"/events/distilled_link_clicked?api_key="+scoped_write_key+"&data=e30=&redirect="
+referrer_domains = ReferrerDomains(settings.CRAWLBIN_REFERRER_CACHE_SIZE)
 
+_keeniod_url = None
 
-def index(request):
-    """ Render the crawlbin index page.
+
+def scoped_write_key():
+    """ A Keen scoped key that can only write events: the
+    KEEN_SCOPED_WRITE_KEY setting, or else one made from the master key.
+
+    """
+
+    if settings.KEEN_SCOPED_WRITE_KEY:
+        return settings.KEEN_SCOPED_WRITE_KEY
+
+    from keen import scoped_keys
+
+    return scoped_keys.encrypt(settings.KEEN_MASTER_KEY, {"allowed_operations": ["write"]})
+
+
+def keeniod_url():
+    """ The Keen URL that records a click on the Distilled link before
+    redirecting. Making its scoped write key needs Keen and an
+    encryption, so it's made when it's first needed.
+
+    """
+
+    global _keeniod_url
+
+    if _keeniod_url is None:
+        _keeniod_url = "https://api.keen.io/3.0/projects/"+settings.KEEN_PROJECT_ID+\
+        "/events/distilled_link_clicked?api_key="+scoped_write_key()+"&data=e30=&redirect="
+
+    return _keeniod_url
+
+
+class Page(namedtuple('Page', ['content', 'status_code', 'headers', 'directives', 'delay',
+                               'server_timing', 'size', 'chunked', 'pacing', 'encoding',
+                               'encoding_mode'])):
+    """ A crawlbin page, along with what's needed to send it. content is
+    None until the page has been rendered.
+
+    """
+
+    __slots__ = ()
+
+    @property
+    def streamed(self):
+        return bool(self.size or self.chunked or self.pacing)
+
+# The directive page compiled for the fast renderer, or None to render
+# it with Django.
+page_template = None
+if settings.CRAWLBIN_FAST_RENDERER:
+    page_template = load_template("pages/template.html")
+
+# Pages without a random element only change with crawlbin's source, so
+# were last modified when it was. Every worker agrees on that.
+source_mtime = source_modified()
+last_modified = http_date(source_mtime)
+sitemap_lastmod = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(source_mtime))
+
+# ETags change whenever the directive page template does, or the
+# Last-Modified date it renders along with the other headers.
+etag_salt = hashlib.sha1(
+    load_template_source("pages/template.html").encode('utf-8') + last_modified).digest()
+
+# Pages without any random element, or seeded, keyed on host, scheme, path,
+# user agent categories and X-Crawlbin-Seed.
+response_cache = LRUCache(
+    max_size=settings.CRAWLBIN_RESPONSE_CACHE_SIZE,
+    max_bytes=settings.CRAWLBIN_RESPONSE_CACHE_MAX_BYTES,
+    sizeof=lambda page: len(page.content),
+)
+
+# The compressed bodies of cached pages, keyed on the response cache key,
+# encoding and encoding mode.
+encoded_cache = LRUCache(
+    max_size=settings.CRAWLBIN_ENCODED_CACHE_SIZE,
+    max_bytes=settings.CRAWLBIN_ENCODED_CACHE_MAX_BYTES,
+)
+
+# Most bytes an entry of each shared cache can take pickled. Plans and
+# user agents take a few hundred, and pages a couple of KB before their
+# links_<n> directive adds to them.
+SHARED_PLAN_SLOT_SIZE = 1024
+SHARED_USER_AGENT_SLOT_SIZE = 1024
+SHARED_RESPONSE_SLOT_SIZE = 8192
+
+
+def share_caches(directory):
+    """ Back the plan, user agent and response caches with SharedCaches
+    in directory, which every worker on the host using it shares.
+
+    The files are named for the source_version() and the cache sizes,
+    so workers running other code or settings never see these entries,
+    and those for other versions or sizes are removed.
+
+    """
+
+    version = source_version()
+
+    for name, cache, max_size, slot_size in [
+            ('plans', plan_cache, settings.CRAWLBIN_SHARED_PLAN_CACHE_SIZE,
+             SHARED_PLAN_SLOT_SIZE),
+            ('user_agents', user_agent_cache, settings.CRAWLBIN_SHARED_USER_AGENT_CACHE_SIZE,
+             SHARED_USER_AGENT_SLOT_SIZE),
+            ('responses', response_cache, settings.CRAWLBIN_SHARED_RESPONSE_CACHE_SIZE,
+             SHARED_RESPONSE_SLOT_SIZE)]:
+        path = os.path.join(directory, '%s-%s-%dx%d.cache' % (name, version, max_size,
+                                                               slot_size))
+
+        for stale in glob.glob(os.path.join(directory, '%s-*.cache' % name)):
+            if stale != path:
+                # Workers still running the old code keep their mapping.
+                try:
+                    os.remove(stale)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+
+        cache.shared = SharedCache(path, max_size, slot_size)
+        logger.info('Sharing the %s cache through %s', name, path)
+
+
+def finish_timing(response, view, timer, server_timing=False):
+    """ Record the stage timings of a request and, if asked for by the
+    server_timing directive or the setting, send them back in a
+    Server-Timing header.
 
     """
-    keen.add_event("visit",
-        {'page': 'index.html',
+
+    stage_metrics.record(view, timer)
+
+    if server_timing or settings.CRAWLBIN_SERVER_TIMING:
+        response['Server-Timing'] = timer.server_timing()
+
+
+def add_visit(request, page):
+    """ Queue a visit event for page, with where the visitor came from.
+    Nothing is worked out if analytics are off.
+
+    """
+
+    if not analytics.enabled:
+        return
+
+    referer = request.META.get('HTTP_REFERER', '/')
+    analytics.add_event("visit",
+        {'page': page,
         "ip_address": "${keen.ip}",
             "keen": {
             "addons": [{
@@ -50,131 +260,437 @@ def index(request):
                 }]
             },
         "user_agent": "${keen.user_agent}",
-        "referral_domain": '.'.join(tldextract.extract(request.META.get('HTTP_REFERER', '/'))[1:]),
-        "referral_url": request.META.get('HTTP_REFERER', '/')})
-    return render(request, 'pages/index.html', {'keeniod_url': keeniod_url})
+        "referral_domain": referrer_domains.domain(referer),
+        "referral_url": referer})
+
+
+def index_page():
+    return static_page('pages/index.html', 'text/html; charset=utf-8',
+                       {'keeniod_url': keeniod_url()})
+
+
+def robots_page():
+    return static_page('pages/robots.txt', 'text/plain; charset=UTF-8')
+
+
+def index(request):
+    """ Render the crawlbin index page. It's the same for everyone, so
+    is only rendered once (see pages.static_pages).
+
+    """
+    timer = StageTimer()
+    add_visit(request, 'index.html')
+    timer.lap('analytics')
+
+    response = static_response(request, index_page())
+    timer.lap('render')
+
+    finish_timing(response, 'index', timer)
+    return response
 
 
 def robots(request):
-    """ Render the crawlbin robots.txt.
+    """ Render the crawlbin robots.txt, once (see pages.static_pages).
+
+    """
+
+    timer = StageTimer()
+
+    response = static_response(request, robots_page())
+    timer.lap('render')
+
+    analytics.add_event("visit", {'page': 'robots.txt'})
+    timer.lap('analytics')
+
+    finish_timing(response, 'robots', timer)
+    return response
+
+
+def sitemap(request, directives=None):
+    """ Render the sitemap index for the sitemap with directives, e.g.
+    site_1+links_20 for a synthetic site (see crawlbin.core.sitemap).
 
     """
 
-    response = render(request, "pages/robots.txt", )
-    response['Content-Type'] = "text/plain; charset=UTF-8"
-    keen.add_event("visit", {'page': 'robots.txt'})
+    timer = StageTimer()
+
+    prefix = '{scheme}://{host}/'.format(scheme=request.scheme, host=request.get_host())
+    if directives:
+        prefix += directives + '/'
+
+    shards = compile_sitemap(directives.split('+') if directives else []).shards()
+    content = sitemap_index(['%ssitemap_%d.xml.gz' % (prefix, shard)
+                             for shard in range(1, shards + 1)], sitemap_lastmod)
+    response = HttpResponse(content, content_type='application/xml; charset=utf-8')
+    timer.lap('render')
+
+    analytics.add_event("visit", {'page': request.path[1:]})
+    timer.lap('analytics')
+
+    finish_timing(response, 'sitemap', timer)
     return response
 
 
-def handle(request, url):
-    """ Render all crawlbin urls.
+def sitemap_shard(request, shard, directives=None):
+    """ Stream a gzipped shard of the sitemap with directives.
 
     """
 
-    url_parts = url.split("/")
-    last_part = url_parts[-1]
-    previous_parts = url_parts[:-1]
-    directives = get_directives_from_random_matching_block(
-        last_part,
-        user_agent=request.META['HTTP_USER_AGENT']
-    )
+    timer = StageTimer()
 
-    base_url = '{scheme}://{host}'.format(
-        scheme=request.scheme,
-        host=request.get_host()
-    )
-    current_url = '{base}{path}'.format(
-        base=base_url,
-        path=request.path
-    )
+    sitemap = compile_sitemap(directives.split('+') if directives else [])
+    shard = int(shard)
+    if not 1 <= shard <= sitemap.shards():
+        raise Http404('No sitemap shard %d' % shard)
 
-    # Avoid ending up with 2 trailing slashes for empty paths
-    path = '/'.join(pp for pp in previous_parts)
-    if path:
-        previous_parts_url = '{base}/{path}/'.format(base=base_url, path=path)
-    else:
-        previous_parts_url = '{base}/'.format(base=base_url)
-
-    context = {
-        'url': url,
-        'previous_parts_url': previous_parts_url,
-        'directives': directives
-    }
-    headers = {}
-
-    # handle h1 directives
-    h1_context, h1_headers = h1_directive(directives)
-    context.update(h1_context)
-    headers.update(h1_headers)
-
-    # handle title_tag directives
-    title_tag_context, title_tag_headers = title_tag_directive(directives)
-    context.update(title_tag_context)
-    headers.update(title_tag_headers)
-
-    # handle index_follow directives
-    index_follow_context, index_follow_headers = index_follow_directives(
-        directives
-    )
-    context.update(index_follow_context)
-    headers.update(index_follow_headers)
-
-    # handle canonical directives
-    canonical_context, canonical_headers = canonical_directives(
-        directives,
-        base_url,
-        current_url,
-        previous_parts_url
-    )
-    context.update(canonical_context)
-    headers.update(canonical_headers)
+    base_url = '{scheme}://{host}'.format(scheme=request.scheme, host=request.get_host())
+    response = StreamingHttpResponse(gzip_stream(urlset(sitemap, shard, base_url,
+                                                        sitemap_lastmod)),
+                                     content_type='application/x-gzip')
+    timer.lap('render')
+
+    analytics.add_event("visit", {'page': request.path[1:]})
+    timer.lap('analytics')
+
+    finish_timing(response, 'sitemap_shard', timer)
+    return response
 
-    # handle vary directives
-    vary_context, vary_headers = vary_directives(directives)
-    context.update(vary_context)
-    headers.update(vary_headers)
 
-    # handle delay directives
-    delay_context, delay_headers = delay_directives(directives)
-    context.update(delay_context)
-    headers.update(delay_headers)
+def metrics(request):
+    """ Serve the stage timings and cache, analytics and delay stats in the
+    Prometheus text format.
 
-    # for debug/output purposes
-    context.update({'headers': headers})
+    """
+
+    content = ''.join([
+        stage_metrics.render(),
+        format_stats('crawlbin_cache', 'cache', {
+            'plan': plan_cache.stats(),
+            'user_agent': user_agent_cache.stats(),
+            'response': response_cache.stats(),
+            'encoded': encoded_cache.stats(),
+            'negotiation': negotiation_cache.stats(),
+            'referrer': referrer_domains.cache.stats(),
+        }, 'Crawlbin cache stats'),
+        format_stats('crawlbin_analytics', 'queue', {
+            'events': analytics.stats(),
+        }, 'Analytics queue stats'),
+        format_stats('crawlbin_delays', 'limiter', {
+            'delays': delay_limiter.stats(),
+            'pacing': pacing_limiter.stats(),
+        }, 'Delayed and paced response stats'),
+    ])
+
+    return HttpResponse(content, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def request_seed(request):
+    """ The seed given in a request's X-Crawlbin-Seed header, or None if
+    there isn't one or it isn't a whole number.
+
+    """
+
+    seed = request.META.get('HTTP_X_CRAWLBIN_SEED')
+    if seed is None:
+        return None
+
+    try:
+        return int(seed)
+    except ValueError:
+        logger.info('Ignoring X-Crawlbin-Seed: %r', seed)
+        return None
+
+
+def evaluate_page(scheme, host, path, url, plan, ua_mask, seed=None):
+    """ Evaluate the directives for a crawlbin url (see
+    crawlbin.core.page.evaluate_plan).
+
+    Validators are added to the headers here, before rendering, so
+    revalidating crawlers can be answered without rendering anything.
+
+    """
+
+    base_url = '{scheme}://{host}'.format(scheme=scheme, host=host)
+    evaluation = evaluate_plan(url, plan, ua_mask, base_url, path, seed)
+    directives = evaluation.directives
+
+    context = evaluation.context
+    headers = evaluation.headers
+
+    # The page only depends on the url, the directives that were picked
+    # and the seed for anything random in them, so those identify it.
+    # Seeded pages even change their changing ETag the same way each time.
+    etag = context['etag']
+    if etag == 'changing':
+        headers['ETag'] = changing_etag(evaluation.rng)
+    elif etag == 'weak' or evaluation.cacheable:
+        parts = [scheme, host, path] + list(directives)
+        if context['seed'] is not None:
+            parts.append(str(context['seed']))
+        headers['ETag'] = page_etag(etag_salt, parts, weak=etag == 'weak')
+    if evaluation.cacheable:
+        headers['Last-Modified'] = last_modified
+
+    # Seeded by the header rather than a seed_<n> directive.
+    if seed is not None and plan.seed is None:
+        add_vary(headers, 'X-Crawlbin-Seed')
+
+    return evaluation
+
+
+def add_vary(headers, header):
+    """ Add header to the Vary header in headers. """
+
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = header
+    elif header not in vary:
+        headers['Vary'] = vary + ', ' + header
+
+
+def build_page(evaluation):
+    """ Build the Page for an evaluation, ready to be rendered with
+    render_page().
+
+    """
 
-    response_context, response_headers, status_code = handle_redirect(
-        directives,
-        previous_parts_url
+    context = evaluation.context
+
+    page = Page(
+        content=None,
+        status_code=evaluation.status_code,
+        headers=evaluation.headers,
+        directives=evaluation.directives,
+        delay=context.get('delay'),
+        server_timing=context['server_timing'],
+        size=context['size'],
+        chunked=context['chunked'],
+        pacing=make_pacing(context['ttfb'], context['throttle'], context['drip']),
+        encoding=context['encoding'],
+        encoding_mode=context['encoding_mode'],
     )
-    context.update(response_context)
-    headers.update(response_headers)
 
-    context['keeniod_url'] = keeniod_url
+    # A negotiated encoding depends on the Accept-Encoding header.
+    if settings.CRAWLBIN_COMPRESSION and page.encoding is None and not page.streamed:
+        add_vary(page.headers, 'Accept-Encoding')
+
+    return page
+
+
+def render_page(request, context):
+    """ Render the directive page, returning the bytes. """
+
+    # Only added here, so evaluating pages without rendering them, for
+    # batches and crawlbin_eval, doesn't need Keen.
+    context['keeniod_url'] = keeniod_url()
+
+    if page_template is not None:
+        return page_template.render(context)
 
-    response = render(
-        request,
+    return render_to_string(
         "pages/template.html",
         context,
-        status=status_code
-    )
+        context_instance=RequestContext(request)
+    ).encode('utf-8')
+
+
+def response_encoding(request, page):
+    """ The Content-Encoding to send a page with: the one its directives
+    ask for, or the best the client accepts. None sends it as is, as
+    are streamed pages.
+
+    """
+
+    if page.streamed or page.encoding == 'identity':
+        return None
+
+    if page.encoding is not None:
+        return page.encoding
+
+    if settings.CRAWLBIN_COMPRESSION:
+        return negotiate(request.META.get('HTTP_ACCEPT_ENCODING'))
+
+    return None
+
+
+def not_modified(request, page, encoding):
+    """ Whether to send a 304, either for the response_304 directive or
+    because the crawler already has the page in this encoding.
+
+    """
+
+    if page.status_code == 304:
+        return True
+
+    if page.status_code != 200:
+        return False
+
+    etag = page.headers.get('ETag')
+    if etag and encoding:
+        etag = encoded_etag(etag, encoding)
 
-    for header_key, header_val in headers.iteritems():
+    return is_not_modified(request, etag, page.headers.get('Last-Modified'))
+
+
+def encoded_content(page, encoding, cache_key=None):
+    """ The page's content encoded for sending. Encodings of cacheable
+    pages, those with a cache_key, are cached.
+
+    """
+
+    if cache_key is None:
+        return encode(page.content, encoding, page.encoding_mode)
+
+    return encoded_cache.get_or_create(
+        (cache_key, encoding, page.encoding_mode),
+        lambda key: encode(page.content, encoding, page.encoding_mode))
+
+
+def handle(request, url):
+    """ Render all crawlbin urls.
+
+    Pages that will always be the same for this host, path and category
+    of user agent are cached, so only the first request renders them.
+    Seeded pages, by a seed_<n> directive or an X-Crawlbin-Seed header,
+    are always the same, so are cached too.
+    Conditional requests for a page the crawler already has get a 304,
+    without the page being rendered.
+
+    """
+
+    timer = StageTimer()
+
+    last_part = url.split("/")[-1]
+    plan = compile_url_path(last_part)
+    timer.lap('parse')
+
+    ua_mask = classify_user_agent(request.META['HTTP_USER_AGENT'])
+    timer.lap('ua')
+
+    # A seed_<n> directive overrides the header, so key on the seed used.
+    seed = request_seed(request)
+    applied_seed = plan.seed if plan.seed is not None else seed
+    cache_key = (request.get_host(), request.scheme, request.path, ua_mask, applied_seed)
+    page = response_cache.get(cache_key)
+    cacheable = page is not None
+    timer.lap('cache')
+
+    if page is None:
+        evaluation = evaluate_page(request.scheme, request.get_host(), request.path, url, plan,
+                                   ua_mask, seed)
+        page = build_page(evaluation)
+        cacheable = evaluation.cacheable
+        timer.lap('evaluate')
+
+    encoding = response_encoding(request, page)
+
+    if not_modified(request, page, encoding):
+        # No body is sent, so there's nothing to render.
+        response = HttpResponseNotModified()
+    else:
+        if page.content is None:
+            page = page._replace(content=render_page(request, evaluation.context))
+            timer.lap('render')
+            if cacheable:
+                response_cache.set(cache_key, page)
+
+        if page.streamed:
+            # Large and paced bodies are generated as they are sent
+            # rather than held in memory, and without a Content-Length
+            # the server chunks them.
+            response = StreamingHttpResponse(padded_body(page.content, page.size),
+                                             status=page.status_code)
+            if not page.chunked:
+                response['Content-Length'] = str(padded_length(page.content, page.size))
+        elif encoding is not None:
+            response = HttpResponse(
+                encoded_content(page, encoding, cache_key if cacheable else None),
+                status=page.status_code)
+            response['Content-Encoding'] = encoding
+            timer.lap('encode')
+        else:
+            response = HttpResponse(page.content, status=page.status_code)
+
+    for header_key, header_val in page.headers.iteritems():
         response[header_key] = header_val
 
-    keen.add_event("crawlbin", {'directives': context['directives'],
-        'headers': context['headers']})
-    keen.add_event("visit",
-        {'page': url,
-        "ip_address": "${keen.ip}",
-            "keen": {
-            "addons": [{
-                "name": "keen:ip_to_geo",
-                "input": {"ip": "ip_address"},
-                "output":"ip_geo_info"
-                }]
-            },
-        "user_agent": "${keen.user_agent}",
-        "referral_domain": '.'.join(tldextract.extract(request.META.get('HTTP_REFERER', '/'))[1:]),
-        "referral_url": request.META.get('HTTP_REFERER', '/')})
+    if encoding is not None and 'ETag' in page.headers:
+        response['ETag'] = encoded_etag(page.headers['ETag'], encoding)
+
+    analytics.add_event("crawlbin", {'directives': page.directives,
+        'headers': page.headers})
+    add_visit(request, url)
+    timer.lap('analytics')
+
+    if page.delay:
+        # The delay happens after the view returns, so it is recorded
+        # rather than timed.
+        timer.add('delay', page.delay)
+        response = delay_response(request, response, page.delay)
+
+    # A refused delay leaves a 503, which isn't paced.
+    if page.pacing and response.streaming:
+        response = pace_response(request, response, page.pacing)
+
+    finish_timing(response, 'handle', timer, page.server_timing)
 
     return response
+
+
+def batch_outcome(entry, scheme, host):
+    """ What handle would send for a batch entry requested from scheme and
+    host, without rendering it.
+
+    """
+
+    outcome = OrderedDict([('index', entry.index)])
+    if entry.error is not None:
+        outcome['error'] = entry.error
+        return outcome
+
+    try:
+        path, url = split_path(entry.path)
+        plan = compile_url_path(url.split("/")[-1])
+    except (ValueError, SyntaxError) as e:
+        # SyntaxError is for unbalanced or too deeply nested brackets.
+        outcome['error'] = str(e)
+        return outcome
+
+    ua_mask = classify_user_agent(entry.user_agent)
+    evaluation = evaluate_page(scheme, host, path, url, plan, ua_mask, entry.seed)
+    page = build_page(evaluation)
+
+    outcome.update([
+        ('path', path),
+        ('user_agent', entry.user_agent),
+        ('seed', evaluation.context['seed']),
+        ('directives', list(page.directives)),
+        ('unknown_directives', evaluation.unknown),
+        ('status_code', page.status_code),
+        ('headers', page.headers),
+        ('cacheable', evaluation.cacheable),
+    ])
+    return outcome
+
+
+@csrf_exempt
+@require_POST
+def batch(request):
+    """ Evaluate a batch of paths and user agents, a JSON array or one per
+    line (see pages.batch), and stream back what crawlbin would send for each
+    as NDJSON: the directives picked, status code and headers. Nothing is
+    rendered and no analytics are sent.
+
+    """
+
+    content_type = request.META.get('CONTENT_TYPE', '').split(';')[0].strip()
+    if content_type == 'application/json':
+        entries = parse_json(request.body)
+    else:
+        # Django reads a line at a time slowly, and the body is in memory
+        # already.
+        entries = parse_lines(request.body.splitlines())
+
+    scheme, host = request.scheme, request.get_host()
+    outcomes = (batch_outcome(entry, scheme, host) for entry in entries)
+    return StreamingHttpResponse(ndjson_chunks(outcomes), content_type='application/x-ndjson')
@@ -0,0 +1,125 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Warming up a worker before it takes requests.
+
+Much of what crawlbin needs is loaded on first use: ua-parser's regular
+expressions, compiled URL plans, the index page, Django's URL resolver
+and middleware, and the public suffix list. Left alone, the first
+requests to a fresh worker pay for all of it. warm_up() does it in
+advance. crawlbin.wsgi calls it as the application is loaded: in each
+worker, or once before forking with runcrawlbin --preload.
+
+Directive pages are evaluated and rendered only to load the code they
+use. They aren't put in the response cache, which is keyed on the host
+the request came to, so the first request for each page still renders
+it.
+
+"""
+
+import logging
+import timeit
+
+from django.conf import settings
+from django.core.urlresolvers import Resolver404
+from django.core.urlresolvers import get_resolver
+
+from dispatch import directive_url
+
+from crawlbin.core.url import compile_url_path
+from crawlbin.core.user_agent import classify_user_agent
+
+logger = logging.getLogger('crawlbin.pages.warmup')
+
+# User agents most requests come from.
+COMMON_USER_AGENTS = (
+    'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 8_3 like Mac OS X) AppleWebKit/600.1.4 '
+    '(KHTML, like Gecko) Version/8.0 Mobile/12F70 Safari/600.1.4 '
+    '(compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+    'Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:35.0) Gecko/20100101 Firefox/35.0',
+    'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+    'Chrome/41.0.2272.101 Safari/537.36',
+    'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; Trident/6.0)',
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 8_1 like Mac OS X) AppleWebKit/600.1.4 '
+    '(KHTML, like Gecko) Version/8.0 Mobile/12B411 Safari/600.1.4',
+)
+
+# Paths that between them use every kind of directive.
+COMMON_PATHS = (
+    '/meta_noindex/',
+    '/[meta_noindex][response_404][canonical_self+vary_cookie]/',
+    '/[meta_index+[vary_cookie,vary_referer]][h1_off+[response_301,response_302]]/',
+    '/[googlebot:response_404][mobile:canonical_home][all:vary_user_agent]/',
+    '/a/b/header_nofollow+random_title+etag_weak+server_timing+delay_ms_0+size_1kb/',
+    '/site_0+links_10+sitemap_malformed_1/',
+)
+
+
+def _read_paths(path):
+    with open(path) as path_file:
+        return [line.strip() for line in path_file
+                if line.strip() and not line.startswith('#')]
+
+
+def warm_up(application=None):
+    """Load everything the first requests would otherwise wait for, but
+    for the directive pages themselves.
+
+    application is the WSGI handler, whose middleware is loaded too.
+    Paths in the file CRAWLBIN_PATH_WARM_FILE, one per line, are warmed
+    as well as COMMON_PATHS. Lines that aren't directive page paths,
+    such as /meta_noindex/, are logged and skipped.
+
+    """
+
+    # Imported here as the views load most of crawlbin.
+    import views
+
+    start = timeit.default_timer()
+
+    if application is not None and getattr(application, '_request_middleware', 0) is None:
+        application.load_middleware()
+
+    for user_agent in COMMON_USER_AGENTS:
+        classify_user_agent(user_agent)
+
+    paths = list(COMMON_PATHS)
+    if settings.CRAWLBIN_PATH_WARM_FILE:
+        paths.extend(_read_paths(settings.CRAWLBIN_PATH_WARM_FILE))
+
+    resolver = get_resolver(None)
+    resolver.resolve('/')
+    resolver.resolve('/robots.txt')
+
+    for path in paths:
+        # A bad line in the warm file is skipped rather than stopping
+        # the worker from starting.
+        url = directive_url(path)
+        try:
+            if url is None:
+                raise ValueError('not a directive page path')
+            resolver.resolve(path)
+            plan = compile_url_path(url.split('/')[-1])
+        except (Resolver404, ValueError, SyntaxError) as e:
+            logger.warning('Not warming up %r: %s', path, e)
+            continue
+
+        # Evaluating and rendering the pages loads the directives' and
+        # the template's code paths. The pages themselves are dropped.
+        ua_mask = classify_user_agent(COMMON_USER_AGENTS[0])
+        evaluation = views.evaluate_page('http', 'crawlbin.com', path, url, plan, ua_mask)
+        if views.page_template is not None:
+            views.render_page(None, evaluation.context)
+
+    views.index_page()
+    views.robots_page()
+
+    if views.analytics.enabled:
+        views.referrer_domains.load()
+
+    logger.info('Warmed up in %.0fms', (timeit.default_timer() - start) * 1000)
@@ -0,0 +1,168 @@
+# Copyright 2015 Distilled
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+
+"""
+Pre-forked worker processes sharing one listening socket.
+
+The master process binds the socket and forks the workers, each of which
+accepts connections on it from its own event loop. The master only
+supervises: it replaces workers that die, and on SIGHUP starts a fresh
+set of workers before gracefully stopping the old ones, so a reload
+never refuses a connection. SIGTERM or SIGINT stop every worker
+gracefully, and then the master.
+
+Workers are forked, not started afresh, so a reload only picks up
+changes to code the master hasn't imported. runcrawlbin's master has
+imported the settings, pages.server, pages.eventloop, pages.delays and
+this module, but not the application, which each worker loads itself
+unless runcrawlbin is given --preload. A change to anything else needs
+a restart.
+
+"""
+
+import errno
+import logging
+import os
+import signal
+import time
+
+logger = logging.getLogger('crawlbin.pages.workers')
+
+# How often the master checks on its workers, in seconds.
+SUPERVISE_INTERVAL = 0.5
+
+
+class WorkerPool(object):
+    """Run serve(sock) in size forked worker processes.
+
+    serve is called in the child after the fork, and should serve
+    connections on sock until the worker receives SIGTERM, then finish
+    the responses in progress and return.
+
+    """
+
+    def __init__(self, sock, serve, size, graceful_timeout=30):
+        self.sock = sock
+        self.serve = serve
+        self.size = size
+        self.graceful_timeout = graceful_timeout
+
+        self.workers = set()
+        # Workers from before a reload, which are finishing their responses.
+        self.retiring = set()
+
+        self._reload = False
+        self._stopping = False
+
+    def run(self):
+        """Supervise the workers until told to stop."""
+
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        try:
+            while not self._stopping:
+                self._reap()
+
+                if self._reload:
+                    self._reload = False
+                    self._retire()
+
+                while len(self.workers) < self.size and not self._stopping:
+                    self._spawn()
+
+                time.sleep(SUPERVISE_INTERVAL)
+        finally:
+            self._stop()
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+
+        # In the worker. The master decides when workers stop, so ignore
+        # the SIGINT a terminal sends to the whole process group.
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        status = 0
+        try:
+            self.serve(self.sock)
+        except Exception:
+            logger.exception('Worker %d failed', os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _retire(self):
+        """Replace every worker, stopping the old ones gracefully once
+        the new ones are running.
+
+        """
+
+        old = self.workers
+        self.workers = set()
+        for _ in range(self.size):
+            self._spawn()
+
+        logger.info('Reloading, retiring workers %s', sorted(old))
+        self._signal(old, signal.SIGTERM)
+        self.retiring |= old
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.args[0] == errno.ECHILD:
+                    return
+                raise
+
+            if not pid:
+                return
+
+            if pid in self.workers:
+                logger.warning('Worker %d exited with status %d, replacing it', pid, status)
+            self.workers.discard(pid)
+            self.retiring.discard(pid)
+
+    def _signal(self, pids, signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                if e.args[0] != errno.ESRCH:
+                    raise
+
+    def _stop(self):
+        """Stop every worker gracefully, killing any that are still
+        running after the graceful timeout.
+
+        """
+
+        self.retiring |= self.workers
+        self.workers = set()
+        self._signal(self.retiring, signal.SIGTERM)
+
+        deadline = time.time() + self.graceful_timeout
+        while self.retiring and time.time() < deadline:
+            self._reap()
+            time.sleep(0.1)
+
+        if self.retiring:
+            logger.warning('Killing workers %s', sorted(self.retiring))
+            self._signal(self.retiring, signal.SIGKILL)
+            while self.retiring:
+                pid, status = os.waitpid(-1, 0)
+                self.retiring.discard(pid)